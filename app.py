@@ -1,7 +1,10 @@
+import time
 import streamlit as st
 import pandas as pd
 import streamlit.components.v1 as components
 from google_sheets_auth import get_google_sheets_client
+from sheet_sync import sync_worksheet, snapshot_path, frame_path, SheetFrameCache
+from cache_manager import register_cache, named_lru_cache, cache_stats
 from database import (
     init_database,
     create_or_update_reconciliation,
@@ -14,10 +17,25 @@ from database import (
     archive_order,
     get_all_archived_orders,
     get_archived_order,
-    delete_archived_order
+    delete_archived_order,
+    get_asn_imeis,
+    get_asn_imei_counts,
+    get_asn_imei_sheet_counts,
+    get_reconciliation_status,
+    unit_of_work,
+    enqueue_upload_job,
+    get_upload_jobs,
+    delete_upload_job,
+    JOB_QUEUED,
+    JOB_RUNNING,
+    JOB_DONE,
+    JOB_FAILED
 )
 from datetime import datetime
-from imei_extractor import extract_imeis_from_file, format_imeis_for_display
+from imei_extractor import extract_imeis_cached, split_valid_imeis, format_imeis_for_display
+from imei_matcher import match_imeis, is_fully_matched, discrepancy_report
+from bulk_upload import process_bulk_upload, STATUS_SAVED
+from job_queue import JobQueue, JOB_KIND_ASN, JOB_KIND_IMEI_SERIAL
 
 # Page configuration
 st.set_page_config(
@@ -220,25 +238,30 @@ st.markdown("""
         }
     }
 
-    /* Tabs */
-    .stTabs [data-baseweb="tab-list"] {
+    /* View navigation (horizontal radio styled as tabs) */
+    .st-key-active_view [role="radiogroup"] {
         gap: 8px;
         background-color: transparent;
     }
 
-    .stTabs [data-baseweb="tab"] {
+    .st-key-active_view [role="radiogroup"] label {
         background-color: white;
         border-radius: 8px;
         padding: 1rem 2rem;
         font-weight: 600;
         border: 2px solid var(--border-color);
+        margin-right: 0;
     }
 
-    .stTabs [data-baseweb="tab"]:hover {
+    .st-key-active_view [role="radiogroup"] label > div:first-child {
+        display: none;
+    }
+
+    .st-key-active_view [role="radiogroup"] label:hover {
         background-color: var(--bg-color);
     }
 
-    .stTabs [aria-selected="true"] {
+    .st-key-active_view [role="radiogroup"] label:has(input:checked) {
         background-color: var(--primary-color);
         color: white;
         border-color: var(--primary-color);
@@ -386,15 +409,42 @@ st.markdown("""
 SHEET_ID = "1Jz7HV0Jjad6NVvlomUdydjysaCTJcA-CUu7cVacMwFg"
 WORKSHEET_GID = "1072853082"
 
-@st.cache_data(ttl=300)
-def load_data_from_sheets():
-    """Load data from Google Sheets"""
+def build_invoice_index(df):
+    """
+    Pre-group the sheet by invoice so views never scan the full sheet per order
+
+    Returns: dict with
+        'summary': DataFrame indexed by INVOICE with QTY and MODELS columns
+        'rows': dict mapping each invoice to the positions of its rows in df
+    """
+    grouped = df.groupby('INVOICE', sort=False)
+    summary = grouped.agg(QTY=('QTY', 'sum'), MODELS=('MODEL', 'nunique'))
+    return {'summary': summary, 'rows': grouped.indices}
+
+def get_order_rows(df, invoice_index, invoice):
+    """Get the sheet rows for one invoice by position instead of a column comparison"""
+    rows = invoice_index['rows'].get(invoice)
+    if rows is None:
+        return df.iloc[0:0]
+    return df.iloc[rows]
+
+def fetch_sheet_dataframe(full=False):
+    """
+    Fetch the order sheet from Google Sheets and parse it into a DataFrame
+
+    Runs on a background thread, so it must not call Streamlit APIs. full=True
+    re-reads the whole worksheet instead of syncing the snapshot incrementally.
+
+    Returns: tuple (DataFrame, error message if any)
+    """
     try:
         client = get_google_sheets_client()
         spreadsheet = client.open_by_key(SHEET_ID)
 
         worksheet = spreadsheet.get_worksheet_by_id(int(WORKSHEET_GID))
-        all_values = worksheet.get_all_values()
+        # Only the header, the tail and the INVOICE column are read when a local snapshot exists
+        all_values, _ = sync_worksheet(worksheet, snapshot_path(SHEET_ID, WORKSHEET_GID),
+                                       key_column='INVOICE', full=full)
 
         if len(all_values) < 3:
             return None, "Not enough rows in the spreadsheet"
@@ -440,6 +490,99 @@ def load_data_from_sheets():
     except Exception as e:
         return None, str(e)
 
+@st.cache_resource
+def get_sheet_cache():
+    """Sheet data shared by every session; persisted to disk for fast cold starts"""
+    return register_cache('sheet_data', SheetFrameCache(
+        fetch_sheet_dataframe,
+        frame_path(SHEET_ID, WORKSHEET_GID),
+        max_age_seconds=300,
+        prepare=build_invoice_index
+    ))
+
+@st.cache_resource
+def get_job_queue():
+    """Background upload workers, started once per server process"""
+    return JobQueue().start()
+
+def queue_upload(kind, invoice, uploaded_file):
+    """Queue an uploaded file for background processing; returns the job id or None"""
+    uploaded_file.seek(0)
+    job_id = enqueue_upload_job(kind, invoice, uploaded_file.name, uploaded_file.read())
+    if job_id is not None:
+        get_job_queue().notify()
+    return job_id
+
+JOB_LABELS = {JOB_KIND_ASN: "ASN", JOB_KIND_IMEI_SERIAL: "IMEI/Serial"}
+
+# Finished jobs stay on screen this long (seconds)
+JOB_RESULT_DISPLAY_SECONDS = 300
+
+def show_upload_job(job):
+    """One status line for an upload job"""
+    label = f"{JOB_LABELS.get(job.kind, job.kind)} {job.filename}"
+    if job.status == JOB_QUEUED:
+        st.info(f"⏳ {label} is queued")
+    elif job.status == JOB_RUNNING:
+        st.progress(job.progress or 0.0, text=f"⚙️ Processing {label}...")
+    elif job.status == JOB_FAILED:
+        st.error(f"❌ {label} failed: {job.error}")
+    elif job.status == JOB_DONE:
+        st.success(f"✅ {label}: {job.result}")
+
+@st.fragment(run_every=2)
+def poll_upload_jobs(invoice):
+    """Refresh job status every 2 seconds; rerun the page once every job has finished"""
+    jobs = get_upload_jobs(invoice)
+    if not any(job.status in (JOB_QUEUED, JOB_RUNNING) for job in jobs):
+        st.rerun()
+    for job in jobs:
+        show_upload_job(job)
+
+def render_upload_jobs(invoice, key_prefix):
+    """Status of an order's background uploads: live while running, then the outcome"""
+    jobs = get_upload_jobs(invoice)
+    if any(job.status in (JOB_QUEUED, JOB_RUNNING) for job in jobs):
+        poll_upload_jobs(invoice)
+        return
+    now = datetime.utcnow()
+    for job in jobs:
+        if job.status == JOB_FAILED or (job.finished_at and (now - job.finished_at).total_seconds() < JOB_RESULT_DISPLAY_SECONDS):
+            show_upload_job(job)
+            if job.status == JOB_FAILED and st.button("Dismiss", key=f"{key_prefix}_dismiss_job_{job.id}"):
+                delete_upload_job(job.id)
+                st.rerun()
+
+def load_data_from_sheets():
+    """
+    Load data from Google Sheets
+
+    Serves the last good copy immediately; stale data is refreshed in the background.
+
+    Returns: tuple (DataFrame, per-invoice index from build_invoice_index, error message if any)
+    """
+    return get_sheet_cache().get()
+
+def load_reconciliations():
+    """
+    Reconciliation records for every order, without file contents
+
+    Returns: dict invoice -> OrderReconciliation
+    """
+    return {r.invoice: r for r in get_all_reconciliations()}
+
+def render_data_freshness():
+    """Show when the sheet data was fetched and whether a refresh is running"""
+    cache = get_sheet_cache()
+    if cache.as_of is None:
+        return
+    caption = f"Sheet data as of {cache.as_of.strftime('%Y-%m-%d %H:%M:%S')} UTC"
+    if cache.refreshing:
+        caption += " · refreshing in background…"
+    elif cache.error:
+        caption += f" · last refresh failed: {cache.error}"
+    st.caption(caption)
+
 def clean_model_name(model):
     """Clean model name by removing 'IPHONE' prefix"""
     if pd.isna(model):
@@ -471,490 +614,885 @@ def process_selected_orders(df, selected_invoices):
 
     return model_gb_output, model_only_output, grade_mix_output
 
+def _breakdowns_size(breakdowns):
+    return sum(int(df.memory_usage(deep=True).sum()) for df in breakdowns if df is not None)
+
+def get_invoice_breakdowns(order_df, invoice):
+    """
+    process_selected_orders for a single invoice, cached per sheet snapshot
+
+    Keyed by the snapshot's 'as of' time, so a sheet refresh makes old entries
+    unreachable without clearing anything else.
+    """
+    cache = named_lru_cache('invoice_breakdowns', 16, _breakdowns_size)
+    key = (invoice, get_sheet_cache().as_of)
+    breakdowns = cache.get(key)
+    if breakdowns is None:
+        breakdowns = process_selected_orders(order_df, [invoice])
+        cache.put(key, breakdowns)
+    return breakdowns
+
 def get_table_text(df):
     """Convert dataframe to tab-separated text for copying"""
     return df.to_csv(sep='\t', index=False)
 
-def main():
-    # Header with logo
-    st.image("assets/logo.png", width=400)
-
-    # Initialize database
-    init_database()
+def load_asn_imeis(invoice, recon):
+    """
+    Get an invoice's ASN IMEIs, from the asn_imei table when it holds all of them
+
+    The index is trusted only when its row count matches recon.asn_imei_count,
+    recorded when the ASN was indexed. ASNs stored before the count existed or
+    that could not be parsed, and any index that disagrees with its count, fall
+    back to parsing the stored file (cached by content hash).
+
+    Returns: tuple (list of IMEIs, total count, error message if any)
+    """
+    if recon and recon.asn_imei_count:
+        imeis = get_asn_imeis(invoice)
+        if len(imeis) == recon.asn_imei_count:
+            return imeis, len(imeis), None
+    if recon and recon.asn_uploaded and recon.asn_file_data:
+        return extract_imeis_cached(recon.asn_file_data, recon.asn_filename)
+    return [], 0, None
+
+def render_bulk_upload(invoices):
+    """Bulk ASN upload: many files or ZIP archives, each matched to an order and parsed in parallel"""
+    with st.expander("📦 Bulk ASN Upload", expanded='bulk_upload_report' in st.session_state):
+        st.caption("Upload several ASN files or ZIP archives. Each file is matched to an order by the invoice number in its name, or by an invoice column inside it.")
+
+        report = st.session_state.get('bulk_upload_report')
+        if report is not None:
+            saved = sum(1 for row in report if row['STATUS'] == STATUS_SAVED)
+            if saved == len(report):
+                st.success(f"✅ Saved {saved} ASN files")
+            else:
+                st.warning(f"⚠️ Saved {saved} of {len(report)} files; see the details below")
+            report_df = pd.DataFrame(report)
+            st.dataframe(report_df, hide_index=True, use_container_width=True)
+            col1, col2 = st.columns(2)
+            with col1:
+                st.download_button("⬇️ Download Report", report_df.to_csv(index=False), "bulk_upload_report.csv", "text/csv", key="dl_bulk_report", use_container_width=True)
+            with col2:
+                if st.button("Done", key="bulk_upload_done", use_container_width=True):
+                    st.session_state.pop('bulk_upload_report', None)
+                    # New uploader key so the saved files are cleared from it
+                    st.session_state['bulk_upload_round'] = st.session_state.get('bulk_upload_round', 0) + 1
+                    st.rerun()
+            return
 
-    # Navigation tabs - professional styling
-    tab1, tab2, tab3 = st.tabs(["Dashboard", "Order Details", "Archived"])
+        files = st.file_uploader("Choose ASN files", type=['xlsx', 'xls', 'csv', 'txt', 'zip'], accept_multiple_files=True, key=f"bulk_asn_files_{st.session_state.get('bulk_upload_round', 0)}")
+        if files and st.button(f"💾 Save {len(files)} files", key="bulk_asn_save", type="primary"):
+            progress_bar = st.progress(0.0, text="Parsing ASN files...")
+            report = process_bulk_upload(
+                [(uploaded.name, uploaded.getvalue()) for uploaded in files],
+                invoices,
+                progress=lambda fraction, message: progress_bar.progress(min(fraction, 1.0), text=message)
+            )
+            progress_bar.empty()
+            # Keep the report across the rerun that refreshes order statuses
+            st.session_state['bulk_upload_report'] = report
+            st.rerun()
+
+def render_dashboard():
+    """Dashboard view: stats, recent orders with quick upload, bulk upload"""
+    st.markdown("## Overview")
+
+    # Load data in background
+    df, invoice_index, error = load_data_from_sheets()
+
+    if error:
+        st.error(f"❌ Failed to load data: {error}")
+    else:
+        recon_dict = load_reconciliations()
+
+        # Calculate real-time stats from Google Sheets
+        if df is not None and not df.empty:
+            unique_invoices = df['INVOICE'].unique()
+            total_qty = df['QTY'].sum()
+
+            # Count orders with ASN and IMEI in the database, limited to this sheet's invoices
+            stats = get_order_statistics(unique_invoices.tolist())
+            orders_with_asn = stats['with_asn']
+            orders_with_imei = stats['with_imei']
+            pending_orders = len(unique_invoices) - orders_with_asn
+
+            # Stats row
+            col1, col2, col3, col4 = st.columns(4)
 
-    # TAB 1: Dashboard
-    with tab1:
-        st.markdown("## Overview")
+            with col1:
+                st.markdown(f"""
+                <div class="stat-card">
+                    <h3>Total Orders</h3>
+                    <p class="value">{len(unique_invoices)}</p>
+                </div>
+                """, unsafe_allow_html=True)
 
-        # Load data in background
-        df, error = load_data_from_sheets()
+            with col2:
+                st.markdown(f"""
+                <div class="stat-card">
+                    <h3>Total Units</h3>
+                    <p class="value">{total_qty:,}</p>
+                </div>
+                """, unsafe_allow_html=True)
 
-        if error:
-            st.error(f"❌ Failed to load data: {error}")
-        else:
-            # Get statistics
-            stats = get_order_statistics()
-            reconciliations = get_all_reconciliations()
+            with col3:
+                st.markdown(f"""
+                <div class="stat-card">
+                    <h3>With ASN</h3>
+                    <p class="value">{orders_with_asn}</p>
+                </div>
+                """, unsafe_allow_html=True)
 
-            # Create reconciliation lookup
-            recon_dict = {r.invoice: r for r in reconciliations}
+            with col4:
+                st.markdown(f"""
+                <div class="stat-card">
+                    <h3>With IMEI/Serial</h3>
+                    <p class="value">{orders_with_imei}</p>
+                </div>
+                """, unsafe_allow_html=True)
 
-            # Calculate real-time stats from Google Sheets
-            if df is not None and not df.empty:
-                unique_invoices = df['INVOICE'].unique()
-                total_qty = df['QTY'].sum()
+            st.markdown("---")
 
-                # Count orders with ASN and IMEI
-                orders_with_asn = sum(1 for inv in unique_invoices if recon_dict.get(inv) and recon_dict[inv].asn_uploaded)
-                orders_with_imei = sum(1 for inv in unique_invoices if recon_dict.get(inv) and recon_dict[inv].imei_serial_uploaded)
-                pending_orders = len(unique_invoices) - orders_with_asn
+            # Recent Orders Section
+            st.markdown("### Recent Orders")
 
-                # Stats row
-                col1, col2, col3, col4 = st.columns(4)
+            # Add headers
+            header_col1, header_col2, header_col3, header_col4 = st.columns([2.5, 1.5, 1.8, 0.9])
+            with header_col1:
+                st.markdown("**ORDER**")
+            with header_col2:
+                st.markdown("**UNITS**")
+            with header_col3:
+                st.markdown("**STATUS**")
+            with header_col4:
+                st.markdown("**UPLOAD**")
 
-                with col1:
-                    st.markdown(f"""
-                    <div class="stat-card">
-                        <h3>Total Orders</h3>
-                        <p class="value">{len(unique_invoices)}</p>
-                    </div>
-                    """, unsafe_allow_html=True)
+            st.markdown("---")
 
-                with col2:
-                    st.markdown(f"""
-                    <div class="stat-card">
-                        <h3>Total Units</h3>
-                        <p class="value">{total_qty:,}</p>
-                    </div>
-                    """, unsafe_allow_html=True)
+            # Show recent 10 orders
+            recent_invoices = sorted(unique_invoices, reverse=True)[:10]
 
-                with col3:
-                    st.markdown(f"""
-                    <div class="stat-card">
-                        <h3>With ASN</h3>
-                        <p class="value">{orders_with_asn}</p>
-                    </div>
-                    """, unsafe_allow_html=True)
+            for invoice in recent_invoices:
+                recon = recon_dict.get(invoice)
+                order_qty = invoice_index['summary'].at[invoice, 'QTY']
 
-                with col4:
-                    st.markdown(f"""
-                    <div class="stat-card">
-                        <h3>With IMEI/Serial</h3>
-                        <p class="value">{orders_with_imei}</p>
-                    </div>
-                    """, unsafe_allow_html=True)
+                # Determine status
+                has_asn = recon and recon.asn_uploaded
+                has_imei = recon and recon.imei_serial_uploaded
 
-                st.markdown("---")
+                if has_asn and has_imei:
+                    status_class = "status-complete"
+                    status_text = "✅ Complete"
+                elif has_asn:
+                    status_class = "status-partial"
+                    status_text = "⚠️ ASN Only"
+                else:
+                    status_class = "status-pending"
+                    status_text = "📋 Pending"
 
-                # Recent Orders Section
-                st.markdown("### Recent Orders")
+                col1, col2, col3, col4 = st.columns([2.5, 1.5, 1.8, 0.9])
 
-                # Add headers
-                header_col1, header_col2, header_col3, header_col4 = st.columns([2.5, 1.5, 1.8, 0.9])
-                with header_col1:
-                    st.markdown("**ORDER**")
-                with header_col2:
-                    st.markdown("**UNITS**")
-                with header_col3:
-                    st.markdown("**STATUS**")
-                with header_col4:
-                    st.markdown("**UPLOAD**")
+                with col1:
+                    st.markdown(f"**{invoice}**")
+                with col2:
+                    st.markdown(f"**{order_qty:,} units**")
+                with col3:
+                    st.markdown(f'<span class="status-badge {status_class}">{status_text}</span>', unsafe_allow_html=True)
+                with col4:
+                    if st.button("📤", key=f"upload_{invoice}", use_container_width=True, help="Upload files"):
+                        st.session_state['upload_order'] = invoice
+                        st.rerun()
 
+            # Upload File Modal
+            if 'upload_order' in st.session_state and st.session_state['upload_order']:
                 st.markdown("---")
+                st.markdown(f"### 📤 Upload Files for Order: {st.session_state['upload_order']}")
 
-                # Show recent 10 orders
-                recent_invoices = sorted(unique_invoices, reverse=True)[:10]
+                upload_invoice = st.session_state['upload_order']
+                # Load this one record with its files; the listing has none
+                upload_recon = get_reconciliation_status(upload_invoice)
 
-                for invoice in recent_invoices:
-                    recon = recon_dict.get(invoice)
-                    order_df = df[df['INVOICE'] == invoice]
-                    order_qty = order_df['QTY'].sum()
-
-                    # Determine status
-                    has_asn = recon and recon.asn_uploaded
-                    has_imei = recon and recon.imei_serial_uploaded
+                col1, col2 = st.columns(2)
 
-                    if has_asn and has_imei:
-                        status_class = "status-complete"
-                        status_text = "✅ Complete"
-                    elif has_asn:
-                        status_class = "status-partial"
-                        status_text = "⚠️ ASN Only"
+                with col1:
+                    st.markdown("#### 📄 ASN File")
+                    has_asn = upload_recon and upload_recon.asn_uploaded
+
+                    if has_asn:
+                        st.success(f"✅ Uploaded: {upload_recon.asn_filename}")
+                        if st.button("🗑️ Remove ASN", key=f"remove_asn_{upload_invoice}"):
+                            if clear_asn_data(upload_invoice):
+                                st.success("ASN removed!")
+                                st.rerun()
                     else:
-                        status_class = "status-pending"
-                        status_text = "📋 Pending"
-
-                    col1, col2, col3, col4 = st.columns([2.5, 1.5, 1.8, 0.9])
-
-                    with col1:
-                        st.markdown(f"**{invoice}**")
-                    with col2:
-                        st.markdown(f"**{order_qty:,} units**")
-                    with col3:
-                        st.markdown(f'<span class="status-badge {status_class}">{status_text}</span>', unsafe_allow_html=True)
-                    with col4:
-                        if st.button("📤", key=f"upload_{invoice}", use_container_width=True, help="Upload files"):
-                            st.session_state['upload_order'] = invoice
-                            st.rerun()
-
-                # Upload File Modal
-                if 'upload_order' in st.session_state and st.session_state['upload_order']:
-                    st.markdown("---")
-                    st.markdown(f"### 📤 Upload Files for Order: {st.session_state['upload_order']}")
+                        asn_file = st.file_uploader("Choose ASN file", key=f"quick_asn_{upload_invoice}", type=['xlsx', 'xls', 'csv', 'txt'])
+                        if asn_file:
+                            if st.button("✅ Confirm Upload", key=f"confirm_asn_{upload_invoice}", type="primary"):
+                                # Parsed and indexed in the background; status shows below
+                                if queue_upload(JOB_KIND_ASN, upload_invoice, asn_file):
+                                    st.rerun()
+                                else:
+                                    st.error("❌ Failed to queue upload")
 
-                    upload_invoice = st.session_state['upload_order']
-                    upload_recon = recon_dict.get(upload_invoice)
+                    render_upload_jobs(upload_invoice, "quick")
 
-                    col1, col2 = st.columns(2)
+                with col2:
+                    st.markdown("#### Extracted IMEIs")
 
-                    with col1:
-                        st.markdown("#### 📄 ASN File")
-                        has_asn = upload_recon and upload_recon.asn_uploaded
+                    # Extract IMEIs from ASN file if available
+                    if has_asn and upload_recon.asn_file_data:
+                        imeis, count, error = load_asn_imeis(upload_invoice, upload_recon)
 
-                        if has_asn:
-                            st.success(f"✅ Uploaded: {upload_recon.asn_filename}")
-                            if st.button("🗑️ Remove ASN", key=f"remove_asn_{upload_invoice}"):
-                                if clear_asn_data(upload_invoice):
-                                    st.success("ASN removed!")
-                                    st.rerun()
+                        if error:
+                            st.error(f"⚠️ {error}")
+                        elif imeis:
+                            st.success(f"✅ Found {count} IMEIs")
+                            imei_text = format_imeis_for_display(imeis)
+                            st.text_area(
+                                "Copy IMEIs:",
+                                value=imei_text,
+                                height=200,
+                                key=f"quick_imei_display_{upload_invoice}"
+                            )
                         else:
-                            asn_file = st.file_uploader("Choose ASN file", key=f"quick_asn_{upload_invoice}", type=['xlsx', 'xls', 'csv', 'txt'])
-                            if asn_file:
-                                if st.button("✅ Confirm Upload", key=f"confirm_asn_{upload_invoice}", type="primary"):
-                                    asn_file.seek(0)
-                                    asn_data = asn_file.read()
-                                    create_or_update_reconciliation(
-                                        invoice=upload_invoice,
-                                        asn_uploaded=True,
-                                        asn_filename=asn_file.name,
-                                        asn_file_data=asn_data,
-                                        asn_upload_date=datetime.utcnow()
-                                    )
-                                    st.success("✅ ASN uploaded successfully!")
-                                    st.session_state.pop('upload_order', None)
-                                    st.rerun()
+                            st.warning("⚠️ No IMEIs found")
+                    else:
+                        st.info("📄 Upload ASN file first")
 
-                    with col2:
-                        st.markdown("#### Extracted IMEIs")
-
-                        # Extract IMEIs from ASN file if available
-                        if has_asn and upload_recon.asn_file_data:
-                            imeis, count, error = extract_imeis_from_file(upload_recon.asn_file_data, upload_recon.asn_filename)
-
-                            if error:
-                                st.error(f"⚠️ {error}")
-                            elif imeis:
-                                st.success(f"✅ Found {count} IMEIs")
-                                imei_text = format_imeis_for_display(imeis)
-                                st.text_area(
-                                    "Copy IMEIs:",
-                                    value=imei_text,
-                                    height=200,
-                                    key=f"quick_imei_display_{upload_invoice}"
-                                )
-                            else:
-                                st.warning("⚠️ No IMEIs found")
-                        else:
-                            st.info("📄 Upload ASN file first")
+                # Close button
+                st.markdown("---")
+                if st.button("❌ Close Upload", use_container_width=False):
+                    st.session_state.pop('upload_order', None)
+                    st.rerun()
 
-                    # Close button
-                    st.markdown("---")
-                    if st.button("❌ Close Upload", use_container_width=False):
-                        st.session_state.pop('upload_order', None)
-                        st.rerun()
+            st.markdown("---")
+            render_bulk_upload(unique_invoices.tolist())
 
-                # Refresh button with stats
-                st.markdown("---")
-                col1, col2, col3 = st.columns([2, 1, 2])
-                with col2:
-                    if st.button("🔄 Refresh Data", use_container_width=True, type="primary"):
-                        st.cache_data.clear()
-                        st.rerun()
+            # Refresh button with stats
+            st.markdown("---")
+            col1, col2, col3 = st.columns([2, 1, 2])
+            with col2:
+                if st.button("🔄 Refresh Data", use_container_width=True, type="primary"):
+                    # Only the sheet data is refetched (in full, so it also repairs any
+                    # drift in the snapshot); other caches stay warm
+                    get_sheet_cache().refresh(full=True)
+                    st.rerun()
 
-                # Show refresh stats after button
-                st.info(f"📊 Loaded **{len(unique_invoices)} orders** with **{total_qty:,} total units** from Google Sheets")
+            # Show refresh stats after button
+            st.info(f"📊 Loaded **{len(unique_invoices)} orders** with **{total_qty:,} total units** from Google Sheets")
+            render_data_freshness()
 
-            else:
-                st.warning("No data available")
+        else:
+            st.warning("No data available")
+
+def render_order_details():
+    """Order Details view: grid of order cards, or one order's files and IMEI match"""
+    st.markdown("## Order Details")
+
+    df, invoice_index, error = load_data_from_sheets()
+
+    if error or df is None or df.empty:
+        st.error("Failed to load orders")
+        return
+
+    render_data_freshness()
+
+    all_invoices = sorted(df['INVOICE'].unique().tolist(), reverse=True)
+    recon_dict = load_reconciliations()
+
+    # Check database connection
+    engine = get_database_engine()
+    if engine is None:
+        st.error("⚠️ **DATABASE NOT CONNECTED!**")
+        st.warning("Files cannot be saved without database. Check DATABASE_URL in Railway settings.")
+        st.info("Go to Railway → Your Project → PostgreSQL → Connect → Copy DATABASE_URL → Add to your web service variables")
+
+    # Debug toggle
+    if st.checkbox("🐛 Show Debug Info", key="debug_toggle"):
+        import os
+        db_url = os.environ.get('DATABASE_URL', 'NOT SET')
+        st.write(f"**Database URL:** {db_url[:50]}... (truncated)" if db_url != 'NOT SET' else "**Database URL:** NOT SET")
+        st.write(f"**Database Engine:** {'✅ Connected' if engine else '❌ Not Connected'}")
+        st.write(f"**Total Records:** {len(recon_dict)}")
+        st.write("**Caches:**", cache_stats())
+        st.write("**Last rerun by view:**", st.session_state.get('rerun_stats', {}))
+        if recon_dict:
+            st.write("**Sample Records:**")
+            for r in list(recon_dict.values())[:3]:
+                st.write(f"- {r.invoice}: ASN={r.asn_uploaded}, File={r.asn_filename or 'none'}")
+
+    # Initialize selected order
+    if 'selected_order_card' not in st.session_state:
+        st.session_state['selected_order_card'] = None
+
+    # Detail view for selected order
+    if st.session_state['selected_order_card']:
+        selected_invoice = st.session_state['selected_order_card']
+
+        if st.button("← Back to All Orders", key="back_to_grid"):
+            st.session_state['selected_order_card'] = None
+            st.rerun()
 
-    # TAB 2: Order Details - Grid Card View
-    with tab2:
-        st.markdown("## Order Details")
+        st.markdown("---")
 
-        df, error = load_data_from_sheets()
+        # Only the selected order's files are fetched from the database
+        recon = get_reconciliation_status(selected_invoice) if selected_invoice in recon_dict else None
+        order_df = get_order_rows(df, invoice_index, selected_invoice)
+        order_qty = order_df['QTY'].sum()
+        unique_models = order_df['MODEL'].nunique()
+        has_asn = recon and recon.asn_uploaded
+        has_imei = recon and recon.imei_serial_uploaded
 
-        if error or df is None or df.empty:
-            st.error("Failed to load orders")
-            return
+        # IMEIs were indexed when the ASN was stored; no file parsing here
+        if has_asn and recon.asn_file_data:
+            asn_imeis, asn_imei_count, asn_error = load_asn_imeis(selected_invoice, recon)
+        else:
+            asn_imeis, asn_imei_count, asn_error = [], 0, None
 
-        all_invoices = sorted(df['INVOICE'].unique().tolist(), reverse=True)
-        reconciliations = get_all_reconciliations()
-        recon_dict = {r.invoice: r for r in reconciliations}
-
-        # Check database connection
-        engine = get_database_engine()
-        if engine is None:
-            st.error("⚠️ **DATABASE NOT CONNECTED!**")
-            st.warning("Files cannot be saved without database. Check DATABASE_URL in Railway settings.")
-            st.info("Go to Railway → Your Project → PostgreSQL → Connect → Copy DATABASE_URL → Add to your web service variables")
-
-        # Debug toggle
-        if st.checkbox("🐛 Show Debug Info", key="debug_toggle"):
-            import os
-            db_url = os.environ.get('DATABASE_URL', 'NOT SET')
-            st.write(f"**Database URL:** {db_url[:50]}... (truncated)" if db_url != 'NOT SET' else "**Database URL:** NOT SET")
-            st.write(f"**Database Engine:** {'✅ Connected' if engine else '❌ Not Connected'}")
-            st.write(f"**Total Records:** {len(reconciliations)}")
-            if reconciliations:
-                st.write("**Sample Records:**")
-                for r in reconciliations[:3]:
-                    st.write(f"- {r.invoice}: ASN={r.asn_uploaded}, File Size={len(r.asn_file_data) if r.asn_file_data else 0} bytes")
-
-        # Initialize selected order
-        if 'selected_order_card' not in st.session_state:
-            st.session_state['selected_order_card'] = None
+        # Serials failing the Luhn check digit are mistyped or misread; they don't count toward the ASN
+        asn_imeis, asn_invalid_imeis = split_valid_imeis(asn_imeis)
+        asn_imei_count = len(asn_imeis)
 
-        # Detail view for selected order
-        if st.session_state['selected_order_card']:
-            selected_invoice = st.session_state['selected_order_card']
+        # Professional header - no emojis
+        st.markdown(f"### {selected_invoice}")
 
-            if st.button("← Back to All Orders", key="back_to_grid"):
+        # ASN Status badge - clean professional style
+        if has_asn:
+            st.markdown('<span style="display: inline-block; padding: 0.25rem 0.75rem; border-radius: 4px; font-size: 0.75rem; font-weight: 600; background: #E8F5E9; color: #2E7D32; text-transform: uppercase; letter-spacing: 0.5px;">ASN Uploaded</span>', unsafe_allow_html=True)
+        else:
+            st.markdown('<span style="display: inline-block; padding: 0.25rem 0.75rem; border-radius: 4px; font-size: 0.75rem; font-weight: 600; background: #FFF3E0; color: #E65100; text-transform: uppercase; letter-spacing: 0.5px;">No ASN</span>', unsafe_allow_html=True)
+
+        # Archive button - minimal professional style
+        st.markdown(f"""
+        <style>
+        /* Professional Archive button styling */
+        button[data-testid="baseButton-primary"][aria-label*="Archive"] {{
+            display: inline-block !important;
+            padding: 0.4rem 1rem !important;
+            border-radius: 4px !important;
+            font-size: 0.75rem !important;
+            font-weight: 600 !important;
+            background: white !important;
+            color: #424242 !important;
+            border: 1px solid #E0E0E0 !important;
+            transition: all 0.2s !important;
+            min-height: auto !important;
+            height: auto !important;
+            text-transform: uppercase !important;
+            letter-spacing: 0.5px !important;
+            box-shadow: 0 1px 2px rgba(0,0,0,0.05) !important;
+        }}
+        button[data-testid="baseButton-primary"][aria-label*="Archive"]:hover {{
+            background: #FAFAFA !important;
+            border-color: #BDBDBD !important;
+            box-shadow: 0 2px 4px rgba(0,0,0,0.1) !important;
+        }}
+        </style>
+        """, unsafe_allow_html=True)
+
+        if st.button("Archive Order", key=f"archive_{selected_invoice}", type="primary"):
+            # Prepare order data for archiving
+            order_data_list = order_df.to_dict('records')
+            archived_id = archive_order(
+                invoice=selected_invoice,
+                order_data=order_data_list,
+                total_qty=order_qty,
+                unique_models=unique_models,
+                notes=recon.notes if recon else None
+            )
+            if archived_id:
+                st.success("✅ Order archived!")
                 st.session_state['selected_order_card'] = None
                 st.rerun()
+            else:
+                st.error("❌ Failed to archive")
 
-            st.markdown("---")
+        st.markdown("---")
 
-            recon = recon_dict.get(selected_invoice)
-            order_df = df[df['INVOICE'] == selected_invoice]
-            order_qty = order_df['QTY'].sum()
-            unique_models = order_df['MODEL'].nunique()
-            has_asn = recon and recon.asn_uploaded
-            has_imei = recon and recon.imei_serial_uploaded
+        # Metrics and Order Details Side by Side
+        col1, col2 = st.columns([1.5, 3.5])
 
-            # Professional header - no emojis
-            st.markdown(f"### {selected_invoice}")
+        with col1:
+            # Compact square metrics
+            st.markdown("### Summary")
 
-            # ASN Status badge - clean professional style
-            if has_asn:
-                st.markdown('<span style="display: inline-block; padding: 0.25rem 0.75rem; border-radius: 4px; font-size: 0.75rem; font-weight: 600; background: #E8F5E9; color: #2E7D32; text-transform: uppercase; letter-spacing: 0.5px;">ASN Uploaded</span>', unsafe_allow_html=True)
+            # IMEI Comparison: ON ASN vs EXPECTED
+            on_asn_count = asn_imei_count
+
+            expected_count = order_qty
+
+            # Determine color based on match
+            if on_asn_count == expected_count:
+                border_color = "#06D6A0"  # Green - match
+                status_icon = "✅"
+            elif on_asn_count > 0:
+                border_color = "#F18F01"  # Orange - partial
+                status_icon = "⚠️"
             else:
-                st.markdown('<span style="display: inline-block; padding: 0.25rem 0.75rem; border-radius: 4px; font-size: 0.75rem; font-weight: 600; background: #FFF3E0; color: #E65100; text-transform: uppercase; letter-spacing: 0.5px;">No ASN</span>', unsafe_allow_html=True)
+                border_color = "#C73E1D"  # Red - missing
+                status_icon = "❌"
 
-            # Archive button - minimal professional style
+            # Bigger square cards
             st.markdown(f"""
-            <style>
-            /* Professional Archive button styling */
-            button[data-testid="baseButton-primary"][aria-label*="Archive"] {{
-                display: inline-block !important;
-                padding: 0.4rem 1rem !important;
-                border-radius: 4px !important;
-                font-size: 0.75rem !important;
-                font-weight: 600 !important;
-                background: white !important;
-                color: #424242 !important;
-                border: 1px solid #E0E0E0 !important;
-                transition: all 0.2s !important;
-                min-height: auto !important;
-                height: auto !important;
-                text-transform: uppercase !important;
-                letter-spacing: 0.5px !important;
-                box-shadow: 0 1px 2px rgba(0,0,0,0.05) !important;
-            }}
-            button[data-testid="baseButton-primary"][aria-label*="Archive"]:hover {{
-                background: #FAFAFA !important;
-                border-color: #BDBDBD !important;
-                box-shadow: 0 2px 4px rgba(0,0,0,0.1) !important;
-            }}
-            </style>
+            <div style="background: white; padding: 0.8rem; border-radius: 8px; margin-bottom: 0.5rem; border-left: 4px solid #2E86AB; min-height: 70px;">
+                <p style="color: #6C757D; margin: 0; font-size: 0.75rem;">Total Units</p>
+                <p style="font-size: 1.8rem; font-weight: 700; margin: 0;">{order_qty:,}</p>
+            </div>
+
+            <div style="background: white; padding: 0.8rem; border-radius: 8px; margin-bottom: 0.5rem; border-left: 4px solid #A23B72; min-height: 70px;">
+                <p style="color: #6C757D; margin: 0; font-size: 0.75rem;">Models</p>
+                <p style="font-size: 1.8rem; font-weight: 700; margin: 0;">{unique_models}</p>
+            </div>
+
+            <div style="background: white; padding: 0.8rem; border-radius: 8px; border-left: 4px solid {border_color}; min-height: 90px;">
+                <p style="color: #6C757D; margin: 0 0 0.4rem 0; font-size: 0.75rem;">{status_icon} Compare</p>
+                <div style="display: flex; justify-content: space-between; margin-bottom: 0.3rem;">
+                    <span style="font-size: 0.75rem; color: #6C757D;">ASN QTY:</span>
+                    <span style="font-size: 1.3rem; font-weight: 700;">{on_asn_count}</span>
+                </div>
+                <div style="display: flex; justify-content: space-between;">
+                    <span style="font-size: 0.75rem; color: #6C757D;">EXPECTED QTY:</span>
+                    <span style="font-size: 1.3rem; font-weight: 700;">{expected_count}</span>
+                </div>
+            </div>
             """, unsafe_allow_html=True)
 
-            if st.button("Archive Order", key=f"archive_{selected_invoice}", type="primary"):
-                # Prepare order data for archiving
-                order_data_list = order_df.to_dict('records')
-                result = archive_order(
-                    invoice=selected_invoice,
-                    order_data=order_data_list,
-                    total_qty=order_qty,
-                    unique_models=unique_models,
-                    notes=recon.notes if recon else None
+        with col2:
+            # Compact Order Details Card with proper column widths
+            st.markdown("### Expected Order Details")
+
+            # Define columns to display in order
+            display_columns = ['INVOICE', 'MODEL', 'CAPACITY', 'COLOR', 'LOCKED', 'GRADE', 'UNIT', 'TOTAL', 'QTY', 'STATUS', 'SUPPLIER', 'FALLOUT RATE']
+
+            # Filter to only columns that exist in the dataframe
+            available_columns = [col for col in display_columns if col in order_df.columns]
+
+            # Configure column widths with specific pixel values for tighter spacing
+            column_config = {
+                "INVOICE": st.column_config.TextColumn("INVOICE", width=100),
+                "MODEL": st.column_config.TextColumn("MODEL", width=150),
+                "CAPACITY": st.column_config.TextColumn("CAPACITY", width=80),
+                "COLOR": st.column_config.TextColumn("COLOR", width=80),
+                "LOCKED": st.column_config.TextColumn("LOCKED", width=70),
+                "GRADE": st.column_config.TextColumn("GRADE", width=70),
+                "UNIT": st.column_config.TextColumn("UNIT", width=60),
+                "TOTAL": st.column_config.NumberColumn("TOTAL", width=70),
+                "QTY": st.column_config.NumberColumn("QTY", width=60),
+                "STATUS": st.column_config.TextColumn("STATUS", width=80),
+                "SUPPLIER": st.column_config.TextColumn("SUPPLIER", width=100),
+                "FALLOUT RATE": st.column_config.TextColumn("FALLOUT RATE", width=90)
+            }
+
+            st.dataframe(
+                order_df[available_columns] if available_columns else order_df,
+                hide_index=True,
+                use_container_width=True,
+                height=250,
+                column_config=column_config
+            )
+
+        st.markdown("---")
+
+        # Process breakdowns for this order
+        model_gb_output, model_only_output, grade_mix_output = get_invoice_breakdowns(order_df, selected_invoice)
+
+        # Professional breakdowns section - no emojis
+        st.markdown("### Breakdowns")
+        st.caption(f"{len(model_gb_output) + len(model_only_output) + len(grade_mix_output)} total items")
+
+        # Model + GB Breakdown - Expanded by default
+        with st.expander(f"MODEL + GB BREAKDOWN ({len(model_gb_output)} items)", expanded=True):
+            if model_gb_output is not None and not model_gb_output.empty:
+                # Copy button - minimal style
+                if st.button("Copy", key=f"copy_model_gb_{selected_invoice}", help="Copy to clipboard"):
+                    table_text = get_table_text(model_gb_output)
+                    st.code(table_text, language=None)
+                    st.success("✓ Copied! Select the text above and copy with Ctrl+C (Cmd+C on Mac)")
+
+                config_model_gb = {
+                    "MODEL_GB": st.column_config.TextColumn("MODEL + GB", width=200),
+                    "QTY": st.column_config.NumberColumn("QTY", width=80)
+                }
+                st.dataframe(
+                    model_gb_output,
+                    hide_index=True,
+                    use_container_width=False,
+                    height=min(300, len(model_gb_output) * 35 + 50),
+                    column_config=config_model_gb
                 )
-                if result:
-                    st.success("✅ Order archived!")
-                    st.session_state['selected_order_card'] = None
-                    st.rerun()
-                else:
-                    st.error("❌ Failed to archive")
+            else:
+                st.info("No data available")
+
+        # Model + Qty Breakdown
+        with st.expander(f"MODEL + QTY BREAKDOWN ({len(model_only_output)} items)", expanded=False):
+            if model_only_output is not None and not model_only_output.empty:
+                # Copy button
+                if st.button("Copy", key=f"copy_model_only_{selected_invoice}", help="Copy to clipboard"):
+                    table_text = get_table_text(model_only_output)
+                    st.code(table_text, language=None)
+                    st.success("✓ Copied! Select the text above and copy with Ctrl+C (Cmd+C on Mac)")
+
+                config_model = {
+                    "MODEL": st.column_config.TextColumn("MODEL", width=200),
+                    "QTY": st.column_config.NumberColumn("QTY", width=80)
+                }
+                st.dataframe(
+                    model_only_output,
+                    hide_index=True,
+                    use_container_width=False,
+                    height=min(300, len(model_only_output) * 35 + 50),
+                    column_config=config_model
+                )
+            else:
+                st.info("No data available")
+
+        # Grade Breakdown
+        with st.expander(f"GRADE BREAKDOWN ({len(grade_mix_output)} items)", expanded=False):
+            if grade_mix_output is not None and not grade_mix_output.empty:
+                # Copy button
+                if st.button("Copy", key=f"copy_grade_{selected_invoice}", help="Copy to clipboard"):
+                    table_text = get_table_text(grade_mix_output)
+                    st.code(table_text, language=None)
+                    st.success("✓ Copied! Select the text above and copy with Ctrl+C (Cmd+C on Mac)")
+
+                config_grade = {
+                    "MODEL": st.column_config.TextColumn("MODEL", width=150),
+                    "CAPACITY": st.column_config.TextColumn("CAPACITY", width=90),
+                    "GRADE": st.column_config.TextColumn("GRADE", width=80),
+                    "QTY": st.column_config.NumberColumn("QTY", width=80)
+                }
+                st.dataframe(
+                    grade_mix_output,
+                    hide_index=True,
+                    use_container_width=False,
+                    height=min(300, len(grade_mix_output) * 35 + 50),
+                    column_config=config_grade
+                )
+            else:
+                st.info("No data available")
 
-            st.markdown("---")
+        st.markdown("---")
 
-            # Metrics and Order Details Side by Side
-            col1, col2 = st.columns([1.5, 3.5])
+        # Background upload jobs for this order
+        render_upload_jobs(selected_invoice, "detail")
 
-            with col1:
-                # Compact square metrics
-                st.markdown("### Summary")
+        # Files
+        col1, col2 = st.columns(2)
 
-                # IMEI Comparison: ON ASN vs EXPECTED
-                if has_asn and recon.asn_file_data:
-                    imeis, imei_count, _ = extract_imeis_from_file(recon.asn_file_data, recon.asn_filename)
-                    on_asn_count = imei_count
+        with col1:
+            st.markdown("#### 📤 ASN File")
+            if has_asn:
+                st.success(f"✅ {recon.asn_filename}")
+                if recon.error_log:
+                    st.warning(f"⚠️ {recon.error_log}")
+                if recon.asn_file_data:
+                    st.caption(f"{len(recon.asn_file_data)} bytes")
+                    st.download_button("⬇️ Download", recon.asn_file_data, recon.asn_filename, key=f"dl_asn_{selected_invoice}", use_container_width=True)
+                else:
+                    st.error("⚠️ File data missing!")
+                if st.button("🗑️ Clear", key=f"clear_asn_{selected_invoice}", use_container_width=True):
+                    clear_asn_data(selected_invoice)
+                    st.rerun()
+            else:
+                asn_file = st.file_uploader("Drag and drop ASN file here", key=f"asn_{selected_invoice}", type=['xlsx', 'xls', 'csv', 'txt', 'pdf'], label_visibility="collapsed")
+                if asn_file:
+                    st.info(f"{asn_file.name} ({asn_file.size} bytes)")
+                    if st.button("💾 Save", key=f"save_asn_{selected_invoice}", type="primary", use_container_width=True):
+                        if queue_upload(JOB_KIND_ASN, selected_invoice, asn_file):
+                            st.rerun()
+                        else:
+                            st.error("❌ Failed to save")
+
+        with col2:
+            st.markdown("#### 🔢 Extracted IMEIs")
+
+            # Extract IMEIs from ASN file if available
+            if has_asn and recon.asn_file_data:
+                if asn_error:
+                    st.error(f"⚠️ {asn_error}")
+                elif asn_imeis or asn_invalid_imeis:
+                    st.success(f"✅ Found {asn_imei_count} IMEIs")
+                    # Suppliers sometimes split an ASN across tabs (one per pallet)
+                    sheet_counts = get_asn_imei_sheet_counts(selected_invoice)
+                    if len(sheet_counts) > 1:
+                        st.caption(" · ".join(f"{sheet}: {count:,}" for sheet, count in sheet_counts))
+                    if asn_invalid_imeis:
+                        st.warning(f"⚠️ {len(asn_invalid_imeis)} IMEIs fail the check digit and are excluded")
+                        with st.expander("Invalid IMEIs"):
+                            st.code(format_imeis_for_display(asn_invalid_imeis), language=None)
+
+                    # Display IMEIs in copyable text area
+                    imei_text = format_imeis_for_display(asn_imeis)
+                    st.text_area(
+                        "Copy IMEIs:",
+                        value=imei_text,
+                        height=300,
+                        key=f"imei_display_{selected_invoice}",
+                        help="Click inside and press Ctrl+A (Cmd+A on Mac) to select all, then Ctrl+C (Cmd+C) to copy"
+                    )
+
+                    # Download as text file
+                    st.download_button(
+                        "⬇️ Download IMEIs",
+                        data=imei_text,
+                        file_name=f"{selected_invoice}_IMEIs.txt",
+                        mime="text/plain",
+                        key=f"dl_imeis_{selected_invoice}",
+                        use_container_width=True
+                    )
+                else:
+                    st.info("📄 No IMEIs found. Upload ASN file with IMEI/Serial columns.")
+            else:
+                st.info("📄 Upload ASN file to extract IMEIs")
+                st.caption("Supports: Excel (.xlsx, .xls), CSV, TXT | Looks for columns: SERIAL, IMEI, Serial No, etc.")
+
+        st.markdown("---")
+
+        # Scanned IMEI/Serial file and reconciliation against the ASN
+        col1, col2 = st.columns(2)
+
+        with col1:
+            st.markdown("#### 📱 IMEI/Serial File")
+            if has_imei:
+                st.success(f"✅ {recon.imei_serial_filename}")
+                if recon.imei_serial_count is not None:
+                    st.caption(f"{recon.imei_serial_count} IMEIs")
+                if recon.imei_serial_file_data:
+                    st.download_button("⬇️ Download", recon.imei_serial_file_data, recon.imei_serial_filename, key=f"dl_imei_serial_{selected_invoice}", use_container_width=True)
                 else:
-                    on_asn_count = 0
+                    st.error("⚠️ File data missing!")
+                if st.button("🗑️ Clear", key=f"clear_imei_serial_{selected_invoice}", use_container_width=True):
+                    clear_imei_serial_data(selected_invoice)
+                    st.rerun()
+            else:
+                imei_file = st.file_uploader("Drag and drop IMEI/Serial file here", key=f"imei_serial_{selected_invoice}", type=['xlsx', 'xls', 'csv', 'txt'], label_visibility="collapsed")
+                if imei_file:
+                    st.info(f"{imei_file.name} ({imei_file.size} bytes)")
+                    if st.button("💾 Save", key=f"save_imei_serial_{selected_invoice}", type="primary", use_container_width=True):
+                        # Extraction can take a while for large scanner exports; it runs in the background
+                        if queue_upload(JOB_KIND_IMEI_SERIAL, selected_invoice, imei_file):
+                            st.rerun()
+                        else:
+                            st.error("❌ Failed to save")
 
-                expected_count = order_qty
+        with col2:
+            st.markdown("#### 🔍 ASN vs Scanned")
+            if has_asn and has_imei and recon.asn_file_data and recon.imei_serial_file_data:
+                # Every occurrence on each side, so duplicates can be reported
+                asn_all, _, asn_all_error = extract_imeis_cached(recon.asn_file_data, recon.asn_filename, unique=False)
+                scanned_all, _, scanned_error = extract_imeis_cached(recon.imei_serial_file_data, recon.imei_serial_filename, unique=False)
 
-                # Determine color based on match
-                if on_asn_count == expected_count:
-                    border_color = "#06D6A0"  # Green - match
+                if asn_all_error or scanned_error:
+                    st.error(f"⚠️ {asn_all_error or scanned_error}")
+                else:
+                    # Same rule as the ASN panel: IMEIs failing the check digit aren't expected
+                    asn_all, _ = split_valid_imeis(asn_all)
+                    match = match_imeis(asn_all, scanned_all)
+
+                    m1, m2, m3, m4 = st.columns(4)
+                    m1.metric("Matched", len(match['matched']))
+                    m2.metric("ASN Only", len(match['asn_only']))
+                    m3.metric("Scanned Only", len(match['scanned_only']))
+                    m4.metric("Duplicates", len(match['asn_duplicates']) + len(match['scanned_duplicates']))
+
+                    if is_fully_matched(match):
+                        st.success("✅ Every ASN IMEI was scanned, with no extras or duplicates")
+                    else:
+                        report = discrepancy_report(match)
+                        st.dataframe(report, hide_index=True, use_container_width=True, height=min(300, len(report) * 35 + 50))
+                        st.download_button(
+                            "⬇️ Download Discrepancies (CSV)",
+                            data=report.to_csv(index=False),
+                            file_name=f"{selected_invoice}_discrepancies.csv",
+                            mime="text/csv",
+                            key=f"dl_discrepancies_{selected_invoice}",
+                            use_container_width=True
+                        )
+            else:
+                st.info("📄 Upload both the ASN and the IMEI/Serial file to reconcile them")
+
+        # Notes
+        st.markdown("---")
+        st.markdown("#### Notes")
+        notes = st.text_area("", value=recon.notes if recon and recon.notes else "", height=100, key=f"notes_{selected_invoice}")
+        if st.button("💾 Save Notes", key=f"save_notes_{selected_invoice}"):
+            create_or_update_reconciliation(invoice=selected_invoice, notes=notes)
+            st.success("✅ Saved!")
+            st.rerun()
+
+    else:
+        # Grid view - show all orders as compact cards
+        st.markdown("### All Orders")
+        st.markdown("---")
+
+        # Indexed IMEI counts for every order in one grouped query
+        imei_counts = get_asn_imei_counts()
+
+        # Create 3-column grid
+        cards_per_row = 3
+        for i in range(0, len(all_invoices), cards_per_row):
+            cols = st.columns(cards_per_row)
+            for j, col in enumerate(cols):
+                idx = i + j
+                if idx >= len(all_invoices):
+                    break
+
+                invoice = all_invoices[idx]
+                recon = recon_dict.get(invoice)
+                order_qty = invoice_index['summary'].at[invoice, 'QTY']
+
+                has_asn = recon and recon.asn_uploaded
+                has_imei = recon and recon.imei_serial_uploaded
+
+                if has_asn and has_imei:
                     status_icon = "✅"
-                elif on_asn_count > 0:
-                    border_color = "#F18F01"  # Orange - partial
+                    status_color = "#D1FAE5"
+                elif has_asn:
                     status_icon = "⚠️"
+                    status_color = "#FEF3C7"
                 else:
-                    border_color = "#C73E1D"  # Red - missing
-                    status_icon = "❌"
+                    status_icon = "📋"
+                    status_color = "#DBEAFE"
+
+                with col:
+                    # Status text
+                    status_text = 'COMPLETE' if has_asn and has_imei else 'ASN ONLY' if has_asn else 'PENDING'
+                    if imei_counts.get(invoice):
+                        status_text += f" ({imei_counts[invoice]:,} IMEIs)"
+
+                    # Use form to make entire card clickable
+                    with st.form(key=f"form_{invoice}"):
+                        # Create styled clickable card
+                        st.markdown(f"""
+                        <div style="
+                            background: white;
+                            padding: 1.2rem;
+                            border-radius: 10px;
+                            border: 2px solid #DEE2E6;
+                            box-shadow: 0 2px 4px rgba(0,0,0,0.08);
+                            height: 160px;
+                            display: flex;
+                            flex-direction: column;
+                            justify-content: flex-start;
+                            gap: 0.8rem;
+                            transition: all 0.2s ease;
+                            cursor: pointer;
+                        " onmouseover="this.style.borderColor='#2E86AB'; this.style.boxShadow='0 4px 8px rgba(0,0,0,0.12)'; this.style.transform='translateY(-2px)';"
+                           onmouseout="this.style.borderColor='#DEE2E6'; this.style.boxShadow='0 2px 4px rgba(0,0,0,0.08)'; this.style.transform='translateY(0)';">
+                            <div style="font-size: 0.95rem; color: #212529; line-height: 1.6;">
+                                <div style="margin-bottom: 0.6rem;"><strong>ORDER:</strong> {invoice}</div>
+                                <div style="margin-bottom: 0.6rem;"><strong>QTY:</strong> {order_qty:,} UNITS</div>
+                                <div><strong>ASN:</strong> {status_text}</div>
+                            </div>
+                        </div>
+                        """, unsafe_allow_html=True)
+
+                        # Invisible submit button that fills the form
+                        submitted = st.form_submit_button("View", use_container_width=True, type="primary")
+                        if submitted:
+                            st.session_state['selected_order_card'] = invoice
+                            st.rerun()
+
+def render_archived():
+    """Archived view: archived order cards, or one archived order's details"""
+    st.markdown("## Archived Orders")
+    st.info("📋 Archived orders are preserved here even after they are removed from the Google Sheet source.")
 
-                # Bigger square cards
+    archived_orders = get_all_archived_orders()
+
+    if not archived_orders:
+        st.warning("No archived orders yet")
+    else:
+        # Initialize selected archived order
+        if 'selected_archived_order' not in st.session_state:
+            st.session_state['selected_archived_order'] = None
+
+        # Detail view for selected archived order
+        if st.session_state['selected_archived_order']:
+            selected_archived = st.session_state['selected_archived_order']
+            archived = get_archived_order(selected_archived)
+
+            if not archived:
+                st.error("Archived order not found")
+                st.session_state['selected_archived_order'] = None
+                st.rerun()
+
+            if st.button("← Back to Archived Orders", key="back_to_archived"):
+                st.session_state['selected_archived_order'] = None
+                st.rerun()
+
+            st.markdown("---")
+
+            # Header
+            col1, col2 = st.columns([3, 1])
+            with col1:
+                st.markdown(f"### 📦 {archived.invoice}")
+                st.caption(f"Archived on: {archived.archived_date.strftime('%Y-%m-%d %H:%M')}")
+            with col2:
+                if st.button("🗑️ Delete Archive", key=f"delete_archived_{archived.invoice}", type="secondary", use_container_width=True):
+                    if delete_archived_order(archived.invoice):
+                        st.success("✅ Archive deleted!")
+                        st.session_state['selected_archived_order'] = None
+                        st.rerun()
+                    else:
+                        st.error("❌ Failed to delete")
+
+            st.markdown("---")
+
+            # Summary and Order Details
+            col1, col2 = st.columns([1.5, 3.5])
+
+            with col1:
+                st.markdown("### Summary")
                 st.markdown(f"""
                 <div style="background: white; padding: 0.8rem; border-radius: 8px; margin-bottom: 0.5rem; border-left: 4px solid #2E86AB; min-height: 70px;">
                     <p style="color: #6C757D; margin: 0; font-size: 0.75rem;">Total Units</p>
-                    <p style="font-size: 1.8rem; font-weight: 700; margin: 0;">{order_qty:,}</p>
+                    <p style="font-size: 1.8rem; font-weight: 700; margin: 0;">{archived.total_qty:,}</p>
                 </div>
 
                 <div style="background: white; padding: 0.8rem; border-radius: 8px; margin-bottom: 0.5rem; border-left: 4px solid #A23B72; min-height: 70px;">
                     <p style="color: #6C757D; margin: 0; font-size: 0.75rem;">Models</p>
-                    <p style="font-size: 1.8rem; font-weight: 700; margin: 0;">{unique_models}</p>
-                </div>
-
-                <div style="background: white; padding: 0.8rem; border-radius: 8px; border-left: 4px solid {border_color}; min-height: 90px;">
-                    <p style="color: #6C757D; margin: 0 0 0.4rem 0; font-size: 0.75rem;">{status_icon} Compare</p>
-                    <div style="display: flex; justify-content: space-between; margin-bottom: 0.3rem;">
-                        <span style="font-size: 0.75rem; color: #6C757D;">ASN QTY:</span>
-                        <span style="font-size: 1.3rem; font-weight: 700;">{on_asn_count}</span>
-                    </div>
-                    <div style="display: flex; justify-content: space-between;">
-                        <span style="font-size: 0.75rem; color: #6C757D;">EXPECTED QTY:</span>
-                        <span style="font-size: 1.3rem; font-weight: 700;">{expected_count}</span>
-                    </div>
+                    <p style="font-size: 1.8rem; font-weight: 700; margin: 0;">{archived.unique_models}</p>
                 </div>
                 """, unsafe_allow_html=True)
 
             with col2:
-                # Compact Order Details Card with proper column widths
-                st.markdown("### Expected Order Details")
+                st.markdown("### 📋 Order Details")
+                if archived.order_data:
+                    import json
+                    order_data = json.loads(archived.order_data)
+                    order_df = pd.DataFrame(order_data)
 
-                # Define columns to display in order
-                display_columns = ['INVOICE', 'MODEL', 'CAPACITY', 'COLOR', 'LOCKED', 'GRADE', 'UNIT', 'TOTAL', 'QTY', 'STATUS', 'SUPPLIER', 'FALLOUT RATE']
+                    # Define columns to display in order
+                    display_columns = ['INVOICE', 'MODEL', 'CAPACITY', 'COLOR', 'LOCKED', 'GRADE', 'UNIT', 'TOTAL', 'QTY', 'STATUS', 'SUPPLIER', 'FALLOUT RATE']
 
-                # Filter to only columns that exist in the dataframe
-                available_columns = [col for col in display_columns if col in order_df.columns]
+                    # Filter to only columns that exist in the dataframe
+                    available_columns = [col for col in display_columns if col in order_df.columns]
 
-                # Configure column widths with specific pixel values for tighter spacing
-                column_config = {
-                    "INVOICE": st.column_config.TextColumn("INVOICE", width=100),
-                    "MODEL": st.column_config.TextColumn("MODEL", width=150),
-                    "CAPACITY": st.column_config.TextColumn("CAPACITY", width=80),
-                    "COLOR": st.column_config.TextColumn("COLOR", width=80),
-                    "LOCKED": st.column_config.TextColumn("LOCKED", width=70),
-                    "GRADE": st.column_config.TextColumn("GRADE", width=70),
-                    "UNIT": st.column_config.TextColumn("UNIT", width=60),
-                    "TOTAL": st.column_config.NumberColumn("TOTAL", width=70),
-                    "QTY": st.column_config.NumberColumn("QTY", width=60),
-                    "STATUS": st.column_config.TextColumn("STATUS", width=80),
-                    "SUPPLIER": st.column_config.TextColumn("SUPPLIER", width=100),
-                    "FALLOUT RATE": st.column_config.TextColumn("FALLOUT RATE", width=90)
-                }
-
-                st.dataframe(
-                    order_df[available_columns] if available_columns else order_df,
-                    hide_index=True,
-                    use_container_width=True,
-                    height=250,
-                    column_config=column_config
-                )
-
-            st.markdown("---")
-
-            # Process breakdowns for this order
-            model_gb_output, model_only_output, grade_mix_output = process_selected_orders(df, [selected_invoice])
-
-            # Professional breakdowns section - no emojis
-            st.markdown("### Breakdowns")
-            st.caption(f"{len(model_gb_output) + len(model_only_output) + len(grade_mix_output)} total items")
-
-            # Model + GB Breakdown - Expanded by default
-            with st.expander(f"MODEL + GB BREAKDOWN ({len(model_gb_output)} items)", expanded=True):
-                if model_gb_output is not None and not model_gb_output.empty:
-                    # Copy button - minimal style
-                    if st.button("Copy", key=f"copy_model_gb_{selected_invoice}", help="Copy to clipboard"):
-                        table_text = get_table_text(model_gb_output)
-                        st.code(table_text, language=None)
-                        st.success("✓ Copied! Select the text above and copy with Ctrl+C (Cmd+C on Mac)")
-
-                    config_model_gb = {
-                        "MODEL_GB": st.column_config.TextColumn("MODEL + GB", width=200),
-                        "QTY": st.column_config.NumberColumn("QTY", width=80)
-                    }
-                    st.dataframe(
-                        model_gb_output,
-                        hide_index=True,
-                        use_container_width=False,
-                        height=min(300, len(model_gb_output) * 35 + 50),
-                        column_config=config_model_gb
-                    )
-                else:
-                    st.info("No data available")
-
-            # Model + Qty Breakdown
-            with st.expander(f"MODEL + QTY BREAKDOWN ({len(model_only_output)} items)", expanded=False):
-                if model_only_output is not None and not model_only_output.empty:
-                    # Copy button
-                    if st.button("Copy", key=f"copy_model_only_{selected_invoice}", help="Copy to clipboard"):
-                        table_text = get_table_text(model_only_output)
-                        st.code(table_text, language=None)
-                        st.success("✓ Copied! Select the text above and copy with Ctrl+C (Cmd+C on Mac)")
-
-                    config_model = {
-                        "MODEL": st.column_config.TextColumn("MODEL", width=200),
-                        "QTY": st.column_config.NumberColumn("QTY", width=80)
-                    }
-                    st.dataframe(
-                        model_only_output,
-                        hide_index=True,
-                        use_container_width=False,
-                        height=min(300, len(model_only_output) * 35 + 50),
-                        column_config=config_model
-                    )
-                else:
-                    st.info("No data available")
-
-            # Grade Breakdown
-            with st.expander(f"GRADE BREAKDOWN ({len(grade_mix_output)} items)", expanded=False):
-                if grade_mix_output is not None and not grade_mix_output.empty:
-                    # Copy button
-                    if st.button("Copy", key=f"copy_grade_{selected_invoice}", help="Copy to clipboard"):
-                        table_text = get_table_text(grade_mix_output)
-                        st.code(table_text, language=None)
-                        st.success("✓ Copied! Select the text above and copy with Ctrl+C (Cmd+C on Mac)")
-
-                    config_grade = {
+                    column_config = {
+                        "INVOICE": st.column_config.TextColumn("INVOICE", width=100),
                         "MODEL": st.column_config.TextColumn("MODEL", width=150),
-                        "CAPACITY": st.column_config.TextColumn("CAPACITY", width=90),
-                        "GRADE": st.column_config.TextColumn("GRADE", width=80),
-                        "QTY": st.column_config.NumberColumn("QTY", width=80)
+                        "CAPACITY": st.column_config.TextColumn("CAPACITY", width=80),
+                        "COLOR": st.column_config.TextColumn("COLOR", width=80),
+                        "LOCKED": st.column_config.TextColumn("LOCKED", width=70),
+                        "GRADE": st.column_config.TextColumn("GRADE", width=70),
+                        "UNIT": st.column_config.TextColumn("UNIT", width=60),
+                        "TOTAL": st.column_config.NumberColumn("TOTAL", width=70),
+                        "QTY": st.column_config.NumberColumn("QTY", width=60),
+                        "STATUS": st.column_config.TextColumn("STATUS", width=80),
+                        "SUPPLIER": st.column_config.TextColumn("SUPPLIER", width=100),
+                        "FALLOUT RATE": st.column_config.TextColumn("FALLOUT RATE", width=90)
                     }
+
                     st.dataframe(
-                        grade_mix_output,
+                        order_df[available_columns] if available_columns else order_df,
                         hide_index=True,
-                        use_container_width=False,
-                        height=min(300, len(grade_mix_output) * 35 + 50),
-                        column_config=config_grade
+                        use_container_width=True,
+                        height=250,
+                        column_config=column_config
                     )
                 else:
-                    st.info("No data available")
+                    st.warning("No order details available")
 
             st.markdown("---")
 
@@ -962,114 +1500,77 @@ def main():
             col1, col2 = st.columns(2)
 
             with col1:
-                st.markdown("#### 📤 ASN File")
-                if has_asn:
-                    st.success(f"✅ {recon.asn_filename}")
-                    if recon.asn_file_data:
-                        st.caption(f"{len(recon.asn_file_data)} bytes")
-                        st.download_button("⬇️ Download", recon.asn_file_data, recon.asn_filename, key=f"dl_asn_{selected_invoice}", use_container_width=True)
-                    else:
-                        st.error("⚠️ File data missing!")
-                    if st.button("🗑️ Clear", key=f"clear_asn_{selected_invoice}", use_container_width=True):
-                        clear_asn_data(selected_invoice)
-                        st.rerun()
+                st.markdown("#### ASN File")
+                if archived.asn_filename and archived.asn_file_data:
+                    st.success(f"✅ {archived.asn_filename}")
+                    st.download_button(
+                        "⬇️ Download ASN",
+                        data=archived.asn_file_data,
+                        file_name=archived.asn_filename,
+                        key=f"dl_archived_asn_{archived.invoice}",
+                        use_container_width=True
+                    )
+
+                    # Extract and show IMEIs from archived ASN
+                    imeis, count, error = extract_imeis_cached(archived.asn_file_data, archived.asn_filename)
+                    if imeis:
+                        st.success(f"✅ Found {count} IMEIs")
                 else:
-                    asn_file = st.file_uploader("Drag and drop ASN file here", key=f"asn_{selected_invoice}", type=['xlsx', 'xls', 'csv', 'txt', 'pdf'], label_visibility="collapsed")
-                    if asn_file:
-                        st.info(f"{asn_file.name} ({asn_file.size} bytes)")
-                        if st.button("💾 Save", key=f"save_asn_{selected_invoice}", type="primary", use_container_width=True):
-                            asn_file.seek(0)
-                            result = create_or_update_reconciliation(invoice=selected_invoice, asn_uploaded=True, asn_filename=asn_file.name, asn_file_data=asn_file.read(), asn_upload_date=datetime.utcnow())
-                            if result:
-                                st.success(f"✅ Saved! ID:{result.id}")
-                                st.rerun()
-                            else:
-                                st.error("❌ Failed to save")
+                    st.info("No ASN file archived")
 
             with col2:
-                st.markdown("#### 🔢 Extracted IMEIs")
-
-                # Extract IMEIs from ASN file if available
-                if has_asn and recon.asn_file_data:
-                    imeis, count, error = extract_imeis_from_file(recon.asn_file_data, recon.asn_filename)
+                st.markdown("#### Extracted IMEIs")
+                if archived.asn_file_data:
+                    imeis, count, error = extract_imeis_cached(archived.asn_file_data, archived.asn_filename)
 
                     if error:
                         st.error(f"⚠️ {error}")
                     elif imeis:
-                        st.success(f"✅ Found {count} IMEIs")
-
-                        # Display IMEIs in copyable text area
                         imei_text = format_imeis_for_display(imeis)
                         st.text_area(
                             "Copy IMEIs:",
                             value=imei_text,
                             height=300,
-                            key=f"imei_display_{selected_invoice}",
-                            help="Click inside and press Ctrl+A (Cmd+A on Mac) to select all, then Ctrl+C (Cmd+C) to copy"
+                            key=f"archived_imei_display_{archived.invoice}"
                         )
-
-                        # Download as text file
                         st.download_button(
                             "⬇️ Download IMEIs",
                             data=imei_text,
-                            file_name=f"{selected_invoice}_IMEIs.txt",
+                            file_name=f"{archived.invoice}_IMEIs.txt",
                             mime="text/plain",
-                            key=f"dl_imeis_{selected_invoice}",
+                            key=f"dl_archived_imeis_{archived.invoice}",
                             use_container_width=True
                         )
                     else:
-                        st.info("📄 No IMEIs found. Upload ASN file with IMEI/Serial columns.")
+                        st.info("No IMEIs found")
                 else:
-                    st.info("📄 Upload ASN file to extract IMEIs")
-                    st.caption("Supports: Excel (.xlsx, .xls), CSV, TXT | Looks for columns: SERIAL, IMEI, Serial No, etc.")
+                    st.info("No ASN file to extract from")
 
             # Notes
-            st.markdown("---")
-            st.markdown("#### Notes")
-            notes = st.text_area("", value=recon.notes if recon and recon.notes else "", height=100, key=f"notes_{selected_invoice}")
-            if st.button("💾 Save Notes", key=f"save_notes_{selected_invoice}"):
-                create_or_update_reconciliation(invoice=selected_invoice, notes=notes)
-                st.success("✅ Saved!")
-                st.rerun()
+            if archived.notes:
+                st.markdown("---")
+                st.markdown("#### Notes")
+                st.text_area("", value=archived.notes, height=100, key=f"archived_notes_{archived.invoice}", disabled=True)
 
         else:
-            # Grid view - show all orders as compact cards
-            st.markdown("### All Orders")
+            # Grid view - show all archived orders
+            st.markdown(f"### 📦 All Archived Orders ({len(archived_orders)})")
             st.markdown("---")
 
             # Create 3-column grid
             cards_per_row = 3
-            for i in range(0, len(all_invoices), cards_per_row):
+            for i in range(0, len(archived_orders), cards_per_row):
                 cols = st.columns(cards_per_row)
                 for j, col in enumerate(cols):
                     idx = i + j
-                    if idx >= len(all_invoices):
+                    if idx >= len(archived_orders):
                         break
 
-                    invoice = all_invoices[idx]
-                    recon = recon_dict.get(invoice)
-                    order_df = df[df['INVOICE'] == invoice]
-                    order_qty = order_df['QTY'].sum()
-
-                    has_asn = recon and recon.asn_uploaded
-                    has_imei = recon and recon.imei_serial_uploaded
-
-                    if has_asn and has_imei:
-                        status_icon = "✅"
-                        status_color = "#D1FAE5"
-                    elif has_asn:
-                        status_icon = "⚠️"
-                        status_color = "#FEF3C7"
-                    else:
-                        status_icon = "📋"
-                        status_color = "#DBEAFE"
+                    archived = archived_orders[idx]
 
                     with col:
-                        # Status text
-                        status_text = 'COMPLETE' if has_asn and has_imei else 'ASN ONLY' if has_asn else 'PENDING'
-
                         # Use form to make entire card clickable
-                        with st.form(key=f"form_{invoice}"):
+                        with st.form(key=f"archived_form_{archived.invoice}"):
                             # Create styled clickable card
                             st.markdown(f"""
                             <div style="
@@ -1088,9 +1589,9 @@ def main():
                             " onmouseover="this.style.borderColor='#2E86AB'; this.style.boxShadow='0 4px 8px rgba(0,0,0,0.12)'; this.style.transform='translateY(-2px)';"
                                onmouseout="this.style.borderColor='#DEE2E6'; this.style.boxShadow='0 2px 4px rgba(0,0,0,0.08)'; this.style.transform='translateY(0)';">
                                 <div style="font-size: 0.95rem; color: #212529; line-height: 1.6;">
-                                    <div style="margin-bottom: 0.6rem;"><strong>ORDER:</strong> {invoice}</div>
-                                    <div style="margin-bottom: 0.6rem;"><strong>QTY:</strong> {order_qty:,} UNITS</div>
-                                    <div><strong>ASN:</strong> {status_text}</div>
+                                    <div style="margin-bottom: 0.6rem;"><strong>ORDER:</strong> {archived.invoice}</div>
+                                    <div style="margin-bottom: 0.6rem;"><strong>QTY:</strong> {archived.total_qty:,} UNITS</div>
+                                    <div><strong>ARCHIVED:</strong> {archived.archived_date.strftime('%Y-%m-%d')}</div>
                                 </div>
                             </div>
                             """, unsafe_allow_html=True)
@@ -1098,217 +1599,40 @@ def main():
                             # Invisible submit button that fills the form
                             submitted = st.form_submit_button("View", use_container_width=True, type="primary")
                             if submitted:
-                                st.session_state['selected_order_card'] = invoice
+                                st.session_state['selected_archived_order'] = archived.invoice
                                 st.rerun()
 
-    # TAB 3: Archived Orders
-    with tab3:
-        st.markdown("## Archived Orders")
-        st.info("📋 Archived orders are preserved here even after they are removed from the Google Sheet source.")
-
-        archived_orders = get_all_archived_orders()
-
-        if not archived_orders:
-            st.warning("No archived orders yet")
-        else:
-            # Initialize selected archived order
-            if 'selected_archived_order' not in st.session_state:
-                st.session_state['selected_archived_order'] = None
-
-            # Detail view for selected archived order
-            if st.session_state['selected_archived_order']:
-                selected_archived = st.session_state['selected_archived_order']
-                archived = get_archived_order(selected_archived)
-
-                if not archived:
-                    st.error("Archived order not found")
-                    st.session_state['selected_archived_order'] = None
-                    st.rerun()
-
-                if st.button("← Back to Archived Orders", key="back_to_archived"):
-                    st.session_state['selected_archived_order'] = None
-                    st.rerun()
-
-                st.markdown("---")
-
-                # Header
-                col1, col2 = st.columns([3, 1])
-                with col1:
-                    st.markdown(f"### 📦 {archived.invoice}")
-                    st.caption(f"Archived on: {archived.archived_date.strftime('%Y-%m-%d %H:%M')}")
-                with col2:
-                    if st.button("🗑️ Delete Archive", key=f"delete_archived_{archived.invoice}", type="secondary", use_container_width=True):
-                        if delete_archived_order(archived.invoice):
-                            st.success("✅ Archive deleted!")
-                            st.session_state['selected_archived_order'] = None
-                            st.rerun()
-                        else:
-                            st.error("❌ Failed to delete")
-
-                st.markdown("---")
-
-                # Summary and Order Details
-                col1, col2 = st.columns([1.5, 3.5])
-
-                with col1:
-                    st.markdown("### Summary")
-                    st.markdown(f"""
-                    <div style="background: white; padding: 0.8rem; border-radius: 8px; margin-bottom: 0.5rem; border-left: 4px solid #2E86AB; min-height: 70px;">
-                        <p style="color: #6C757D; margin: 0; font-size: 0.75rem;">Total Units</p>
-                        <p style="font-size: 1.8rem; font-weight: 700; margin: 0;">{archived.total_qty:,}</p>
-                    </div>
-
-                    <div style="background: white; padding: 0.8rem; border-radius: 8px; margin-bottom: 0.5rem; border-left: 4px solid #A23B72; min-height: 70px;">
-                        <p style="color: #6C757D; margin: 0; font-size: 0.75rem;">Models</p>
-                        <p style="font-size: 1.8rem; font-weight: 700; margin: 0;">{archived.unique_models}</p>
-                    </div>
-                    """, unsafe_allow_html=True)
-
-                with col2:
-                    st.markdown("### 📋 Order Details")
-                    if archived.order_data:
-                        import json
-                        order_data = json.loads(archived.order_data)
-                        order_df = pd.DataFrame(order_data)
-
-                        # Define columns to display in order
-                        display_columns = ['INVOICE', 'MODEL', 'CAPACITY', 'COLOR', 'LOCKED', 'GRADE', 'UNIT', 'TOTAL', 'QTY', 'STATUS', 'SUPPLIER', 'FALLOUT RATE']
-
-                        # Filter to only columns that exist in the dataframe
-                        available_columns = [col for col in display_columns if col in order_df.columns]
-
-                        column_config = {
-                            "INVOICE": st.column_config.TextColumn("INVOICE", width=100),
-                            "MODEL": st.column_config.TextColumn("MODEL", width=150),
-                            "CAPACITY": st.column_config.TextColumn("CAPACITY", width=80),
-                            "COLOR": st.column_config.TextColumn("COLOR", width=80),
-                            "LOCKED": st.column_config.TextColumn("LOCKED", width=70),
-                            "GRADE": st.column_config.TextColumn("GRADE", width=70),
-                            "UNIT": st.column_config.TextColumn("UNIT", width=60),
-                            "TOTAL": st.column_config.NumberColumn("TOTAL", width=70),
-                            "QTY": st.column_config.NumberColumn("QTY", width=60),
-                            "STATUS": st.column_config.TextColumn("STATUS", width=80),
-                            "SUPPLIER": st.column_config.TextColumn("SUPPLIER", width=100),
-                            "FALLOUT RATE": st.column_config.TextColumn("FALLOUT RATE", width=90)
-                        }
-
-                        st.dataframe(
-                            order_df[available_columns] if available_columns else order_df,
-                            hide_index=True,
-                            use_container_width=True,
-                            height=250,
-                            column_config=column_config
-                        )
-                    else:
-                        st.warning("No order details available")
-
-                st.markdown("---")
-
-                # Files
-                col1, col2 = st.columns(2)
+# Views selectable from the navigation bar, in display order
+VIEWS = {
+    "Dashboard": render_dashboard,
+    "Order Details": render_order_details,
+    "Archived": render_archived
+}
 
-                with col1:
-                    st.markdown("#### ASN File")
-                    if archived.asn_filename and archived.asn_file_data:
-                        st.success(f"✅ {archived.asn_filename}")
-                        st.download_button(
-                            "⬇️ Download ASN",
-                            data=archived.asn_file_data,
-                            file_name=archived.asn_filename,
-                            key=f"dl_archived_asn_{archived.invoice}",
-                            use_container_width=True
-                        )
-
-                        # Extract and show IMEIs from archived ASN
-                        imeis, count, error = extract_imeis_from_file(archived.asn_file_data, archived.asn_filename)
-                        if imeis:
-                            st.success(f"✅ Found {count} IMEIs")
-                    else:
-                        st.info("No ASN file archived")
-
-                with col2:
-                    st.markdown("#### Extracted IMEIs")
-                    if archived.asn_file_data:
-                        imeis, count, error = extract_imeis_from_file(archived.asn_file_data, archived.asn_filename)
-
-                        if error:
-                            st.error(f"⚠️ {error}")
-                        elif imeis:
-                            imei_text = format_imeis_for_display(imeis)
-                            st.text_area(
-                                "Copy IMEIs:",
-                                value=imei_text,
-                                height=300,
-                                key=f"archived_imei_display_{archived.invoice}"
-                            )
-                            st.download_button(
-                                "⬇️ Download IMEIs",
-                                data=imei_text,
-                                file_name=f"{archived.invoice}_IMEIs.txt",
-                                mime="text/plain",
-                                key=f"dl_archived_imeis_{archived.invoice}",
-                                use_container_width=True
-                            )
-                        else:
-                            st.info("No IMEIs found")
-                    else:
-                        st.info("No ASN file to extract from")
-
-                # Notes
-                if archived.notes:
-                    st.markdown("---")
-                    st.markdown("#### Notes")
-                    st.text_area("", value=archived.notes, height=100, key=f"archived_notes_{archived.invoice}", disabled=True)
+def main():
+    rerun_start = time.perf_counter()
 
-            else:
-                # Grid view - show all archived orders
-                st.markdown(f"### 📦 All Archived Orders ({len(archived_orders)})")
-                st.markdown("---")
+    # Header with logo
+    st.image("assets/logo.png", width=400)
 
-                # Create 3-column grid
-                cards_per_row = 3
-                for i in range(0, len(archived_orders), cards_per_row):
-                    cols = st.columns(cards_per_row)
-                    for j, col in enumerate(cols):
-                        idx = i + j
-                        if idx >= len(archived_orders):
-                            break
-
-                        archived = archived_orders[idx]
-
-                        with col:
-                            # Use form to make entire card clickable
-                            with st.form(key=f"archived_form_{archived.invoice}"):
-                                # Create styled clickable card
-                                st.markdown(f"""
-                                <div style="
-                                    background: white;
-                                    padding: 1.2rem;
-                                    border-radius: 10px;
-                                    border: 2px solid #DEE2E6;
-                                    box-shadow: 0 2px 4px rgba(0,0,0,0.08);
-                                    height: 160px;
-                                    display: flex;
-                                    flex-direction: column;
-                                    justify-content: flex-start;
-                                    gap: 0.8rem;
-                                    transition: all 0.2s ease;
-                                    cursor: pointer;
-                                " onmouseover="this.style.borderColor='#2E86AB'; this.style.boxShadow='0 4px 8px rgba(0,0,0,0.12)'; this.style.transform='translateY(-2px)';"
-                                   onmouseout="this.style.borderColor='#DEE2E6'; this.style.boxShadow='0 2px 4px rgba(0,0,0,0.08)'; this.style.transform='translateY(0)';">
-                                    <div style="font-size: 0.95rem; color: #212529; line-height: 1.6;">
-                                        <div style="margin-bottom: 0.6rem;"><strong>ORDER:</strong> {archived.invoice}</div>
-                                        <div style="margin-bottom: 0.6rem;"><strong>QTY:</strong> {archived.total_qty:,} UNITS</div>
-                                        <div><strong>ARCHIVED:</strong> {archived.archived_date.strftime('%Y-%m-%d')}</div>
-                                    </div>
-                                </div>
-                                """, unsafe_allow_html=True)
+    # Initialize database and start the background upload workers, which also
+    # resume jobs left unfinished by a restart
+    if init_database() is not None:
+        get_job_queue()
 
-                                # Invisible submit button that fills the form
-                                submitted = st.form_submit_button("View", use_container_width=True, type="primary")
-                                if submitted:
-                                    st.session_state['selected_archived_order'] = archived.invoice
-                                    st.rerun()
+    # Only the selected view runs; the others fetch and compute nothing. Its
+    # database reads share one session and connection.
+    view = st.radio("View", list(VIEWS), horizontal=True, key="active_view", label_visibility="collapsed")
+    work = None
+    try:
+        with unit_of_work() as work:
+            VIEWS[view]()
+    finally:
+        # Wall time and connection checkouts of this rerun, shown in the Order Details debug info
+        st.session_state.setdefault('rerun_stats', {})[view] = {
+            'ms': round((time.perf_counter() - rerun_start) * 1000),
+            'checkouts': work['checkouts'] if work else None
+        }
 
 if __name__ == "__main__":
     main()
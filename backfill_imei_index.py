@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+Build the cross-order IMEI index from ASN files already in the database
+Run once after upgrading: DATABASE_URL=... python backfill_imei_index.py [--rebuild]
+"""
+
+import sys
+
+from database import init_database, backfill_imei_index
+
+
+def main():
+    rebuild = '--rebuild' in sys.argv[1:]
+
+    print("=" * 60)
+    print("IMEI Index Backfill")
+    print("=" * 60)
+
+    if init_database() is None:
+        print("❌ DATABASE_URL not set")
+        return 1
+
+    def progress(done, total):
+        print(f"\r   {done}/{total} ASN files", end='', flush=True)
+
+    summary = backfill_imei_index(rebuild=rebuild, progress=progress)
+    print()
+    print(f"✅ Indexed {summary['indexed']} ASN files ({summary['imeis']:,} IMEIs in index)")
+
+    if summary['collisions']:
+        print(f"\n⚠️  {len(summary['collisions'])} files contain IMEIs already on another order:")
+        for message in summary['collisions']:
+            print(f"   - {message}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
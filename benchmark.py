@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+"""
+Performance benchmarks for IMEI/ASN Match
+Run with: python benchmark.py
+Generates synthetic supplier files in memory, no database or Google Sheets needed
+"""
+
+import glob
+import io
+import os
+import sys
+import re
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+import random
+
+import openpyxl
+import pandas as pd
+
+import imei_extractor
+from imei_extractor import (extract_imeis_from_file, _find_imei_columns, _select_imei_columns,
+                            _extract_from_column, validate_imei, validate_imeis)
+from imei_matcher import match_imeis
+from sqlalchemy import event
+from sqlalchemy.orm import defer
+
+import database
+from database import pack_file_data, unpack_file_data
+
+
+def luhn_check_digit(body):
+    """Check digit that makes a 14-digit IMEI body pass the Luhn check"""
+    total = 0
+    for position, char in enumerate(body):
+        digit = int(char) * (2 if position % 2 else 1)
+        total += digit - 9 if digit > 9 else digit
+    return str(-total % 10)
+
+
+def generate_imeis(count, seed=0, check_digit=True):
+    """Generate `count` random 15-digit IMEIs starting with 35 (random last digit if not check_digit)"""
+    rng = random.Random(seed)
+    if not check_digit:
+        return [f"35{rng.randrange(10 ** 13):013d}" for _ in range(count)]
+    bodies = [f"35{rng.randrange(10 ** 12):012d}" for _ in range(count)]
+    return [body + luhn_check_digit(body) for body in bodies]
+
+
+def generate_asn_dataframe(rows, seed=0):
+    """Generate an ASN shaped like the supplier exports (a dozen columns)"""
+    rng = random.Random(seed)
+    imeis = generate_imeis(rows, seed)
+    return pd.DataFrame({
+        'Auction Date': [10202025] * rows,
+        'SAP Customer Number': [None] * rows,
+        'Customer Organization': ['SUPERIOR'] * rows,
+        'Invoice Number': [rng.randrange(10 ** 8) for _ in range(rows)],
+        'Lot ID': [f"LOT{i // 500:05d}" for i in range(rows)],
+        'Carrier': ['UPS'] * rows,
+        'Auction Model': [rng.choice(['IPHONE 13 128GB', 'IPHONE 14 PRO 256GB']) for _ in range(rows)],
+        'Grade': [rng.choice(['A', 'B', 'C']) for _ in range(rows)],
+        'Serial No': [int(imei) for imei in imeis],
+        'Master Carton ID': [f"MCTN{i // 50:011d}" for i in range(rows)],
+        'Ship Date': [10272025] * rows,
+        'Comments': [''] * rows,
+    })
+
+
+def timed(func, *args, repeat=3):
+    """Return (best wall time in seconds, result) over `repeat` runs"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def legacy_scan_dataframe(df):
+    """Cell-by-cell scan used by extract_imeis_from_file before vectorization"""
+    imeis = []
+    imei_columns = _find_imei_columns(df)
+    for col in imei_columns or df.columns:
+        for value in df[col].dropna():
+            value_str = str(value).strip()
+            imeis.extend(re.findall(r'\b35\d{13}\b', value_str))
+    unique_imeis = []
+    seen = set()
+    for imei in imeis:
+        if imei not in seen:
+            unique_imeis.append(imei)
+            seen.add(imei)
+    return unique_imeis
+
+
+def vectorized_scan_dataframe(df):
+    """Column-at-a-time scan used by extract_imeis_from_file"""
+    imeis = []
+    for col in _find_imei_columns(df) or df.columns:
+        imeis.extend(_extract_from_column(df[col]))
+    return list(dict.fromkeys(imeis))
+
+
+def bench_imei_extraction(rows=100_000):
+    """Compare legacy and vectorized IMEI extraction on a generated ASN"""
+    print(f"\n🔍 IMEI extraction ({rows:,}-row ASN)...")
+    df = generate_asn_dataframe(rows)
+
+    for label, frame in [("IMEI column found", df),
+                         ("no IMEI header (full scan)", df.rename(columns={'Serial No': 'Device'}))]:
+        legacy_time, legacy_result = timed(legacy_scan_dataframe, frame)
+        new_time, new_result = timed(vectorized_scan_dataframe, frame)
+        assert legacy_result == new_result, "vectorized scan changed the output"
+        print(f"   {label}: legacy {legacy_time * 1000:.0f} ms → "
+              f"vectorized {new_time * 1000:.0f} ms ({legacy_time / new_time:.1f}x)")
+
+    # No IMEI header plus a 15-digit order number column that also starts with 35
+    unlabeled = df.rename(columns={'Serial No': 'Device'})
+    unlabeled['Order No'] = [int(number) for number in generate_imeis(rows, seed=7, check_digit=False)]
+    scan_time, scan_result = timed(vectorized_scan_dataframe, unlabeled)
+    profile_time, profile_columns = timed(_select_imei_columns, unlabeled)
+    profile_time += timed(vectorized_scan_dataframe, unlabeled[profile_columns])[0]
+    print(f"   no IMEI header, order numbers present: full scan {scan_time * 1000:.0f} ms, "
+          f"{len(scan_result):,} IMEIs → profiled {profile_time * 1000:.0f} ms on {profile_columns}, "
+          f"{len(set(scan_result) - set(vectorized_scan_dataframe(unlabeled[profile_columns]))):,} false positives dropped")
+
+    csv_data = df.to_csv(index=False).encode('utf-8')
+    csv_time, (imeis, count, error) = timed(extract_imeis_from_file, csv_data, 'asn.csv')
+    assert error is None and count == rows
+    print(f"   End-to-end CSV ({len(csv_data) / 1e6:.1f} MB): {csv_time * 1000:.0f} ms for {count:,} IMEIs")
+
+
+def peak_memory(fn, *args, **kwargs):
+    """Run fn once and return the peak Python memory it allocated, in MB"""
+    tracemalloc.start()
+    try:
+        fn(*args, **kwargs)
+        return tracemalloc.get_traced_memory()[1] / 1e6
+    finally:
+        tracemalloc.stop()
+
+
+def bench_streaming_extraction(rows=500_000):
+    """Peak memory of whole-file vs chunked extraction for a large scanner export"""
+    print(f"\n🔍 Streaming extraction ({rows:,}-row scanner export, mostly repeated IMEIs)...")
+    # Scanner exports repeat a bounded set of devices, so the result set stays small
+    imeis = generate_imeis(5_000, seed=5)
+    df = pd.DataFrame({
+        'Serial No': [imeis[i % len(imeis)] for i in range(rows)],
+        'Model': 'iPhone 15 Pro Max 256GB',
+        'Scanned By': 'Dock 4'
+    })
+    csv_data = df.to_csv(index=False).encode('utf-8')
+    txt_data = csv_data.replace(b',', b'\t')
+
+    def whole_csv(data):
+        return list(dict.fromkeys(_extract_from_column(pd.read_csv(io.BytesIO(data))['Serial No'])))
+
+    def whole_txt(data):
+        return set(re.findall(r'\b35\d{13}\b', data.decode('utf-8', errors='ignore')))
+
+    for label, data, filename, whole in [("CSV", csv_data, 'scan.csv', whole_csv),
+                                         ("TXT", txt_data, 'scan.txt', whole_txt)]:
+        whole_time, whole_result = timed(whole, data)
+        stream_time, (stream_result, _, error) = timed(extract_imeis_from_file, data, filename)
+        assert error is None and set(stream_result) == set(whole_result)
+        print(f"   {label} ({len(data) / 1e6:.0f} MB): whole file {whole_time * 1000:.0f} ms, "
+              f"{peak_memory(whole, data):.0f} MB peak → streamed {stream_time * 1000:.0f} ms, "
+              f"{peak_memory(extract_imeis_from_file, data, filename):.0f} MB peak")
+
+
+def generate_asn_workbook(rows, columns, sheets=1):
+    """Build an .xlsx ASN with `columns` columns, one of them the Serial No column, split across `sheets` tabs"""
+    rng = random.Random(6)
+    imeis = generate_imeis(rows, seed=6)
+    workbook = openpyxl.Workbook(write_only=True)
+    per_sheet = -(-rows // sheets)
+    for number in range(sheets):
+        sheet = workbook.create_sheet(f'Pallet {number + 1}')
+        sheet.append(['Serial No'] + [f'Field {i}' for i in range(1, columns)])
+        for imei in imeis[number * per_sheet:(number + 1) * per_sheet]:
+            sheet.append([imei] + [f'Value {rng.randrange(1000)}' if i % 2 else rng.random()
+                                   for i in range(1, columns)])
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+def bench_excel_extraction(rows=50_000, columns=30):
+    """Compare reading a whole workbook with pandas against reading only the IMEI column"""
+    print(f"\n🔍 Excel extraction ({rows:,} rows x {columns} columns)...")
+    xlsx_data = generate_asn_workbook(rows, columns)
+
+    def whole_workbook(data):
+        return vectorized_scan_dataframe(pd.read_excel(io.BytesIO(data)))
+
+    whole_time, whole_result = timed(whole_workbook, xlsx_data)
+    print(f"   pd.read_excel, all columns: {whole_time * 1000:.0f} ms")
+
+    has_calamine = imei_extractor.HAS_CALAMINE
+    engines = [("openpyxl fallback, IMEI column", False)]
+    if has_calamine:
+        engines.append(("calamine, IMEI column", True))
+    try:
+        for label, use_calamine in engines:
+            imei_extractor.HAS_CALAMINE = use_calamine
+            new_time, (imeis, count, error) = timed(extract_imeis_from_file, xlsx_data, 'asn.xlsx')
+            assert error is None and imeis == whole_result
+            print(f"   {label}: {new_time * 1000:.0f} ms ({whole_time / new_time:.1f}x)")
+    finally:
+        imei_extractor.HAS_CALAMINE = has_calamine
+    if not has_calamine:
+        print("   (python-calamine from requirements.txt is not installed; timed the fallback only)")
+
+
+def bench_multi_sheet_extraction(rows=40_000, columns=10, sheets=4):
+    """Read every tab of a workbook, in this process and in a process pool"""
+    print(f"\n🔍 Multi-sheet Excel extraction ({rows:,} rows over {sheets} sheets, {os.cpu_count()} CPUs)...")
+    xlsx_data = generate_asn_workbook(rows, columns, sheets)
+
+    first_sheet = vectorized_scan_dataframe(pd.read_excel(io.BytesIO(xlsx_data)))
+    print(f"   first sheet only (previous behaviour): {len(first_sheet):,} of {rows:,} IMEIs")
+
+    min_mb = imei_extractor.PARALLEL_SHEETS_MIN_MB
+    try:
+        for label, threshold in [("one process", float('inf')), ("process pool", 0)]:
+            imei_extractor.PARALLEL_SHEETS_MIN_MB = threshold
+            elapsed, (imeis, count, error) = timed(extract_imeis_from_file, xlsx_data, 'asn.xlsx', repeat=1)
+            assert error is None and count == rows
+            print(f"   all sheets, {label}: {elapsed * 1000:.0f} ms for {count:,} IMEIs")
+    finally:
+        imei_extractor.PARALLEL_SHEETS_MIN_MB = min_mb
+    if (os.cpu_count() or 1) < 2:
+        print("   (single CPU: the pool falls back to one process)")
+
+
+def bench_imei_matching(per_side=100_000):
+    """Match an ASN against a scan file with realistic discrepancies"""
+    print(f"\n🔍 ASN vs scanned matching ({per_side:,} IMEIs per side)...")
+    asn = generate_imeis(per_side, seed=1)
+    # 98% of the ASN scanned, 2% unexpected devices, 0.5% scanned twice
+    scanned = asn[:int(per_side * 0.98)] + generate_imeis(int(per_side * 0.02), seed=2)
+    scanned += scanned[:int(per_side * 0.005)]
+    random.Random(3).shuffle(scanned)
+
+    match_time, result = timed(match_imeis, asn, scanned)
+    print(f"   {match_time * 1000:.0f} ms: {len(result['matched']):,} matched, "
+          f"{len(result['asn_only']):,} ASN only, {len(result['scanned_only']):,} scanned only, "
+          f"{len(result['scanned_duplicates']):,} duplicates")
+    if match_time > 0.5:
+        print("   ⚠️  Slower than the 500 ms budget")
+
+
+def bench_luhn_validation(count=1_000_000):
+    """Compare per-IMEI and vectorized Luhn validation"""
+    print(f"\n🔍 Luhn check-digit validation ({count:,} IMEIs)...")
+    imeis = generate_imeis(count, seed=4, check_digit=False)
+
+    scalar_time, scalar_result = timed(lambda values: [validate_imei(imei) for imei in values], imeis)
+    vector_time, vector_result = timed(validate_imeis, imeis)
+    assert vector_result.tolist() == scalar_result, "vectorized validation changed the output"
+    edge_cases = ['35000000000000', '6350000000000014', int(imeis[0]), f' {imeis[0]} ', '', None]
+    assert validate_imeis(edge_cases).tolist() == [validate_imei(imei) for imei in edge_cases], \
+        "vectorized validation disagrees on mixed lengths or types"
+    print(f"   per-IMEI {scalar_time * 1000:.0f} ms → vectorized {vector_time * 1000:.0f} ms "
+          f"({scalar_time / vector_time:.1f}x), {int(vector_result.sum()):,} valid")
+    if vector_time > 0.5:
+        print("   ⚠️  Slower than the 500 ms budget")
+
+
+def _sqlite_blob_store(blobs):
+    """In-memory SQLite table holding `blobs`; returns (connection, database size in bytes)"""
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE file_blob (id INTEGER PRIMARY KEY, data BLOB NOT NULL)')
+    conn.executemany('INSERT INTO file_blob (id, data) VALUES (?, ?)', enumerate(blobs))
+    conn.commit()
+    page_count, = conn.execute('PRAGMA page_count').fetchone()
+    page_size, = conn.execute('PRAGMA page_size').fetchone()
+    return conn, page_count * page_size
+
+
+def bench_blob_storage(rows=100_000):
+    """Stored size and read latency of compressed vs raw file blobs"""
+    print(f"\n🔍 Compressed file storage (attached_assets samples + {rows:,}-row ASN and scan)...")
+    samples = []
+    for path in sorted(glob.glob(os.path.join('attached_assets', '*.csv')) + glob.glob(os.path.join('attached_assets', '*.xlsx'))):
+        with open(path, 'rb') as f:
+            samples.append((os.path.basename(path), f.read()))
+    samples.append((f'asn_{rows}.csv', generate_asn_dataframe(rows).to_csv(index=False).encode()))
+    samples.append((f'asn_{rows // 10}.xlsx', generate_asn_workbook(rows // 10, 12)))
+    samples.append((f'scan_{rows}.txt', '\n'.join(generate_imeis(rows, seed=5)).encode()))
+
+    packed = []
+    for name, data in samples:
+        pack_time, stored = timed(pack_file_data, data)
+        unpack_time, restored = timed(unpack_file_data, stored)
+        assert restored == data, f"{name} did not round-trip"
+        packed.append(stored)
+        print(f"   {name[:40]:<40} {len(data) / 1024:>8,.0f} KB → {len(stored) / 1024:>7,.0f} KB "
+              f"({len(data) / len(stored):.1f}x), pack {pack_time * 1000:.0f} ms, unpack {unpack_time * 1000:.0f} ms")
+
+    raw_db, raw_size = _sqlite_blob_store([data for _, data in samples])
+    packed_db, packed_size = _sqlite_blob_store(packed)
+    print(f"   Database size: raw {raw_size / 1024:,.0f} KB → compressed {packed_size / 1024:,.0f} KB "
+          f"({raw_size / packed_size:.1f}x)")
+
+    def read_all(conn, unpack):
+        for (data,) in conn.execute('SELECT data FROM file_blob ORDER BY id'):
+            if unpack:
+                unpack_file_data(data)
+
+    raw_read, _ = timed(read_all, raw_db, False)
+    packed_read, _ = timed(read_all, packed_db, True)
+    print(f"   Read every file: raw {raw_read * 1000:.1f} ms, compressed + unpack {packed_read * 1000:.1f} ms "
+          f"(local SQLite; over a network connection the smaller transfer dominates)")
+
+
+def legacy_create_or_update_reconciliation(invoice, **kwargs):
+    """The original helper for plain-column writes: SELECT, INSERT/UPDATE, COMMIT, refresh"""
+    session = database.get_session()
+    try:
+        status = session.query(database.OrderReconciliation).options(
+            defer(database.OrderReconciliation.asn_file_blob),
+            defer(database.OrderReconciliation.imei_serial_file_blob)
+        ).filter_by(invoice=invoice).first()
+        if not status:
+            status = database.OrderReconciliation(invoice=invoice)
+            session.add(status)
+        for key, value in kwargs.items():
+            if hasattr(status, key):
+                setattr(status, key, value)
+        status.updated_at = database.datetime.utcnow()
+        session.commit()
+        session.refresh(status)
+        session.expunge(status)
+        return status
+    finally:
+        session.close()
+
+
+def bench_reconciliation_upsert(writes=500, orders=100):
+    """Notes-save latency and round trips (statements + COMMIT): upsert vs the original read-modify-write"""
+    # A scratch database unless BENCH_DATABASE_URL points at a real one
+    scratch = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+    scratch.close()
+    os.environ['DATABASE_URL'] = os.environ.get('BENCH_DATABASE_URL', f'sqlite:///{scratch.name}')
+    engine = database.get_database_engine()
+    print(f"\n🔍 Reconciliation writes ({writes:,} notes saves over {orders} orders, {engine.dialect.name})...")
+    database.Base.metadata.create_all(engine)
+
+    statements = []
+    event.listen(engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+    event.listen(engine, 'commit', lambda *args: statements.append('COMMIT'))
+
+    def run(helper, prefix):
+        statements.clear()
+        start = time.perf_counter()
+        for i in range(writes):
+            helper(f"{prefix}-{i % orders}", notes=f"note {i}")
+        return (time.perf_counter() - start) / writes, len(statements) / writes
+
+    legacy_time, legacy_statements = run(legacy_create_or_update_reconciliation, 'BENCH-LEGACY')
+    upsert_time, upsert_statements = run(database.create_or_update_reconciliation, 'BENCH-UPSERT')
+    print(f"   read-modify-write {legacy_time * 1000:.2f} ms, {legacy_statements:.1f} round trips per save")
+    print(f"   upsert            {upsert_time * 1000:.2f} ms, {upsert_statements:.1f} round trips per save "
+          f"({legacy_time / upsert_time:.1f}x)")
+
+    session = database.get_session()
+    session.query(database.OrderReconciliation).filter(
+        database.OrderReconciliation.invoice.like('BENCH-%')
+    ).delete(synchronize_session=False)
+    session.commit()
+    session.close()
+    os.unlink(scratch.name)
+
+
+def main():
+    print("=" * 60)
+    print("IMEI/ASN Match - Performance Benchmarks")
+    print("=" * 60)
+
+    bench_imei_extraction()
+    bench_streaming_extraction()
+    bench_excel_extraction()
+    bench_multi_sheet_extraction()
+    bench_imei_matching()
+    bench_luhn_validation()
+    bench_blob_storage()
+    bench_reconciliation_upsert()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
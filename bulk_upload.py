@@ -0,0 +1,214 @@
+"""
+Bulk ASN upload
+
+Takes many ASN files (or ZIP archives of them), matches each to an invoice by
+the invoice number in its file name or, failing that, an invoice column inside
+it, and extracts IMEIs from the files concurrently in a process pool. Parsed
+ASNs are written to the database in one transaction per upload.
+"""
+
+import os
+import re
+import zipfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from io import BytesIO
+
+import pandas as pd
+
+import imei_extractor
+from imei_extractor import extract_imei_records
+from database import save_asn_batch
+
+SUPPORTED_EXTENSIONS = ['xlsx', 'xls', 'csv', 'txt']
+
+# Parser processes (default: one per CPU)
+BULK_UPLOAD_WORKERS = int(os.environ.get('BULK_UPLOAD_WORKERS', os.cpu_count() or 1))
+
+# Rows read when looking for an invoice column inside a file
+INVOICE_SAMPLE_ROWS = 50
+
+# Status values in the per-file report
+STATUS_SAVED = 'SAVED'
+STATUS_FAILED = 'FAILED'
+
+
+def _file_ext(filename):
+    return filename.lower().split('.')[-1]
+
+
+def expand_uploads(files):
+    """
+    Flatten uploaded files and ZIP archives into individual ASN files
+
+    files: list of (filename, bytes)
+    Returns: tuple (list of (filename, bytes), list of (filename, error message))
+    """
+    uploads = []
+    errors = []
+    for filename, file_data in files:
+        if _file_ext(filename) != 'zip':
+            if _file_ext(filename) in SUPPORTED_EXTENSIONS:
+                uploads.append((filename, file_data))
+            else:
+                errors.append((filename, f"Unsupported file type: {_file_ext(filename)}"))
+            continue
+
+        try:
+            with zipfile.ZipFile(BytesIO(file_data)) as archive:
+                for info in archive.infolist():
+                    name = os.path.basename(info.filename)
+                    # Skip folders and macOS metadata (__MACOSX/, ._file)
+                    if info.is_dir() or not name or name.startswith('.') or info.filename.startswith('__MACOSX/'):
+                        continue
+                    entry = f"{filename}/{info.filename}"
+                    if _file_ext(name) in SUPPORTED_EXTENSIONS:
+                        uploads.append((entry, archive.read(info)))
+                    else:
+                        errors.append((entry, f"Unsupported file type: {_file_ext(name)}"))
+        except zipfile.BadZipFile:
+            errors.append((filename, "Not a valid ZIP archive"))
+
+    return uploads, errors
+
+
+def invoice_from_filename(filename, invoices):
+    """
+    Find the invoice number in a file name
+
+    An invoice matches when it appears in the name (case insensitive) and is
+    not part of a longer run of letters or digits; the longest match wins.
+    Returns: invoice or None
+    """
+    name = os.path.basename(filename).upper()
+    matches = [
+        invoice for invoice in invoices
+        if str(invoice).upper() in name
+        and re.search(rf'(?<![A-Z0-9]){re.escape(str(invoice).upper())}(?![A-Z0-9])', name)
+    ]
+    return max(matches, key=lambda invoice: len(str(invoice))) if matches else None
+
+
+def invoice_from_content(file_data, filename, invoices):
+    """
+    Find the invoice from an invoice column in the first rows of a CSV or Excel file
+
+    Returns: the most common value of any "invoice" column that is a known invoice, or None
+    """
+    file_ext = _file_ext(filename)
+    if file_ext == 'csv':
+        df = pd.read_csv(BytesIO(file_data), nrows=INVOICE_SAMPLE_ROWS, dtype=str)
+    elif file_ext in ['xlsx', 'xls']:
+        df = pd.read_excel(BytesIO(file_data), nrows=INVOICE_SAMPLE_ROWS, dtype=str)
+    else:
+        return None
+
+    known = {str(invoice).strip().upper(): invoice for invoice in invoices}
+    counts = Counter()
+    for col in df.columns:
+        if 'invoice' in str(col).lower():
+            for value in df[col].dropna():
+                invoice = known.get(str(value).strip().upper())
+                if invoice is not None:
+                    counts[invoice] += 1
+    return counts.most_common(1)[0][0] if counts else None
+
+
+def parse_upload(filename, file_data, invoices, parallel_min_mb=None):
+    """
+    Match one ASN file to an invoice and extract its IMEI records
+
+    Runs in a worker process, or inline for a single file. parallel_min_mb is
+    passed to extract_imei_records.
+    Returns: dict with filename, invoice, records and error
+    """
+    result = {'filename': filename, 'invoice': None, 'records': [], 'error': None}
+    try:
+        invoice = invoice_from_filename(filename, invoices) or invoice_from_content(file_data, filename, invoices)
+    except Exception as e:
+        invoice = None
+        result['error'] = f"Could not read file: {str(e)}"
+    if invoice is None:
+        result['error'] = result['error'] or "No known invoice in the file name or an invoice column"
+        return result
+
+    result['invoice'] = invoice
+    result['records'], result['error'] = extract_imei_records(file_data, filename, parallel_min_mb)
+    return result
+
+
+def _report_row(filename, invoice, imeis, status, details):
+    return {'FILE': filename, 'INVOICE': invoice, 'IMEIS': imeis, 'STATUS': status, 'DETAILS': details}
+
+
+def _iter_parsed(uploads, invoices):
+    """
+    Parse uploads in a process pool (inline for a single file or CPU)
+
+    Yields: tuple (file bytes, parse_upload result) as each file finishes
+    """
+    workers = min(BULK_UPLOAD_WORKERS, len(uploads))
+    if workers <= 1:
+        for filename, file_data in uploads:
+            yield file_data, parse_upload(filename, file_data, invoices)
+        return
+
+    # Not fork(): this runs on a server thread (see imei_extractor.POOL_CONTEXT)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=imei_extractor.POOL_CONTEXT) as pool:
+        # File bytes stay in this process; workers only send back the records
+        # Files are already spread one per process; don't nest a sheet pool inside
+        futures = {
+            pool.submit(parse_upload, filename, file_data, invoices, float('inf')): file_data
+            for filename, file_data in uploads
+        }
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+def process_bulk_upload(files, invoices, progress=None):
+    """
+    Parse and store a bulk ASN upload
+
+    files: list of (filename, bytes); ZIP archives are expanded.
+    invoices: the known invoice numbers files can be matched to.
+    progress(fraction, message), if given, is called as files are parsed and saved.
+    A file whose invoice already came from an earlier file in the same upload is
+    rejected rather than silently replacing it. All parsed files are saved in
+    one transaction: if that fails, none of them are stored.
+
+    Returns: list of report dicts (FILE, INVOICE, IMEIS, STATUS, DETAILS), one per file, by file name
+    """
+    uploads, errors = expand_uploads(files)
+    report = [_report_row(filename, None, 0, STATUS_FAILED, error) for filename, error in errors]
+    invoices = frozenset(invoices)
+    total = len(uploads)
+    claimed = {}
+    pending = []
+
+    for done, (file_data, result) in enumerate(_iter_parsed(uploads, invoices), start=1):
+        filename, invoice = result['filename'], result['invoice']
+        if result['error']:
+            report.append(_report_row(filename, invoice, 0, STATUS_FAILED, result['error']))
+        elif invoice in claimed:
+            report.append(_report_row(filename, invoice, 0, STATUS_FAILED, f"Invoice already taken by {claimed[invoice]}"))
+        else:
+            claimed[invoice] = filename
+            pending.append(dict(result, file_data=file_data))
+        if progress:
+            progress(done / total, f"Parsed {done} of {total} files")
+
+    if pending:
+        if progress:
+            progress(1.0, f"Saving {len(pending)} files")
+        try:
+            logs = save_asn_batch(pending)
+            failure = "Database not available" if logs is None else None
+        except Exception as e:
+            logs, failure = None, f"Database error, upload not saved: {str(e)}"
+        for upload in pending:
+            if failure:
+                report.append(_report_row(upload['filename'], upload['invoice'], 0, STATUS_FAILED, failure))
+            else:
+                report.append(_report_row(upload['filename'], upload['invoice'], len(upload['records']),
+                                           STATUS_SAVED, logs.get(upload['invoice']) or ''))
+    return sorted(report, key=lambda row: row['FILE'])
@@ -0,0 +1,147 @@
+"""
+Named in-process caches with single-flight loading
+
+Every cache lives in a process-wide registry under a name ('sheet_data',
+'invoice_breakdowns', 'imei_extraction', ...) for stats reporting. None needs
+clearing when orders change: keys are content hashes or sheet snapshot times,
+so stale entries become unreachable and age out (unlike st.cache_data.clear(),
+which drops everything for every user). SingleFlight collapses concurrent
+loads of the same key into one upstream call.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache bounded by the estimated size of its values
+
+    sizeof(value) returns the size in bytes charged against max_bytes. Values
+    larger than max_bytes are not cached at all.
+    """
+
+    def __init__(self, max_bytes, sizeof):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'bytes': self.current_bytes,
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exception = None
+
+
+class SingleFlight:
+    """
+    Run at most one call per key at a time; concurrent callers share its result
+
+    If ten sessions ask for the same key while a load is in flight, the first
+    one runs fn and the other nine wait for it instead of issuing their own.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.exception is not None:
+                raise call.exception
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.exception = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+def register_cache(name, cache):
+    """Register a cache object under a name, for cache_stats(); returns the registered cache"""
+    with _registry_lock:
+        _registry[name] = cache
+    return cache
+
+
+def named_lru_cache(name, max_mb, sizeof):
+    """Get the LRU cache registered under name, creating it on first use"""
+    with _registry_lock:
+        cache = _registry.get(name)
+        if cache is None:
+            cache = _registry[name] = LRUCache(int(max_mb * 1024 * 1024), sizeof)
+        return cache
+
+
+def env_max_mb(variable, default):
+    """Read a cache size cap in megabytes from the environment"""
+    return float(os.environ.get(variable, default))
+
+
+def cache_stats():
+    """Stats for every registered cache that reports them"""
+    return {
+        name: cache.stats() if hasattr(cache, 'stats') else {}
+        for name, cache in sorted(_registry.items())
+    }
@@ -1,12 +1,105 @@
 import os
-from sqlalchemy import create_engine, Column, Integer, String, Text, Boolean, DateTime, Float, ForeignKey, LargeBinary
+import hashlib
+import threading
+import zlib
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import create_engine, event, inspect, text, Column, Integer, String, Text, Boolean, DateTime, Float, ForeignKey, Index, LargeBinary, UniqueConstraint, func, insert, update, delete, exists, case, select, false
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Connection, make_url
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker, defer, column_property
 from datetime import datetime
 import streamlit as st
+from imei_extractor import extract_imei_records
+
+try:
+    import zstandard
+    HAS_ZSTD = True
+except ImportError:
+    HAS_ZSTD = False
 
 Base = declarative_base()
 
+# Inline file columns converted to blob references per transaction by the migration
+BLOB_MIGRATION_BATCH = 50
+
+# Stored file contents start with BLOB_MAGIC and a codec byte; blobs without it
+# were written before compression and are raw file bytes
+BLOB_MAGIC = b'\x89FB'
+CODEC_RAW = b'r'
+CODEC_ZLIB = b'z'
+CODEC_ZSTD = b's'
+
+# A compressed copy is kept only if at least this fraction smaller (XLSX is already zipped)
+BLOB_MIN_SAVING = 0.1
+
+def pack_file_data(file_data):
+    """
+    Compress file contents for storage (zstd when installed, otherwise zlib)
+
+    Returns: bytes prefixed with BLOB_MAGIC and the codec used
+    """
+    if HAS_ZSTD:
+        codec, packed = CODEC_ZSTD, zstandard.ZstdCompressor(level=10).compress(file_data)
+    else:
+        codec, packed = CODEC_ZLIB, zlib.compress(file_data, 6)
+    if len(packed) > len(file_data) * (1 - BLOB_MIN_SAVING):
+        codec, packed = CODEC_RAW, file_data
+    return BLOB_MAGIC + codec + packed
+
+def unpack_file_data(stored):
+    """Original file bytes from a stored blob (None passes through)"""
+    if stored is None:
+        return None
+    stored = bytes(stored)
+    if not stored.startswith(BLOB_MAGIC):
+        return stored
+    header = len(BLOB_MAGIC) + 1
+    codec = stored[header - 1:header]
+    if codec == CODEC_ZLIB:
+        return zlib.decompress(stored[header:])
+    if codec == CODEC_ZSTD:
+        if not HAS_ZSTD:
+            raise RuntimeError("File was stored zstd-compressed; install zstandard to read it")
+        return zstandard.ZstdDecompressor().decompress(stored[header:])
+    return stored[header:]
+
+class FileBlob(Base):
+    """
+    Uploaded file contents, stored once per distinct file
+
+    Keyed by the SHA-256 of the original bytes; orders and archived orders
+    reference a blob by hash, so re-uploading or archiving a file never copies
+    it. data holds the pack_file_data() form; size is the original size.
+    """
+    __tablename__ = 'file_blob'
+
+    sha256 = Column(String(64), primary_key=True)
+    data = Column(LargeBinary, nullable=False)
+    size = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+def _stored_blob(hash_column):
+    """Read-only attribute loading the referenced blob's stored (packed) bytes with the row"""
+    return column_property(
+        select(FileBlob.data).where(FileBlob.sha256 == hash_column).correlate_except(FileBlob).scalar_subquery()
+    )
+
+def _unpacked_blob(stored_attribute):
+    """File bytes of a stored blob, decompressed on first access and kept until it changes"""
+    cache_attribute = f'_{stored_attribute}_unpacked'
+
+    def get(self):
+        stored = getattr(self, stored_attribute)
+        cached = self.__dict__.get(cache_attribute)
+        if cached is None or cached[0] is not stored:
+            cached = self.__dict__[cache_attribute] = (stored, unpack_file_data(stored))
+        return cached[1]
+    return property(get)
+
 class OrderReconciliation(Base):
     __tablename__ = 'order_reconciliation'
 
@@ -16,11 +109,16 @@ class OrderReconciliation(Base):
     reconciled_date = Column(DateTime, nullable=True)
     asn_uploaded = Column(Boolean, default=False)
     asn_filename = Column(String, nullable=True)
-    asn_file_data = Column(LargeBinary, nullable=True)
+    asn_file_hash = Column(String(64), ForeignKey('file_blob.sha256'), nullable=True, index=True)
+    asn_file_blob = _stored_blob(asn_file_hash)
+    asn_file_data = _unpacked_blob('asn_file_blob')
     asn_upload_date = Column(DateTime, nullable=True)
+    asn_imei_count = Column(Integer, nullable=True)  # IMEIs indexed from the ASN; None if not indexed
     imei_serial_uploaded = Column(Boolean, default=False)
     imei_serial_filename = Column(String, nullable=True)
-    imei_serial_file_data = Column(LargeBinary, nullable=True)
+    imei_serial_file_hash = Column(String(64), ForeignKey('file_blob.sha256'), nullable=True, index=True)
+    imei_serial_file_blob = _stored_blob(imei_serial_file_hash)
+    imei_serial_file_data = _unpacked_blob('imei_serial_file_blob')
     imei_serial_upload_date = Column(DateTime, nullable=True)
     imei_serial_count = Column(Integer, nullable=True)
     notes = Column(Text, nullable=True)
@@ -28,6 +126,36 @@ class OrderReconciliation(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+class AsnImei(Base):
+    """
+    One row per IMEI found in an ASN, written once at upload time
+
+    This is the global IMEI index across live and archived orders: the index on
+    imei makes "which other order also has this IMEI?" a single indexed lookup.
+    An IMEI is unique per order, not globally, so every order's rows are kept
+    and a collision is a query rather than a dropped row. Rows of live orders
+    have archived_order_id NULL; archiving an order points its rows at the
+    ArchivedOrder instead of deleting them.
+    """
+    __tablename__ = 'asn_imei'
+
+    id = Column(Integer, primary_key=True)
+    invoice = Column(String, nullable=False, index=True)
+    imei = Column(String(15), nullable=False, index=True)
+    source_row = Column(Integer, nullable=True)
+    source_column = Column(String, nullable=True)
+    source_sheet = Column(String, nullable=True)  # worksheet name for Excel ASNs
+    upload_id = Column(String(64), nullable=False, index=True)  # SHA-256 of the ASN file
+    archived_order_id = Column(Integer, nullable=True, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index('uq_asn_imei_live', 'invoice', 'imei', unique=True,
+              postgresql_where=text('archived_order_id IS NULL'), sqlite_where=text('archived_order_id IS NULL')),
+        Index('uq_asn_imei_archived', 'archived_order_id', 'imei', unique=True,
+              postgresql_where=text('archived_order_id IS NOT NULL'), sqlite_where=text('archived_order_id IS NOT NULL')),
+    )
+
 class OrderLineItem(Base):
     __tablename__ = 'order_line_items'
     
@@ -72,17 +200,94 @@ class ArchivedOrder(Base):
     order_data = Column(Text, nullable=True)  # JSON string of order line items
     total_qty = Column(Integer, nullable=True)
     unique_models = Column(Integer, nullable=True)
-    # Files
+    # Files (blob references shared with the order they were archived from)
     asn_filename = Column(String, nullable=True)
-    asn_file_data = Column(LargeBinary, nullable=True)
+    asn_file_hash = Column(String(64), ForeignKey('file_blob.sha256'), nullable=True, index=True)
+    asn_file_blob = _stored_blob(asn_file_hash)
+    asn_file_data = _unpacked_blob('asn_file_blob')
     imei_serial_filename = Column(String, nullable=True)
-    imei_serial_file_data = Column(LargeBinary, nullable=True)
+    imei_serial_file_hash = Column(String(64), ForeignKey('file_blob.sha256'), nullable=True, index=True)
+    imei_serial_file_blob = _stored_blob(imei_serial_file_hash)
+    imei_serial_file_data = _unpacked_blob('imei_serial_file_blob')
     # Metadata
     notes = Column(Text, nullable=True)
     archived_date = Column(DateTime, default=datetime.utcnow)
     archived_by = Column(String, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
 
+class UploadJob(Base):
+    """
+    A queued upload (parse, validate, index) run by the background workers in job_queue.py
+
+    Jobs are keyed on (kind, invoice, file hash), so submitting the same file
+    again while it is queued or running returns the existing job. The file is
+    kept here only until the job finishes.
+    """
+    __tablename__ = 'upload_job'
+    __table_args__ = (UniqueConstraint('kind', 'invoice', 'file_hash', name='uq_upload_job_file'),)
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False)  # 'asn' or 'imei_serial'
+    invoice = Column(String, nullable=False, index=True)
+    filename = Column(String, nullable=False)
+    file_hash = Column(String(64), nullable=False)  # SHA-256 of the file
+    file_data = Column(LargeBinary, nullable=True)
+    status = Column(String, nullable=False, default='queued', index=True)  # queued, running, done, failed
+    progress = Column(Float, nullable=True)
+    result = Column(Text, nullable=True)
+    error = Column(Text, nullable=True)
+    attempts = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)  # last sign of life from the worker running it
+    finished_at = Column(DateTime, nullable=True)
+
+class SchemaVersion(Base):
+    """One row per migration in MIGRATIONS applied to this database"""
+    __tablename__ = 'schema_version'
+
+    version = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False)
+    applied_at = Column(DateTime, default=datetime.utcnow)
+
+# PostgreSQL advisory lock held while the schema is created or migrated
+SCHEMA_LOCK_KEY = 0x494D4549
+
+# Set once this process has brought the schema up to date
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+# Columns create_or_update_reconciliation accepts as keywords
+RECONCILIATION_COLUMNS = frozenset(OrderReconciliation.__table__.columns.keys()) - {'id', 'invoice'}
+
+# Dialects whose INSERT supports ON CONFLICT DO UPDATE
+UPSERT_INSERTS = {
+    'postgresql': postgresql_insert,
+    'sqlite': sqlite_insert
+}
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+# Connection pool sizing and limits (pool settings are ignored for SQLite)
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '5'))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', '10'))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', '1800'))  # seconds; 0 disables
+DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', '0'))  # PostgreSQL only; 0 disables
+
+# Connection checkouts counted for the active unit of work (see unit_of_work)
+_checkouts = ContextVar('db_checkouts', default=None)
+
+# Session shared by every helper inside a unit of work
+_shared_session = ContextVar('db_shared_session', default=None)
+
+def _count_checkout(dbapi_connection, connection_record, connection_proxy):
+    counter = _checkouts.get()
+    if counter is not None:
+        counter['checkouts'] += 1
+
 @st.cache_resource
 def get_database_engine():
     """Create and cache the database engine"""
@@ -91,102 +296,251 @@ def get_database_engine():
         return None
     
     try:
-        engine = create_engine(database_url, pool_pre_ping=True)
+        options = {'pool_pre_ping': True}
+        if make_url(database_url).get_backend_name() != 'sqlite':
+            options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW)
+            if DB_POOL_RECYCLE:
+                options['pool_recycle'] = DB_POOL_RECYCLE
+        if DB_STATEMENT_TIMEOUT_MS and make_url(database_url).get_backend_name() == 'postgresql':
+            options['connect_args'] = {'options': f'-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}'}
+        engine = create_engine(database_url, **options)
+        event.listen(engine, 'checkout', _count_checkout)
         return engine
     except Exception as e:
         st.error(f"Database connection error: {str(e)}")
         return None
 
+@st.cache_resource
+def get_session_factory():
+    """Create and cache the session factory (None without a database)"""
+    engine = get_database_engine()
+    if engine is None:
+        return None
+    # Objects stay readable after commit; helpers return them detached
+    return sessionmaker(bind=engine, expire_on_commit=False)
+
+class _SharedSession(Session):
+    """
+    The session of a unit of work, bound to the one connection it holds
+
+    Helpers close their session when done. Here that detaches everything they
+    loaded and rolls back whatever they did not commit (a helper that failed
+    partway leaves its writes in the transaction, and on PostgreSQL an aborted
+    transaction), exactly as closing a private session would, but the
+    connection stays checked out for the next helper. unit_of_work() closes it
+    for real at the end.
+    """
+
+    def close(self):
+        # Detach first: rollback would expire the objects helpers return
+        self.expunge_all()
+        if self.get_transaction() is not None:
+            self.rollback()
+
+@contextmanager
+def unit_of_work():
+    """
+    Share one session (and its connection) between all database helpers called inside
+
+    Wrap one render in it: reads reuse the connection checked out by the first
+    query instead of checking out one per helper. Helpers still commit their own
+    writes. Worker threads are unaffected, since each thread has its own context.
+
+    Yields: dict whose 'checkouts' counts connection checkouts during the block
+    """
+    counter = {'checkouts': 0}
+    counter_token = _checkouts.set(counter)
+    engine = get_database_engine()
+    connection = None
+    if engine is not None:
+        try:
+            connection = engine.connect()
+        except Exception:
+            # Helpers fall back to their own sessions and report the error themselves
+            pass
+    session = _SharedSession(bind=connection, expire_on_commit=False) if connection is not None else None
+    session_token = _shared_session.set(session)
+    try:
+        yield counter
+    finally:
+        _shared_session.reset(session_token)
+        _checkouts.reset(counter_token)
+        if session is not None:
+            Session.close(session)
+            connection.close()
+
 def init_database():
-    """Initialize the database tables"""
+    """
+    Initialize the database tables
+
+    Creates tables and applies pending migrations once per process; later
+    calls (every rerun) only return the engine.
+    """
+    global _schema_ready
     engine = get_database_engine()
     if engine is None:
         st.warning("⚠️ Database not configured. Reconciliation and notes features will be unavailable.")
         return None
-    Base.metadata.create_all(engine)
-    
-    # Run migrations for existing databases
-    _run_migrations(engine)
+    if _schema_ready:
+        return engine
+
+    with _schema_lock:
+        if not _schema_ready:
+            try:
+                _run_migrations(engine)
+            except Exception as e:
+                st.error(f"Database migration failed: {str(e)}")
+                return None
+            _schema_ready = True
     
     return engine
 
 def _run_migrations(engine):
-    """Run database migrations for schema updates"""
-    from sqlalchemy import inspect, text
-    
-    inspector = inspect(engine)
-    
-    # Migration: Add asn_file_data column to order_reconciliation table
-    if 'order_reconciliation' in inspector.get_table_names():
-        columns = [col['name'] for col in inspector.get_columns('order_reconciliation')]
-        
-        if 'asn_file_data' not in columns:
-            try:
-                with engine.connect() as conn:
-                    conn.execute(text('ALTER TABLE order_reconciliation ADD COLUMN asn_file_data BYTEA'))
-                    conn.commit()
-            except Exception as e:
-                # Column might already exist or other error
-                pass
-        
-        # Migration: Add error_log column to order_reconciliation table
-        if 'error_log' not in columns:
-            try:
-                with engine.connect() as conn:
-                    conn.execute(text('ALTER TABLE order_reconciliation ADD COLUMN error_log TEXT'))
-                    conn.commit()
-            except Exception as e:
-                # Column might already exist or other error
-                pass
+    """
+    Create missing tables and apply pending MIGRATIONS in order
 
-        # Migration: Add IMEI/SERIAL tracking columns
-        if 'imei_serial_uploaded' not in columns:
-            try:
-                with engine.connect() as conn:
-                    conn.execute(text('ALTER TABLE order_reconciliation ADD COLUMN imei_serial_uploaded BOOLEAN DEFAULT FALSE'))
-                    conn.commit()
-            except Exception:
-                pass
+    Runs on one connection holding a PostgreSQL advisory lock, so replicas
+    starting together wait for each other instead of racing (SQLite has no
+    advisory locks and skips it). Each migration commits together with its
+    schema_version row; one that fails stops the run and is retried on the next
+    start.
+    """
+    with engine.connect() as conn:
+        use_lock = conn.dialect.name == 'postgresql'
+        if use_lock:
+            conn.execute(text('SELECT pg_advisory_lock(:key)'), {'key': SCHEMA_LOCK_KEY})
+            conn.commit()
+        try:
+            Base.metadata.create_all(conn)
+            conn.commit()
 
-        if 'imei_serial_filename' not in columns:
-            try:
-                with engine.connect() as conn:
-                    conn.execute(text('ALTER TABLE order_reconciliation ADD COLUMN imei_serial_filename VARCHAR'))
-                    conn.commit()
-            except Exception:
-                pass
+            applied = set(conn.execute(select(SchemaVersion.version)).scalars())
+            for version, name, migrate in MIGRATIONS:
+                if version in applied:
+                    continue
+                migrate(conn)
+                conn.execute(insert(SchemaVersion).values(version=version, name=name, applied_at=datetime.utcnow()))
+                conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            if use_lock:
+                conn.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': SCHEMA_LOCK_KEY})
+                conn.commit()
 
-        if 'imei_serial_file_data' not in columns:
-            try:
-                with engine.connect() as conn:
-                    conn.execute(text('ALTER TABLE order_reconciliation ADD COLUMN imei_serial_file_data BYTEA'))
-                    conn.commit()
-            except Exception:
-                pass
+def _columns(conn, table):
+    """Column names of a table, or None if it does not exist"""
+    inspector = inspect(conn)
+    if table not in inspector.get_table_names():
+        return None
+    return [col['name'] for col in inspector.get_columns(table)]
 
-        if 'imei_serial_upload_date' not in columns:
-            try:
-                with engine.connect() as conn:
-                    conn.execute(text('ALTER TABLE order_reconciliation ADD COLUMN imei_serial_upload_date TIMESTAMP'))
-                    conn.commit()
-            except Exception:
-                pass
+def _add_columns(conn, table, columns):
+    """ALTER TABLE ADD COLUMN for each (name, type) the table lacks"""
+    existing = _columns(conn, table)
+    if existing is None:
+        return
+    for name, column_type in columns:
+        if name not in existing:
+            conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {name} {column_type}'))
 
-        if 'imei_serial_count' not in columns:
-            try:
-                with engine.connect() as conn:
-                    conn.execute(text('ALTER TABLE order_reconciliation ADD COLUMN imei_serial_count INTEGER'))
-                    conn.commit()
-            except Exception:
-                pass
+# Migrations: each brings a database created by any earlier version up to date
+# and is a no-op where create_all already made the change
+
+def _migrate_reconciliation_columns(conn):
+    _add_columns(conn, 'order_reconciliation', [
+        ('error_log', 'TEXT'),
+        ('imei_serial_uploaded', 'BOOLEAN DEFAULT FALSE'),
+        ('imei_serial_filename', 'VARCHAR'),
+        ('imei_serial_upload_date', 'TIMESTAMP'),
+        ('imei_serial_count', 'INTEGER')
+    ])
+
+def _migrate_imei_index_archive(conn):
+    """Track archived orders in the IMEI index"""
+    _add_columns(conn, 'asn_imei', [('archived_order_id', 'INTEGER')])
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_asn_imei_archived_order_id ON asn_imei (archived_order_id)'))
+
+def _migrate_imei_index_sheet(conn):
+    """Record which worksheet of a multi-sheet ASN each IMEI came from"""
+    _add_columns(conn, 'asn_imei', [('source_sheet', 'VARCHAR')])
+
+def _migrate_upload_job_heartbeat(conn):
+    """Let running jobs report liveness, so only silent ones are requeued"""
+    _add_columns(conn, 'upload_job', [('heartbeat_at', 'TIMESTAMP')])
+
+def _migrate_imei_index_per_order(conn):
+    """
+    Make asn_imei unique per order instead of per IMEI
+
+    IMEIs the old unique index kept out of a second order are not restored
+    here; backfill_imei_index.py re-indexes orders whose rows fall short.
+    """
+    indexes = {index['name']: index for index in inspect(conn).get_indexes('asn_imei')}
+    if indexes.get('ix_asn_imei_imei', {}).get('unique'):
+        conn.execute(text('DROP INDEX ix_asn_imei_imei'))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_asn_imei_imei ON asn_imei (imei)'))
+    conn.execute(text('CREATE UNIQUE INDEX IF NOT EXISTS uq_asn_imei_live ON asn_imei (invoice, imei) '
+                      'WHERE archived_order_id IS NULL'))
+    conn.execute(text('CREATE UNIQUE INDEX IF NOT EXISTS uq_asn_imei_archived ON asn_imei (archived_order_id, imei) '
+                      'WHERE archived_order_id IS NOT NULL'))
+
+def _migrate_asn_imei_count(conn):
+    """Record how many IMEIs each ASN was indexed with, to tell a complete index from a partial one"""
+    _add_columns(conn, 'order_reconciliation', [('asn_imei_count', 'INTEGER')])
+
+def _migrate_file_blobs(conn):
+    """Move inline file contents into file_blob, leaving hash references"""
+    for table in ('order_reconciliation', 'archived_orders'):
+        for prefix in ('asn', 'imei_serial'):
+            _add_columns(conn, table, [(f'{prefix}_file_hash', 'VARCHAR(64) REFERENCES file_blob (sha256)')])
+            conn.execute(text(f'CREATE INDEX IF NOT EXISTS ix_{table}_{prefix}_file_hash ON {table} ({prefix}_file_hash)'))
+            conn.commit()
+            if f'{prefix}_file_data' in _columns(conn, table):
+                _move_inline_blobs(conn, table, prefix)
+
+# (version, name, function(connection)), applied in order; append new ones, never renumber
+MIGRATIONS = [
+    (1, 'reconciliation_columns', _migrate_reconciliation_columns),
+    (2, 'imei_index_archive', _migrate_imei_index_archive),
+    (3, 'imei_index_sheet', _migrate_imei_index_sheet),
+    (4, 'file_blobs', _migrate_file_blobs),
+    (5, 'upload_job_heartbeat', _migrate_upload_job_heartbeat),
+    (6, 'imei_index_per_order', _migrate_imei_index_per_order),
+    (7, 'asn_imei_count', _migrate_asn_imei_count),
+]
+
+def _move_inline_blobs(conn, table, prefix):
+    """
+    Convert one inline file column to blob references, BLOB_MIGRATION_BATCH rows per transaction
+
+    Each converted row gets its hash set and its inline copy cleared, so the
+    migration resumes where it stopped if interrupted and is a no-op once done.
+    """
+    data_column, hash_column = f'{prefix}_file_data', f'{prefix}_file_hash'
+    while True:
+        rows = conn.execute(text(
+            f'SELECT id, {data_column} FROM {table} WHERE {data_column} IS NOT NULL ORDER BY id LIMIT :limit'
+        ), {'limit': BLOB_MIGRATION_BATCH}).all()
+        if not rows:
+            return
+        for row_id, file_data in rows:
+            file_hash = _put_blob(conn, bytes(file_data))
+            conn.execute(text(
+                f'UPDATE {table} SET {hash_column} = :file_hash, {data_column} = NULL WHERE id = :id'
+            ), {'file_hash': file_hash, 'id': row_id})
+        conn.commit()
 
 def get_session():
-    """Get a new database session"""
-    engine = get_database_engine()
-    if engine is None:
+    """Get the unit of work's shared session, or a new database session outside one"""
+    shared = _shared_session.get()
+    if shared is not None:
+        return shared
+    factory = get_session_factory()
+    if factory is None:
         return None
-    Session = sessionmaker(bind=engine)
-    return Session()
+    return factory()
 
 def get_reconciliation_status(invoice):
     """Get reconciliation status for an invoice"""
@@ -199,38 +553,609 @@ def get_reconciliation_status(invoice):
     finally:
         session.close()
 
+def _upsert_reconciliation(session, invoice, values):
+    """
+    Insert or update an order's row and return it, without file contents
+
+    One INSERT ... ON CONFLICT (invoice) DO UPDATE ... RETURNING statement on
+    PostgreSQL and SQLite (3.35+); other databases read the row and update it
+    through the ORM.
+    """
+    dialect = session.get_bind().dialect
+    no_files = (defer(OrderReconciliation.asn_file_blob), defer(OrderReconciliation.imei_serial_file_blob))
+    if dialect.name in UPSERT_INSERTS and dialect.insert_returning:
+        statement = UPSERT_INSERTS[dialect.name](OrderReconciliation).values(invoice=invoice, **values)
+        statement = statement.on_conflict_do_update(index_elements=['invoice'], set_=values)
+        # populate_existing: a shared session may already hold the old row
+        return session.scalars(statement.returning(OrderReconciliation).options(*no_files),
+                               execution_options={'populate_existing': True}).one()
+
+    status = session.query(OrderReconciliation).options(*no_files).filter_by(invoice=invoice).first()
+    if not status:
+        status = OrderReconciliation(invoice=invoice)
+        session.add(status)
+    for key, value in values.items():
+        setattr(status, key, value)
+    session.flush()
+    return status
+
+def _upsert_reconciliations(session, rows):
+    """
+    Insert or update several orders' rows; each dict has invoice and the same other keys
+
+    One multi-row INSERT ... ON CONFLICT (invoice) DO UPDATE on PostgreSQL and
+    SQLite; other databases go through _upsert_reconciliation row by row.
+    """
+    dialect = session.get_bind().dialect
+    if dialect.name in UPSERT_INSERTS:
+        statement = UPSERT_INSERTS[dialect.name](OrderReconciliation)
+        statement = statement.on_conflict_do_update(
+            index_elements=['invoice'],
+            set_={key: statement.excluded[key] for key in rows[0] if key != 'invoice'}
+        )
+        session.execute(statement, rows)
+        return
+    for row in rows:
+        _upsert_reconciliation(session, row['invoice'], {key: value for key, value in row.items() if key != 'invoice'})
+
 def create_or_update_reconciliation(invoice, **kwargs):
-    """Create or update reconciliation record"""
+    """
+    Create or update reconciliation record
+
+    Saved with a single upsert (see _upsert_reconciliation), so concurrent saves
+    of a new invoice cannot race on its unique constraint. asn_file_data and
+    imei_serial_file_data are stored in file_blob, and an ASN's IMEIs are indexed
+    in the same transaction. Keywords that are not columns are ignored.
+
+    Returns: the saved record, without file contents (see get_reconciliation_status)
+    """
     session = get_session()
     if session is None:
         return None
     try:
-        status = session.query(OrderReconciliation).filter_by(invoice=invoice).first()
-        
-        if not status:
-            status = OrderReconciliation(invoice=invoice)
-            session.add(status)
-        
-        for key, value in kwargs.items():
-            if hasattr(status, key):
-                setattr(status, key, value)
-        
-        status.updated_at = datetime.utcnow()
-        session.commit()
-        session.refresh(status)
-        # Make the object accessible after session close
+        # File contents go to file_blob; the order keeps only the hash
+        files = {key: kwargs.pop(key) for key in ('asn_file_data', 'imei_serial_file_data') if key in kwargs}
+        values = {key: value for key, value in kwargs.items() if key in RECONCILIATION_COLUMNS}
+
+        replaced_hashes = []
+        if files:
+            previous = session.query(
+                OrderReconciliation.asn_filename, OrderReconciliation.asn_file_hash, OrderReconciliation.imei_serial_file_hash
+            ).filter_by(invoice=invoice).first()
+            if previous:
+                replaced_hashes = [previous.asn_file_hash, previous.imei_serial_file_hash]
+                if 'asn_file_data' in files:
+                    # The stored name tells the IMEI indexer the file type
+                    values.setdefault('asn_filename', previous.asn_filename)
+            for key, file_data in files.items():
+                values[key.replace('_file_data', '_file_hash')] = _put_blob(session, file_data) if file_data else None
+
+        # Index the ASN's IMEIs in the same transaction as the file itself
+        if 'asn_file_data' in files:
+            if files['asn_file_data']:
+                values['asn_imei_count'], values['error_log'] = _store_asn_imeis(
+                    session, invoice, files['asn_file_data'], values.get('asn_filename')
+                )
+            else:
+                _live_asn_imeis(session, invoice).delete()
+                values['asn_imei_count'] = None
+
+        values['updated_at'] = datetime.utcnow()
+        status = _upsert_reconciliation(session, invoice, values)
+        _release_blobs(session, replaced_hashes)
+
+        # Detach before committing, which would otherwise expire the loaded attributes
         session.expunge(status)
+        session.commit()
         return status
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+def save_asn_batch(uploads):
+    """
+    Store a batch of already-parsed ASNs in one transaction
+
+    uploads: list of dicts with invoice, filename, file_data and records (from
+    extract_imei_records). Either the whole batch is stored or, if anything
+    fails, none of it is.
+    Returns: dict invoice -> error log (IMEI collisions) or None per ASN; None if no database
+    """
+    session = get_session()
+    if session is None:
+        return None
+    try:
+        now = datetime.utcnow()
+        replaced_hashes = list(session.execute(select(OrderReconciliation.asn_file_hash).where(
+            OrderReconciliation.invoice.in_([upload['invoice'] for upload in uploads])
+        )).scalars())
+        file_hashes = _put_blobs(session, [upload['file_data'] for upload in uploads])
+        logs = _index_asn_batch(session, [
+            (upload['invoice'], file_hash, upload['records']) for upload, file_hash in zip(uploads, file_hashes)
+        ])
+        _upsert_reconciliations(session, [
+            {
+                'invoice': upload['invoice'],
+                'asn_uploaded': True,
+                'asn_filename': upload['filename'],
+                'asn_file_hash': file_hash,
+                'asn_upload_date': now,
+                'updated_at': now,
+                'asn_imei_count': len(upload['records']),
+                'error_log': logs[upload['invoice']]
+            }
+            for upload, file_hash in zip(uploads, file_hashes)
+        ])
+
+        _release_blobs(session, replaced_hashes)
+        session.commit()
+        return logs
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+def _dialect(executor):
+    """Dialect of a Session or Connection"""
+    return executor.dialect if isinstance(executor, Connection) else executor.get_bind().dialect
+
+def _put_blobs(session, files):
+    """
+    Store file contents in file_blob, skipping files already there
+
+    One SELECT of the hashes already stored and one multi-row INSERT for the
+    rest, however many files. Works on a Session or a Connection.
+
+    Blobs this transaction is about to reference stay locked until it commits,
+    so a concurrent _release_blobs can't delete them in between: the SELECT
+    takes FOR SHARE row locks on PostgreSQL, and on SQLite, which locks the
+    whole database rather than rows, the write lock is taken before reading.
+    The INSERT skips hashes another session stored first; those are locked on
+    a second pass.
+    Returns: list of SHA-256 hex digests referencing the blobs, in the order of files
+    """
+    file_hashes = [hashlib.sha256(file_data).hexdigest() for file_data in files]
+    contents = dict(zip(file_hashes, files))
+    dialect = _dialect(session)
+    if dialect.name == 'sqlite':
+        # A write that matches no rows, only to hold SQLite's write lock from here to commit
+        session.execute(update(FileBlob.__table__).where(false()).values(size=FileBlob.size))
+
+    pending = set(contents)
+    while pending:
+        stored = set(session.execute(
+            select(FileBlob.sha256).where(FileBlob.sha256.in_(pending)).with_for_update(read=True)
+        ).scalars())
+        missing = pending - stored
+        if not missing:
+            break
+        now = datetime.utcnow()
+        rows = [
+            {'sha256': file_hash, 'data': pack_file_data(contents[file_hash]),
+             'size': len(contents[file_hash]), 'created_at': now}
+            for file_hash in missing
+        ]
+        if dialect.name in UPSERT_INSERTS and dialect.insert_returning:
+            statement = UPSERT_INSERTS[dialect.name](FileBlob.__table__).on_conflict_do_nothing()
+            inserted = set(session.execute(statement.returning(FileBlob.sha256), rows).scalars())
+        else:
+            session.execute(insert(FileBlob.__table__), rows)
+            inserted = missing
+        pending = missing - inserted
+    return file_hashes
+
+def _put_blob(session, file_data):
+    """_put_blobs for one file; returns its SHA-256 hex digest"""
+    return _put_blobs(session, [file_data])[0]
+
+def _release_blobs(session, hashes=None):
+    """
+    Delete blobs that no order or archived order references, in one statement
+
+    hashes limits the check to blobs just dereferenced; None sweeps every
+    unreferenced blob. Blobs locked by a transaction about to reference them
+    (see _put_blobs) are skipped rather than waited on; a later sweep removes
+    any that end up unreferenced.
+    """
+    conditions = [
+        ~exists().where(column == FileBlob.sha256)
+        for column in (OrderReconciliation.asn_file_hash, OrderReconciliation.imei_serial_file_hash,
+                       ArchivedOrder.asn_file_hash, ArchivedOrder.imei_serial_file_hash)
+    ]
+    if hashes is not None:
+        hashes = {file_hash for file_hash in hashes if file_hash}
+        if not hashes:
+            return
+        conditions.append(FileBlob.sha256.in_(hashes))
+    unreferenced = select(FileBlob.sha256).where(*conditions).with_for_update(skip_locked=True)
+    session.execute(delete(FileBlob).where(FileBlob.sha256.in_(unreferenced)),
+                    execution_options={'synchronize_session': False})
+
+def _live_asn_imeis(session, invoice):
+    """Query for the index rows of a live (not archived) order"""
+    return session.query(AsnImei).filter(AsnImei.invoice == invoice, AsnImei.archived_order_id.is_(None))
+
+def _find_imei_owners(session, imeis):
+    """
+    Look up which orders already hold each IMEI
+
+    One indexed lookup per IMEI, batched into IN lists. Call after clearing the
+    order's own rows, so that only other orders are found.
+    Returns: dict imei -> list of (invoice, archived_order_id or None)
+    """
+    owners = {}
+    for start in range(0, len(imeis), 1000):
+        batch = imeis[start:start + 1000]
+        query = session.query(AsnImei.imei, AsnImei.invoice, AsnImei.archived_order_id).filter(AsnImei.imei.in_(batch))
+        for imei, invoice, archived_order_id in query:
+            owners.setdefault(imei, []).append((invoice, archived_order_id))
+    return owners
+
+def _describe_collisions(owners):
+    labels = sorted({f"{invoice} (archived)" if archived_order_id else invoice
+                     for holders in owners.values() for invoice, archived_order_id in holders})
+    more = f" and {len(labels) - 5} more" if len(labels) > 5 else ""
+    return f"{len(owners)} IMEIs already on another order's ASN: {', '.join(labels[:5])}{more}"
+
+def _index_asn_batch(session, uploads):
+    """
+    _store_asn_imeis for several live orders in a fixed number of statements
+
+    uploads: list of (invoice, upload id, records from extract_imei_records).
+    One DELETE clears the orders' old rows, owners are looked up for all IMEIs
+    together and the new rows go in one multi-row INSERT. Within the batch an
+    IMEI is reported against the uploads before it, as when stored one at a time.
+    Returns: dict invoice -> error log (IMEI collisions) or None
+    """
+    session.execute(delete(AsnImei).where(
+        AsnImei.invoice.in_([invoice for invoice, _, _ in uploads]), AsnImei.archived_order_id.is_(None)
+    ), execution_options={'synchronize_session': False})
+    owners = _find_imei_owners(session, [record[0] for _, _, records in uploads for record in records])
+
+    now = datetime.utcnow()
+    rows = []
+    logs = {}
+    for invoice, upload_id, records in uploads:
+        taken = {}
+        for imei, source_row, source_column, source_sheet in records:
+            if imei in owners:
+                taken[imei] = list(owners[imei])
+            owners.setdefault(imei, []).append((invoice, None))
+            rows.append({
+                'invoice': invoice,
+                'imei': imei,
+                'source_row': source_row,
+                'source_column': source_column,
+                'source_sheet': source_sheet,
+                'upload_id': upload_id,
+                'archived_order_id': None,
+                'created_at': now
+            })
+        logs[invoice] = _describe_collisions(taken) if taken else None
+    if rows:
+        session.execute(insert(AsnImei), rows)
+    return logs
+
+def _store_asn_imeis(session, invoice, file_data, filename, archived_order_id=None, records=None):
+    """
+    Replace the asn_imei rows for an order with the IMEIs in its ASN file
+
+    Every IMEI is indexed; those also indexed under another live or archived
+    order are collisions and are reported. Pass records (from
+    extract_imei_records) when the file was already parsed elsewhere.
+    Returns: tuple (number of IMEIs indexed, or None if the file could not be
+    parsed; error log message describing collisions or parse errors, or None)
+    """
+    if archived_order_id is None:
+        _live_asn_imeis(session, invoice).delete()
+    else:
+        session.query(AsnImei).filter_by(archived_order_id=archived_order_id).delete()
+
+    if records is None:
+        records, error = extract_imei_records(file_data, filename or '')
+        if error:
+            return None, error
+    if not records:
+        return 0, None
+
+    taken = _find_imei_owners(session, [record[0] for record in records])
+
+    upload_id = hashlib.sha256(file_data).hexdigest()
+    now = datetime.utcnow()
+    session.execute(insert(AsnImei), [
+        {
+            'invoice': invoice,
+            'imei': imei,
+            'source_row': source_row,
+            'source_column': source_column,
+            'source_sheet': source_sheet,
+            'upload_id': upload_id,
+            'archived_order_id': archived_order_id,
+            'created_at': now
+        }
+        for imei, source_row, source_column, source_sheet in records
+    ])
+
+    return len(records), _describe_collisions(taken) if taken else None
+
+def get_asn_imeis(invoice):
+    """Get the IMEIs indexed for a live invoice's ASN, in file order"""
+    session = get_session()
+    if session is None:
+        return []
+    try:
+        rows = _live_asn_imeis(session, invoice).with_entities(AsnImei.imei).order_by(AsnImei.id).all()
+        return [row.imei for row in rows]
+    finally:
+        session.close()
+
+def get_asn_imei_counts(invoices=None):
+    """Get the number of indexed ASN IMEIs per live invoice"""
+    session = get_session()
+    if session is None:
+        return {}
+    try:
+        query = session.query(AsnImei.invoice, func.count(AsnImei.id)).filter(
+            AsnImei.archived_order_id.is_(None)
+        ).group_by(AsnImei.invoice)
+        if invoices is not None:
+            query = query.filter(AsnImei.invoice.in_(list(invoices)))
+        return dict(query.all())
+    finally:
+        session.close()
+
+def get_asn_imei_sheet_counts(invoice):
+    """
+    Get the number of indexed ASN IMEIs per worksheet for a live invoice
+
+    Returns: list of (sheet name, count) in workbook order; empty for CSV/TXT ASNs
+    """
+    session = get_session()
+    if session is None:
+        return []
+    try:
+        return [
+            (sheet, count)
+            for sheet, count, _ in session.query(
+                AsnImei.source_sheet, func.count(AsnImei.id), func.min(AsnImei.id)
+            ).filter(
+                AsnImei.invoice == invoice,
+                AsnImei.archived_order_id.is_(None),
+                AsnImei.source_sheet.isnot(None)
+            ).group_by(AsnImei.source_sheet).order_by(func.min(AsnImei.id)).all()
+        ]
+    finally:
+        session.close()
+
+def enqueue_upload_job(kind, invoice, filename, file_data):
+    """
+    Queue an upload for the background workers
+
+    Idempotent on the file's SHA-256: if the same file is already queued or
+    running for this invoice, that job is returned. A finished or failed job for
+    the same file is reset and queued again.
+    Returns: job id, or None if the database is not available
+    """
+    session = get_session()
+    if session is None:
+        return None
+    file_hash = hashlib.sha256(file_data).hexdigest()
+    try:
+        for _ in range(2):
+            job = session.query(UploadJob).options(defer(UploadJob.file_data)).filter_by(
+                kind=kind, invoice=invoice, file_hash=file_hash
+            ).first()
+            if job is not None and job.status in (JOB_QUEUED, JOB_RUNNING):
+                return job.id
+            if job is None:
+                job = UploadJob(kind=kind, invoice=invoice, file_hash=file_hash)
+                session.add(job)
+            job.filename = filename
+            job.file_data = file_data
+            job.status = JOB_QUEUED
+            job.progress = None
+            job.result = None
+            job.error = None
+            job.attempts = 0
+            job.created_at = datetime.utcnow()
+            job.started_at = None
+            job.heartbeat_at = None
+            job.finished_at = None
+            try:
+                session.commit()
+                return job.id
+            except IntegrityError:
+                # Another session queued the same file first; return its job
+                session.rollback()
+        return None
+    finally:
+        session.close()
+
+def claim_next_job():
+    """
+    Take the oldest queued job and mark it running
+
+    The status check in the UPDATE makes the claim atomic, so several workers
+    (or processes) never run the same job.
+    Returns: UploadJob with its file, detached from the session, or None
+    """
+    session = get_session()
+    if session is None:
+        return None
+    try:
+        candidates = session.query(UploadJob.id).filter_by(status=JOB_QUEUED).order_by(UploadJob.id).limit(5).all()
+        for (job_id,) in candidates:
+            now = datetime.utcnow()
+            claimed = session.execute(
+                update(UploadJob)
+                .where(UploadJob.id == job_id, UploadJob.status == JOB_QUEUED)
+                .values(status=JOB_RUNNING, started_at=now, heartbeat_at=now, attempts=UploadJob.attempts + 1)
+            ).rowcount
+            session.commit()
+            if claimed:
+                job = session.get(UploadJob, job_id)
+                session.expunge(job)
+                return job
+        return None
+    finally:
+        session.close()
+
+def update_job(job_id, **values):
+    """Set fields on a job (status, progress, heartbeat_at, result, error, finished_at, file_data)"""
+    session = get_session()
+    if session is None:
+        return
+    try:
+        session.execute(update(UploadJob).where(UploadJob.id == job_id).values(**values))
+        session.commit()
+    finally:
+        session.close()
+
+def requeue_stale_jobs(older_than):
+    """
+    Put running jobs whose last heartbeat is before `older_than` back in the queue
+
+    A job stays 'running' if its process died mid-job; this lets it resume
+    after a restart. A live worker keeps heartbeat_at fresh however long the
+    job takes, so slow jobs are never run twice at once.
+    Returns: number of jobs requeued
+    """
+    session = get_session()
+    if session is None:
+        return 0
+    try:
+        count = session.execute(
+            update(UploadJob)
+            .where(UploadJob.status == JOB_RUNNING,
+                   func.coalesce(UploadJob.heartbeat_at, UploadJob.started_at) < older_than)
+            .values(status=JOB_QUEUED, progress=None)
+        ).rowcount
+        session.commit()
+        return count
+    finally:
+        session.close()
+
+def get_upload_jobs(invoice):
+    """
+    Get the latest job per upload kind for an invoice, without file data
+
+    Returns: list of UploadJob, newest first
+    """
+    session = get_session()
+    if session is None:
+        return []
+    try:
+        jobs = session.query(UploadJob).options(defer(UploadJob.file_data)).filter_by(
+            invoice=invoice
+        ).order_by(UploadJob.created_at.desc(), UploadJob.id.desc()).all()
+        latest = {}
+        for job in jobs:
+            latest.setdefault(job.kind, job)
+        for job in latest.values():
+            session.expunge(job)
+        return list(latest.values())
+    finally:
+        session.close()
+
+def delete_upload_job(job_id):
+    """Remove a finished or failed job (dismissed in the UI)"""
+    session = get_session()
+    if session is None:
+        return False
+    try:
+        session.query(UploadJob).filter(
+            UploadJob.id == job_id, UploadJob.status.in_([JOB_DONE, JOB_FAILED])
+        ).delete(synchronize_session=False)
+        session.commit()
+        return True
+    finally:
+        session.close()
+
+def backfill_imei_index(rebuild=False, progress=None):
+    """
+    Build the IMEI index from ASN files already stored in the database
+
+    Streams one blob at a time: only ids are listed up front, and each ASN is
+    loaded, indexed and committed before the next is read, so memory stays
+    bounded by the largest single file. Unless rebuild is True, live orders whose
+    index rows match their asn_imei_count and archived orders with any index rows
+    are skipped. A live order's asn_imei_count and error_log are set as an upload
+    would set them. progress(done, total), if given, is called after each file.
+
+    Returns: dict with 'indexed' (files), 'imeis' (rows) and 'collisions' (messages)
+    """
+    session = get_session()
+    if session is None:
+        return {'indexed': 0, 'imeis': 0, 'collisions': []}
+    try:
+        live = session.query(OrderReconciliation.id, OrderReconciliation.invoice, OrderReconciliation.asn_imei_count).filter(
+            OrderReconciliation.asn_file_hash.isnot(None)
+        ).order_by(OrderReconciliation.id).all()
+        archived_ids = [row.id for row in session.query(ArchivedOrder.id).filter(
+            ArchivedOrder.asn_file_hash.isnot(None)
+        ).order_by(ArchivedOrder.id)]
+        indexed_live = dict(session.query(AsnImei.invoice, func.count(AsnImei.id)).filter(
+            AsnImei.archived_order_id.is_(None)
+        ).group_by(AsnImei.invoice).all())
+        complete_live = {row.id for row in live if row.asn_imei_count is not None
+                         and indexed_live.get(row.invoice, 0) == row.asn_imei_count}
+        indexed_archived = {row.archived_order_id for row in session.query(AsnImei.archived_order_id).filter(
+            AsnImei.archived_order_id.isnot(None)
+        ).distinct()}
+
+        jobs = [('live', row.id) for row in live] + [('archived', record_id) for record_id in archived_ids]
+        summary = {'indexed': 0, 'imeis': 0, 'collisions': []}
+
+        for done, (kind, record_id) in enumerate(jobs, start=1):
+            if kind == 'live':
+                skip = record_id in complete_live
+                model, archived_order_id = OrderReconciliation, None
+            else:
+                skip = record_id in indexed_archived
+                model, archived_order_id = ArchivedOrder, record_id
+
+            if not skip or rebuild:
+                invoice, filename, file_data = session.query(
+                    model.invoice, model.asn_filename, model.asn_file_blob
+                ).filter_by(id=record_id).one()
+                count, message = _store_asn_imeis(session, invoice, unpack_file_data(file_data), filename, archived_order_id)
+                del file_data
+                if kind == 'live':
+                    session.query(OrderReconciliation).filter_by(id=record_id).update(
+                        {'asn_imei_count': count, 'error_log': message}, synchronize_session=False
+                    )
+                session.commit()
+                summary['indexed'] += 1
+                if message:
+                    summary['collisions'].append(f"{invoice}: {message}")
+
+            if progress:
+                progress(done, len(jobs))
+
+        summary['imeis'] = session.query(func.count(AsnImei.id)).scalar()
+        return summary
     finally:
         session.close()
 
 def get_all_reconciliations():
-    """Get all reconciliation records"""
+    """
+    Get all reconciliation records, without file contents
+
+    The asn_file_data and imei_serial_file_data blobs are deferred and cannot be
+    read from the returned objects; use get_reconciliation_status(invoice) to load
+    a single record with its files.
+    """
     session = get_session()
     if session is None:
         return []
     try:
-        return session.query(OrderReconciliation).order_by(OrderReconciliation.created_at.desc()).all()
+        return session.query(OrderReconciliation).options(
+            defer(OrderReconciliation.asn_file_blob),
+            defer(OrderReconciliation.imei_serial_file_blob)
+        ).order_by(OrderReconciliation.created_at.desc()).all()
     finally:
         session.close()
 
@@ -243,18 +1168,22 @@ def save_order_line_items(invoice, line_items):
         # Delete existing line items for this invoice
         session.query(OrderLineItem).filter_by(invoice=invoice).delete()
         
-        # Add new line items
-        for item in line_items:
-            line_item = OrderLineItem(
-                invoice=invoice,
-                model=item.get('MODEL'),
-                capacity=item.get('CAPACITY'),
-                grade=item.get('GRADE'),
-                expected_qty=item.get('EXPECTED_QTY'),
-                received_qty=item.get('RECEIVED_QTY'),
-                variance=item.get('VARIANCE')
-            )
-            session.add(line_item)
+        # Add new line items in one multi-row INSERT
+        if line_items:
+            now = datetime.utcnow()
+            session.execute(insert(OrderLineItem), [
+                {
+                    'invoice': invoice,
+                    'model': item.get('MODEL'),
+                    'capacity': item.get('CAPACITY'),
+                    'grade': item.get('GRADE'),
+                    'expected_qty': item.get('EXPECTED_QTY'),
+                    'received_qty': item.get('RECEIVED_QTY'),
+                    'variance': item.get('VARIANCE'),
+                    'created_at': now
+                }
+                for item in line_items
+            ])
         
         session.commit()
     finally:
@@ -353,19 +1282,27 @@ def clear_asn_data(invoice):
     if session is None:
         return False
     try:
-        recon = session.query(OrderReconciliation).filter_by(invoice=invoice).first()
+        recon = session.query(OrderReconciliation).options(
+            defer(OrderReconciliation.asn_file_blob),
+            defer(OrderReconciliation.imei_serial_file_blob)
+        ).filter_by(invoice=invoice).first()
         if recon:
+            released_hash = recon.asn_file_hash
             recon.asn_uploaded = False
             recon.asn_filename = None
-            recon.asn_file_data = None
+            recon.asn_file_hash = None
             recon.asn_upload_date = None
+            recon.asn_imei_count = None
+            recon.error_log = None
             recon.reconciled = False
             recon.reconciled_date = None
             recon.updated_at = datetime.utcnow()
+            _release_blobs(session, [released_hash])
             session.commit()
             
-            # Also clear line items
+            # Also clear line items and indexed IMEIs
             session.query(OrderLineItem).filter_by(invoice=invoice).delete()
+            _live_asn_imeis(session, invoice).delete()
             session.commit()
             return True
         return False
@@ -373,36 +1310,44 @@ def clear_asn_data(invoice):
         session.close()
 
 def clear_all_asn_data():
-    """Clear ASN data for all invoices that have ASN uploaded"""
+    """
+    Clear ASN data for all invoices that have ASN uploaded
+
+    Set-based: the line items and indexed IMEIs of those orders are deleted by
+    subquery, the orders updated in one statement and their blobs released in
+    another, so no rows are loaded and the statement count does not grow with
+    the number of orders.
+    Returns: number of orders cleared
+    """
     session = get_session()
     if session is None:
         return 0
     try:
-        # Get all invoices with ASN data
-        asn_invoices = session.query(OrderReconciliation).filter_by(asn_uploaded=True).all()
-        count = len(asn_invoices)
-        
-        if count == 0:
-            return 0
-        
+        asn_invoices = select(OrderReconciliation.invoice).where(OrderReconciliation.asn_uploaded.is_(True))
+        no_sync = {'synchronize_session': False}
+
+        # Line items and indexed IMEIs, only for those invoices
+        session.execute(delete(OrderLineItem).where(OrderLineItem.invoice.in_(asn_invoices)), execution_options=no_sync)
+        session.execute(delete(AsnImei).where(
+            AsnImei.invoice.in_(asn_invoices), AsnImei.archived_order_id.is_(None)
+        ), execution_options=no_sync)
+
         # Clear ASN-related fields only for invoices with ASN data
-        session.query(OrderReconciliation).filter_by(asn_uploaded=True).update({
-            'asn_uploaded': False,
-            'asn_filename': None,
-            'asn_file_data': None,
-            'asn_upload_date': None,
-            'reconciled': False,
-            'reconciled_date': None,
-            'updated_at': datetime.utcnow()
-        })
+        count = session.execute(update(OrderReconciliation).where(OrderReconciliation.asn_uploaded.is_(True)).values(
+            asn_uploaded=False,
+            asn_filename=None,
+            asn_file_hash=None,
+            asn_upload_date=None,
+            asn_imei_count=None,
+            error_log=None,
+            reconciled=False,
+            reconciled_date=None,
+            updated_at=datetime.utcnow()
+        ), execution_options=no_sync).rowcount
+
+        if count:
+            _release_blobs(session)
         session.commit()
-        
-        # Clear line items only for those invoices
-        invoice_list = [r.invoice for r in asn_invoices]
-        if invoice_list:
-            session.query(OrderLineItem).filter(OrderLineItem.invoice.in_(invoice_list)).delete(synchronize_session=False)
-            session.commit()
-        
         return count
     finally:
         session.close()
@@ -413,22 +1358,32 @@ def clear_imei_serial_data(invoice):
     if session is None:
         return False
     try:
-        recon = session.query(OrderReconciliation).filter_by(invoice=invoice).first()
+        recon = session.query(OrderReconciliation).options(
+            defer(OrderReconciliation.asn_file_blob),
+            defer(OrderReconciliation.imei_serial_file_blob)
+        ).filter_by(invoice=invoice).first()
         if recon:
+            released_hash = recon.imei_serial_file_hash
             recon.imei_serial_uploaded = False
             recon.imei_serial_filename = None
-            recon.imei_serial_file_data = None
+            recon.imei_serial_file_hash = None
             recon.imei_serial_upload_date = None
             recon.imei_serial_count = None
             recon.updated_at = datetime.utcnow()
+            _release_blobs(session, [released_hash])
             session.commit()
             return True
         return False
     finally:
         session.close()
 
-def get_order_statistics():
-    """Get statistics about all orders"""
+def get_order_statistics(invoices=None):
+    """
+    Get statistics about all orders, or only the given invoices
+
+    Counted in the database with a single aggregate query, so no rows (or file
+    blobs) are transferred.
+    """
     session = get_session()
     if session is None:
         return {
@@ -438,25 +1393,43 @@ def get_order_statistics():
             'pending': 0
         }
     try:
-        all_orders = session.query(OrderReconciliation).all()
+        def count_where(condition):
+            return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+
+        query = session.query(
+            func.count(OrderReconciliation.id),
+            count_where(OrderReconciliation.asn_uploaded.is_(True)),
+            count_where(OrderReconciliation.imei_serial_uploaded.is_(True))
+        )
+        if invoices is not None:
+            query = query.filter(OrderReconciliation.invoice.in_(list(invoices)))
+        total_orders, with_asn, with_imei = query.one()
         return {
-            'total_orders': len(all_orders),
-            'with_asn': sum(1 for o in all_orders if o.asn_uploaded),
-            'with_imei': sum(1 for o in all_orders if o.imei_serial_uploaded),
-            'pending': sum(1 for o in all_orders if not o.asn_uploaded)
+            'total_orders': total_orders,
+            'with_asn': with_asn,
+            'with_imei': with_imei,
+            'pending': total_orders - with_asn
         }
     finally:
         session.close()
 
 def archive_order(invoice, order_data, total_qty, unique_models, notes=None):
-    """Archive an order with all its data"""
+    """
+    Archive an order with all its data
+
+    Returns: the id of the new ArchivedOrder, or None if no database; load the
+    record itself with get_archived_order(invoice)
+    """
     import json
     session = get_session()
     if session is None:
         return None
     try:
-        # Get reconciliation data
-        recon = session.query(OrderReconciliation).filter_by(invoice=invoice).first()
+        # Get reconciliation data; files are moved by reference, never loaded
+        recon = session.query(OrderReconciliation).options(
+            defer(OrderReconciliation.asn_file_blob),
+            defer(OrderReconciliation.imei_serial_file_blob)
+        ).filter_by(invoice=invoice).first()
 
         # Convert numpy types to Python native types
         total_qty_int = int(total_qty) if total_qty is not None else None
@@ -469,9 +1442,9 @@ def archive_order(invoice, order_data, total_qty, unique_models, notes=None):
             total_qty=total_qty_int,
             unique_models=unique_models_int,
             asn_filename=recon.asn_filename if recon else None,
-            asn_file_data=recon.asn_file_data if recon else None,
+            asn_file_hash=recon.asn_file_hash if recon else None,
             imei_serial_filename=recon.imei_serial_filename if recon else None,
-            imei_serial_file_data=recon.imei_serial_file_data if recon else None,
+            imei_serial_file_hash=recon.imei_serial_file_hash if recon else None,
             notes=notes or (recon.notes if recon else None),
             archived_date=datetime.utcnow()
         )
@@ -482,21 +1455,34 @@ def archive_order(invoice, order_data, total_qty, unique_models, notes=None):
         if recon:
             session.delete(recon)
 
-        # Delete line items
+        # Delete line items; indexed IMEIs move to the archived order
         session.query(OrderLineItem).filter_by(invoice=invoice).delete()
+        _live_asn_imeis(session, invoice).update(
+            {'archived_order_id': archived.id}, synchronize_session=False
+        )
 
+        archived_id = archived.id
         session.commit()
-        return archived
+        return archived_id
     finally:
         session.close()
 
 def get_all_archived_orders():
-    """Get all archived orders"""
+    """
+    Get all archived orders, without file contents
+
+    File blobs are deferred; use get_archived_order(invoice) to load one
+    archived order with its files.
+    """
     session = get_session()
     if session is None:
         return []
     try:
-        return session.query(ArchivedOrder).order_by(ArchivedOrder.archived_date.desc()).all()
+        return session.query(ArchivedOrder).options(
+            defer(ArchivedOrder.order_data),
+            defer(ArchivedOrder.asn_file_blob),
+            defer(ArchivedOrder.imei_serial_file_blob)
+        ).order_by(ArchivedOrder.archived_date.desc()).all()
     finally:
         session.close()
 
@@ -516,9 +1502,14 @@ def delete_archived_order(invoice):
     if session is None:
         return False
     try:
-        archived = session.query(ArchivedOrder).filter_by(invoice=invoice).first()
+        archived = session.query(ArchivedOrder).options(
+            defer(ArchivedOrder.asn_file_blob),
+            defer(ArchivedOrder.imei_serial_file_blob)
+        ).filter_by(invoice=invoice).first()
         if archived:
+            session.query(AsnImei).filter_by(archived_order_id=archived.id).delete()
             session.delete(archived)
+            _release_blobs(session, [archived.asn_file_hash, archived.imei_serial_file_hash])
             session.commit()
             return True
         return False
@@ -0,0 +1,79 @@
+from collections import Counter
+
+import pandas as pd
+
+# Row labels used in discrepancy reports
+STATUS_MATCHED = 'MATCHED'
+STATUS_ASN_ONLY = 'ASN ONLY'
+STATUS_SCANNED_ONLY = 'SCANNED ONLY'
+STATUS_ASN_DUPLICATE = 'DUPLICATE ON ASN'
+STATUS_SCANNED_DUPLICATE = 'DUPLICATE IN SCAN'
+
+
+def match_imeis(asn_imeis, scanned_imeis):
+    """
+    Reconcile the IMEIs on an ASN against the IMEIs actually scanned
+
+    Both inputs are lists of every occurrence (duplicates included). Each side
+    is loaded once into a hash table, so matching is linear in the number of
+    IMEIs. Output lists keep first-seen file order.
+
+    Returns: dict with
+        'matched': IMEIs on both the ASN and the scan (ASN order)
+        'asn_only': IMEIs on the ASN that were not scanned
+        'scanned_only': IMEIs scanned that are not on the ASN
+        'asn_duplicates': IMEIs listed more than once on the ASN
+        'scanned_duplicates': IMEIs scanned more than once
+    """
+    # dicts double as ordered sets: first-seen order, O(1) membership
+    asn_unique = dict.fromkeys(asn_imeis)
+    scanned_unique = dict.fromkeys(scanned_imeis)
+
+    matched = []
+    asn_only = []
+    for imei in asn_unique:
+        (matched if imei in scanned_unique else asn_only).append(imei)
+
+    return {
+        'matched': matched,
+        'asn_only': asn_only,
+        'scanned_only': [imei for imei in scanned_unique if imei not in asn_unique],
+        'asn_duplicates': _duplicates(asn_imeis, asn_unique),
+        'scanned_duplicates': _duplicates(scanned_imeis, scanned_unique)
+    }
+
+
+def _duplicates(imeis, unique_imeis):
+    """IMEIs occurring more than once, in first-seen order; skips counting when there are none"""
+    if len(imeis) == len(unique_imeis):
+        return []
+    return [imei for imei, count in Counter(imeis).items() if count > 1]
+
+
+def is_fully_matched(result):
+    """True when every ASN IMEI was scanned, nothing extra was scanned and nothing is duplicated"""
+    return not (result['asn_only'] or result['scanned_only']
+                or result['asn_duplicates'] or result['scanned_duplicates'])
+
+
+def discrepancy_report(result, include_matched=False):
+    """
+    Flatten a match_imeis result into one row per IMEI and status, for CSV export
+
+    Returns: DataFrame with IMEI and STATUS columns
+    """
+    sections = [
+        (STATUS_ASN_ONLY, result['asn_only']),
+        (STATUS_SCANNED_ONLY, result['scanned_only']),
+        (STATUS_ASN_DUPLICATE, result['asn_duplicates']),
+        (STATUS_SCANNED_DUPLICATE, result['scanned_duplicates'])
+    ]
+    if include_matched:
+        sections.append((STATUS_MATCHED, result['matched']))
+
+    imeis = []
+    statuses = []
+    for status, section_imeis in sections:
+        imeis.extend(section_imeis)
+        statuses.extend([status] * len(section_imeis))
+    return pd.DataFrame({'IMEI': imeis, 'STATUS': statuses})
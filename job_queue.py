@@ -0,0 +1,187 @@
+"""
+Background upload jobs
+
+Saving an ASN or IMEI/Serial file queues an UploadJob row (see database.py) and
+returns at once; a small pool of worker threads in the server process picks
+jobs up, parses, validates and indexes the file, and stores the result. The
+page polls job status. Because jobs live in the database, a job interrupted by
+a restart (its heartbeat stops) is put back in the queue and run again.
+"""
+
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from database import (
+    claim_next_job,
+    create_or_update_reconciliation,
+    get_asn_imeis,
+    requeue_stale_jobs,
+    update_job,
+    JOB_DONE,
+    JOB_FAILED,
+    JOB_QUEUED,
+)
+from imei_extractor import extract_imeis_cached, split_valid_imeis
+
+JOB_KIND_ASN = 'asn'
+JOB_KIND_IMEI_SERIAL = 'imei_serial'
+
+# Worker threads per server process
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+
+# Seconds between queue checks when idle (jobs queued by other processes)
+JOB_POLL_SECONDS = 2.0
+
+# A running job with no heartbeat for this long is assumed orphaned by a crash and requeued
+JOB_STALE_MINUTES = int(os.environ.get('JOB_STALE_MINUTES', '10'))
+
+# Seconds between heartbeats written while a job runs
+JOB_HEARTBEAT_SECONDS = 30
+
+# Attempts before a job that keeps failing is marked failed
+JOB_MAX_ATTEMPTS = 3
+
+# Minimum seconds between progress writes to the job row
+PROGRESS_INTERVAL_SECONDS = 0.5
+
+
+def _run_asn_job(job, progress):
+    """Store the ASN and index its IMEIs, then report valid/invalid counts"""
+    status = create_or_update_reconciliation(
+        invoice=job.invoice,
+        asn_uploaded=True,
+        asn_filename=job.filename,
+        asn_file_data=job.file_data,
+        asn_upload_date=job.created_at
+    )
+    if status is None:
+        raise RuntimeError("Database not available")
+    progress(0.9)
+
+    valid, invalid = split_valid_imeis(get_asn_imeis(job.invoice))
+    summary = f"{len(valid):,} IMEIs indexed"
+    if invalid:
+        summary += f", {len(invalid):,} fail the check digit"
+    if status.error_log:
+        summary += f". {status.error_log}"
+    return summary
+
+
+def _run_imei_serial_job(job, progress):
+    """Count the scanned IMEIs (warming the extraction cache) and store the file"""
+    _, scanned_count, error = extract_imeis_cached(job.file_data, job.filename, progress=progress)
+    if error:
+        raise ValueError(error)
+    status = create_or_update_reconciliation(
+        invoice=job.invoice,
+        imei_serial_uploaded=True,
+        imei_serial_filename=job.filename,
+        imei_serial_file_data=job.file_data,
+        imei_serial_upload_date=job.created_at,
+        imei_serial_count=scanned_count
+    )
+    if status is None:
+        raise RuntimeError("Database not available")
+    return f"{scanned_count:,} IMEIs"
+
+
+def _heartbeat(job_id, stop):
+    """Touch the job's heartbeat every JOB_HEARTBEAT_SECONDS until stop is set"""
+    while not stop.wait(JOB_HEARTBEAT_SECONDS):
+        try:
+            update_job(job_id, heartbeat_at=datetime.utcnow())
+        except Exception:
+            # A missed beat is harmless; the job is only requeued after JOB_STALE_MINUTES
+            pass
+
+
+JOB_HANDLERS = {
+    JOB_KIND_ASN: _run_asn_job,
+    JOB_KIND_IMEI_SERIAL: _run_imei_serial_job,
+}
+
+
+class JobQueue:
+    """
+    Worker threads that run queued upload jobs
+
+    notify() wakes an idle worker right after a job is queued; otherwise workers
+    check the queue every JOB_POLL_SECONDS, which also picks up jobs queued by
+    other server processes.
+    """
+
+    def __init__(self, workers=JOB_WORKERS):
+        self.workers = workers
+        self._wake = threading.Event()
+        self._threads = []
+        self._started = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return self
+            self._started = True
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"upload-job-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def notify(self):
+        self._wake.set()
+
+    def _work(self):
+        next_stale_check = 0.0
+        while True:
+            if time.monotonic() >= next_stale_check:
+                # Resume jobs orphaned by a crash or restart
+                try:
+                    requeue_stale_jobs(datetime.utcnow() - timedelta(minutes=JOB_STALE_MINUTES))
+                except Exception:
+                    pass
+                next_stale_check = time.monotonic() + 60
+
+            try:
+                job = claim_next_job()
+            except Exception:
+                job = None
+            if job is None:
+                self._wake.wait(JOB_POLL_SECONDS)
+                self._wake.clear()
+                continue
+            self.run_job(job)
+
+    def run_job(self, job):
+        """Run one claimed job and record its outcome, heartbeating while it runs"""
+        last_write = [0.0]
+
+        def progress(fraction):
+            now = time.monotonic()
+            if now - last_write[0] >= PROGRESS_INTERVAL_SECONDS:
+                last_write[0] = now
+                update_job(job.id, progress=min(fraction, 1.0), heartbeat_at=datetime.utcnow())
+
+        # Handlers can go minutes without reporting progress (large workbooks)
+        stop_heartbeat = threading.Event()
+        threading.Thread(target=_heartbeat, args=(job.id, stop_heartbeat),
+                         name=f"upload-job-heartbeat-{job.id}", daemon=True).start()
+        try:
+            handler = JOB_HANDLERS[job.kind]
+            result = handler(job, progress)
+        except Exception as e:
+            retry = (job.attempts or 0) < JOB_MAX_ATTEMPTS and not isinstance(e, (KeyError, ValueError))
+            update_job(
+                job.id,
+                status=JOB_QUEUED if retry else JOB_FAILED,
+                error=str(e),
+                finished_at=None if retry else datetime.utcnow()
+            )
+            return
+        finally:
+            stop_heartbeat.set()
+        # The file now lives on the order; drop the job's copy
+        update_job(job.id, status=JOB_DONE, progress=1.0, result=result,
+                   file_data=None, finished_at=datetime.utcnow())
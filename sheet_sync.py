@@ -0,0 +1,340 @@
+"""
+Incremental Google Sheets sync
+
+Keeps a local snapshot of a worksheet's values (plus a hash per row) on disk and
+refreshes it with a single ranged read of the header rows and the tail of the
+sheet, instead of downloading the whole worksheet on every refresh. The same
+read re-checks the row just above the tail and, optionally, one key column
+(such as INVOICE) over the rest of the sheet, so rows inserted, deleted or
+re-sorted above the tail force a full pull instead of corrupting the snapshot.
+
+SheetFrameCache sits on top: it persists the last good DataFrame as Parquet and
+serves it immediately (on cold start or once stale) while a background thread
+refreshes it.
+
+Works with any worksheet-like object that provides:
+    row_count          number of rows in the sheet grid
+    get_all_values()   list of rows (lists of strings), padded to equal width
+    batch_get(ranges)  list of value lists, one per A1 range (e.g. "1:2", "98:1000", "A3:A97")
+so a plain in-memory fake can stand in for a gspread Worksheet.
+"""
+
+import hashlib
+import os
+import pickle
+import threading
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from cache_manager import SingleFlight
+
+# Where worksheet snapshots are persisted between syncs and restarts
+SNAPSHOT_DIR = os.environ.get('SHEET_SNAPSHOT_DIR', '.sheet_cache')
+
+# Trailing rows re-read and re-hashed on each incremental sync, to pick up edits
+# to recent orders (status, qty) as well as newly appended rows
+VERIFY_WINDOW_ROWS = int(os.environ.get('SHEET_SYNC_VERIFY_ROWS', '200'))
+
+# Incremental syncs between forced full pulls, which catch edits to older rows
+FULL_SYNC_EVERY = int(os.environ.get('SHEET_FULL_SYNC_EVERY', '12'))
+
+_sync_lock = threading.Lock()
+
+
+def snapshot_path(sheet_id, worksheet_gid):
+    """Path of the snapshot file for one worksheet"""
+    return os.path.join(SNAPSHOT_DIR, f'{sheet_id}_{worksheet_gid}.pkl')
+
+
+def frame_path(sheet_id, worksheet_gid):
+    """Path of the persisted DataFrame for one worksheet"""
+    return os.path.join(SNAPSHOT_DIR, f'{sheet_id}_{worksheet_gid}.parquet')
+
+
+def _row_hash(row):
+    return hashlib.blake2b('\x1f'.join(row).encode('utf-8'), digest_size=8).digest()
+
+
+def _column_letter(index):
+    """A1 column letters for a 0-based column index (0 -> A, 26 -> AA)"""
+    letters = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+
+def _key_column_index(header_values, key_column):
+    """Position of key_column in the header rows (lowest header row first), or None"""
+    if key_column is None:
+        return None
+    for row in reversed(header_values):
+        if key_column in row:
+            return row.index(key_column)
+    return None
+
+
+def _pad(row, width):
+    row = [str(value) for value in row]
+    return row + [''] * (width - len(row))
+
+
+def load_snapshot(path):
+    """Load a persisted snapshot, or None if missing or unreadable"""
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except Exception:
+        return None
+
+
+def save_snapshot(path, snapshot):
+    """Persist a snapshot atomically so a crash never leaves a half-written file"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def _full_snapshot(worksheet):
+    rows = worksheet.get_all_values()
+    width = max((len(row) for row in rows), default=0)
+    rows = [_pad(row, width) for row in rows]
+    return {
+        'rows': rows,
+        'hashes': [_row_hash(row) for row in rows],
+        'width': width,
+        'syncs_since_full': 0,
+        'synced_at': datetime.utcnow()
+    }
+
+
+def _incremental_snapshot(worksheet, snapshot, header_rows, key_column=None):
+    """
+    Merge new and changed tail rows into a copy of the snapshot
+
+    The tail read starts one row early: that anchor row, and the key_column
+    values of every row above it, must still match the snapshot, otherwise rows
+    were inserted, deleted or re-sorted above the tail and the merge would
+    misplace them.
+
+    Returns: tuple (new snapshot, number of new or changed rows), or (None, 0)
+    when a full pull is required (header changed, rows moved above the tail,
+    sheet got shorter or wider).
+    """
+    rows = snapshot['rows']
+    width = snapshot['width']
+    known = len(rows)
+    if known <= header_rows:
+        return None, 0
+
+    start = max(header_rows + 1, known - VERIFY_WINDOW_ROWS + 1)
+    end = max(worksheet.row_count, known)
+    anchor = start - 1 if start - 1 > header_rows else None
+    ranges = [f'1:{header_rows}', f'{anchor or start}:{end}']
+    key_index = _key_column_index(rows[:header_rows], key_column)
+    if anchor is not None and key_index is not None and anchor > header_rows + 1:
+        letter = _column_letter(key_index)
+        ranges.append(f'{letter}{header_rows + 1}:{letter}{anchor - 1}')
+    values = worksheet.batch_get(ranges)
+    header_values, tail_values = values[0], list(values[1])
+
+    if any(len(row) > width for row in list(header_values) + tail_values):
+        return None, 0
+    if [_pad(row, width) for row in header_values] != rows[:header_rows]:
+        return None, 0
+    if anchor is not None:
+        anchor_row = _pad(tail_values.pop(0) if tail_values else [], width)
+        if _row_hash(anchor_row) != snapshot['hashes'][anchor - 1]:
+            return None, 0
+    if len(ranges) > 2:
+        # The API drops trailing empty cells, so pad the column back to full length
+        keys = [str(row[0]) if row else '' for row in values[2]]
+        keys += [''] * (anchor - 1 - header_rows - len(keys))
+        if keys != [row[key_index] for row in rows[header_rows:anchor - 1]]:
+            return None, 0
+    if len(tail_values) < known - start + 1:
+        # Rows were deleted (or cleared) at the end of the sheet
+        return None, 0
+
+    merged_rows = rows[:start - 1]
+    merged_hashes = snapshot['hashes'][:start - 1]
+    changed_rows = 0
+    for index, row in enumerate(tail_values, start=start - 1):
+        row = _pad(row, width)
+        row_hash = _row_hash(row)
+        if index >= known or snapshot['hashes'][index] != row_hash:
+            changed_rows += 1
+        merged_rows.append(row)
+        merged_hashes.append(row_hash)
+
+    return {
+        'rows': merged_rows,
+        'hashes': merged_hashes,
+        'width': width,
+        'syncs_since_full': snapshot.get('syncs_since_full', 0) + 1,
+        'synced_at': datetime.utcnow()
+    }, changed_rows
+
+
+def sync_worksheet(worksheet, path, header_rows=2, key_column=None, full=False):
+    """
+    Bring the local snapshot of a worksheet up to date and return its values
+
+    Uses one ranged read of the header rows plus the last VERIFY_WINDOW_ROWS
+    known rows and anything appended after them (and, when key_column names a
+    header, that column for the rows above). Falls back to a full
+    get_all_values() when there is no snapshot, full is True, the header
+    changed, rows moved above the tail, the sheet shrank, or FULL_SYNC_EVERY
+    incremental syncs have passed.
+
+    Returns: tuple (list of rows, sync info dict with mode, changed_rows, synced_at)
+    """
+    with _sync_lock:
+        snapshot = load_snapshot(path)
+        new_snapshot = None
+        changed_rows = 0
+
+        if not full and snapshot is not None and snapshot.get('syncs_since_full', 0) < FULL_SYNC_EVERY:
+            new_snapshot, changed_rows = _incremental_snapshot(worksheet, snapshot, header_rows, key_column)
+
+        if new_snapshot is None:
+            new_snapshot = _full_snapshot(worksheet)
+            mode = 'full'
+            changed_rows = len(new_snapshot['rows'])
+        else:
+            mode = 'incremental'
+
+        save_snapshot(path, new_snapshot)
+
+        return new_snapshot['rows'], {
+            'mode': mode,
+            'changed_rows': changed_rows,
+            'synced_at': new_snapshot['synced_at']
+        }
+
+
+class SheetFrameCache:
+    """
+    Last good sheet DataFrame, served immediately and refreshed in the background
+
+    fetch(full=False) must return (DataFrame, error message or None) and must not
+    call Streamlit APIs, since it runs on a worker thread; full=True asks it to
+    skip any incremental shortcut and re-read everything. prepare(df), if given, builds
+    derived data (such as a per-invoice index) stored alongside each new frame.
+
+    On cold start the frame persisted at `path` is served right away. Once the
+    data is older than max_age_seconds, get() keeps returning it while a single
+    background thread fetches a replacement; only a cold start with nothing on
+    disk waits for the fetch.
+    """
+
+    def __init__(self, fetch, path, max_age_seconds=300, prepare=None):
+        self.fetch = fetch
+        self.path = path
+        self.max_age_seconds = max_age_seconds
+        self.prepare = prepare
+        self.df = None
+        self.extra = None
+        self.error = None
+        self.as_of = None  # UTC datetime the data was fetched from Google Sheets
+        self.refreshing = False
+        self._loaded_at = 0.0  # monotonic time of the last fetch or disk load
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+        self._load_persisted()
+
+    def _load_persisted(self):
+        try:
+            df = pd.read_parquet(self.path)
+            as_of = datetime.utcfromtimestamp(os.path.getmtime(self.path))
+        except Exception:
+            return
+        self._set_frame(df, as_of)
+        # Disk data is of unknown age relative to the sheet, so refresh on first use
+        self._loaded_at = 0.0
+
+    def _set_frame(self, df, as_of):
+        extra = self.prepare(df) if self.prepare else None
+        with self._lock:
+            self.df, self.extra, self.as_of = df, extra, as_of
+            self.error = None
+            self._loaded_at = time.monotonic()
+
+    def _persist(self, df):
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp_path = f'{self.path}.tmp'
+            df.to_parquet(tmp_path)
+            os.replace(tmp_path, self.path)
+        except Exception:
+            # The on-disk copy is only an optimization
+            pass
+
+    def refresh(self, full=False):
+        """
+        Fetch from the sheet now (blocking); keeps the previous frame on failure
+
+        Concurrent calls of the same kind (several sessions pressing Refresh, or
+        background refreshes racing each other) share one upstream fetch. A full
+        refresh never joins an incremental one already in flight.
+        """
+        return self._flight.do('full_refresh' if full else 'refresh', self._fetch_and_store, full)
+
+    def _fetch_and_store(self, full=False):
+        df, error = self.fetch(full=full)
+        if error is None and df is not None:
+            self._set_frame(df, datetime.utcnow())
+            self._persist(df)
+        else:
+            with self._lock:
+                self.error = error
+                self._loaded_at = time.monotonic()
+        return error
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        finally:
+            with self._lock:
+                self.refreshing = False
+
+    def is_stale(self):
+        return time.monotonic() - self._loaded_at > self.max_age_seconds
+
+    def clear(self):
+        """Invalidate: the next get() refreshes in the background (data stays servable)"""
+        with self._lock:
+            self._loaded_at = 0.0
+
+    def stats(self):
+        return {
+            'rows': 0 if self.df is None else len(self.df),
+            'as_of': self.as_of,
+            'refreshing': self.refreshing
+        }
+
+    def get(self):
+        """
+        Get the current frame without waiting on Google Sheets when possible
+
+        Returns: tuple (DataFrame, prepared extra data, error message if any)
+        """
+        if self.df is None:
+            # Nothing to serve yet: cold start with no snapshot on disk
+            self.refresh()
+        elif self.is_stale():
+            with self._lock:
+                start = not self.refreshing
+                self.refreshing = True
+            if start:
+                threading.Thread(target=self._refresh_in_background, daemon=True).start()
+
+        with self._lock:
+            if self.df is None:
+                return None, None, self.error or "Sheet data is still loading"
+            return self.df, self.extra, None
@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pytest
+
+# Modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    """SQLite file the db fixture opens; override it to start from an existing database"""
+    return tmp_path / 'test.db'
+
+
+@pytest.fixture
+def db(db_path, monkeypatch):
+    """The database module on a migrated SQLite database at db_path"""
+    import database
+
+    monkeypatch.setenv('DATABASE_URL', f"sqlite:///{db_path}")
+    monkeypatch.setattr(database, '_schema_ready', False)
+    database.get_database_engine.clear()
+    database.get_session_factory.clear()
+    engine = database.init_database()
+    assert engine is not None
+    yield database
+    engine.dispose()
+    database.get_database_engine.clear()
+    database.get_session_factory.clear()
@@ -0,0 +1,110 @@
+"""
+Content-addressed file storage (file_blob) against a temporary SQLite database
+
+Run with: python -m pytest tests
+"""
+
+import hashlib
+import os
+
+import pytest
+from sqlalchemy import select
+
+ASN = b'IMEI\n356938035643809\n356938035643817\n'
+OTHER_ASN = b'IMEI\n356938035643825\n'
+SCANNED = b'356938035643809\n'
+
+
+def _blob_hashes(db):
+    session = db.get_session()
+    try:
+        return set(session.execute(select(db.FileBlob.sha256)).scalars())
+    finally:
+        session.close()
+
+
+def _upload(db, invoice, asn=ASN, scanned=None):
+    values = {'asn_uploaded': True, 'asn_filename': 'asn.csv', 'asn_file_data': asn}
+    if scanned is not None:
+        values.update(imei_serial_uploaded=True, imei_serial_filename='scan.txt', imei_serial_file_data=scanned)
+    return db.create_or_update_reconciliation(invoice, **values)
+
+
+def test_identical_uploads_share_one_blob(db):
+    first = _upload(db, 'INV-1')
+    second = _upload(db, 'INV-2')
+    batch = db.save_asn_batch([{'invoice': 'INV-3', 'filename': 'asn.csv', 'file_data': ASN, 'records': []}])
+    assert batch == {'INV-3': None}
+
+    assert first.asn_file_hash == second.asn_file_hash == hashlib.sha256(ASN).hexdigest()
+    assert _blob_hashes(db) == {first.asn_file_hash}
+    assert db.get_reconciliation_status('INV-3').asn_file_data == ASN
+
+
+def test_blob_is_released_with_its_last_reference(db):
+    asn_hash = _upload(db, 'INV-1').asn_file_hash
+    _upload(db, 'INV-2')
+
+    # Replacing one order's file keeps the blob the other still uses
+    other_hash = _upload(db, 'INV-1', asn=OTHER_ASN).asn_file_hash
+    assert _blob_hashes(db) == {asn_hash, other_hash}
+
+    db.clear_asn_data('INV-2')
+    assert _blob_hashes(db) == {other_hash}
+
+    db.clear_all_asn_data()
+    assert _blob_hashes(db) == set()
+
+
+def test_archived_orders_keep_their_blobs_until_deleted(db):
+    recon = _upload(db, 'INV-1', scanned=SCANNED)
+    assert db.archive_order('INV-1', [{'MODEL': 'X', 'QTY': 2}], 2, 1)
+    assert _blob_hashes(db) == {recon.asn_file_hash, recon.imei_serial_file_hash}
+
+    archived = db.get_archived_order('INV-1')
+    assert (archived.asn_file_data, archived.imei_serial_file_data) == (ASN, SCANNED)
+
+    assert db.delete_archived_order('INV-1')
+    assert _blob_hashes(db) == set()
+
+
+def test_pack_round_trip_compresses_text_and_keeps_zipped_files_raw(db, monkeypatch):
+    text = ASN * 1000
+    incompressible = os.urandom(4096)  # like an XLSX, already zipped
+
+    codecs = [db.CODEC_ZLIB] + ([db.CODEC_ZSTD] if db.HAS_ZSTD else [])
+    for codec in codecs:
+        monkeypatch.setattr(db, 'HAS_ZSTD', codec == db.CODEC_ZSTD)
+        packed = db.pack_file_data(text)
+        assert packed[:len(db.BLOB_MAGIC) + 1] == db.BLOB_MAGIC + codec
+        assert len(packed) < len(text) / 10
+        assert db.unpack_file_data(packed) == text
+
+    packed = db.pack_file_data(incompressible)
+    assert packed == db.BLOB_MAGIC + db.CODEC_RAW + incompressible
+    assert db.unpack_file_data(packed) == incompressible
+    assert db.unpack_file_data(db.pack_file_data(b'')) == b''
+
+
+def test_unpack_passes_through_blobs_stored_before_compression(db):
+    assert db.unpack_file_data(ASN) == ASN
+    assert db.unpack_file_data(memoryview(ASN)) == ASN
+    assert db.unpack_file_data(None) is None
+
+
+def test_zstd_blob_without_zstandard_is_an_error(db, monkeypatch):
+    monkeypatch.setattr(db, 'HAS_ZSTD', False)
+    with pytest.raises(RuntimeError, match='install zstandard'):
+        db.unpack_file_data(db.BLOB_MAGIC + db.CODEC_ZSTD + b'\x28\xb5\x2f\xfd')
+
+
+def test_stored_blob_is_packed_and_read_back_unpacked(db):
+    recon = _upload(db, 'INV-1', asn=ASN * 1000)
+    session = db.get_session()
+    try:
+        blob = session.get(db.FileBlob, recon.asn_file_hash)
+        stored, size = bytes(blob.data), blob.size
+    finally:
+        session.close()
+    assert stored.startswith(db.BLOB_MAGIC) and len(stored) < size == len(ASN) * 1000
+    assert db.get_reconciliation_status('INV-1').asn_file_data == ASN * 1000
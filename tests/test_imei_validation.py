@@ -0,0 +1,78 @@
+"""
+Vectorized IMEI validation and content-based IMEI column detection
+
+Run with: python -m pytest tests
+"""
+
+import random
+
+import numpy as np
+import pandas as pd
+
+from imei_extractor import _profile_imei_columns, validate_imei, validate_imeis
+
+
+def _imeis(count, valid=True, seed=0):
+    """IMEIs starting with 35 whose check digit is right (or, with valid=False, wrong)"""
+    rng = random.Random(seed)
+    imeis = []
+    for _ in range(count):
+        body = '35' + ''.join(rng.choice('0123456789') for _ in range(12))
+        digits = [body + str(check) for check in range(10)]
+        imeis.append(next(imei for imei in digits if validate_imei(imei) == valid))
+    return imeis
+
+
+def _assert_matches_scalar(values):
+    mask = validate_imeis(values)
+    assert mask.dtype == np.bool_ and len(mask) == len(values)
+    assert mask.tolist() == [validate_imei(value) for value in values]
+
+
+def test_vectorized_matches_scalar_on_well_formed_strings():
+    values = _imeis(500) + _imeis(500, valid=False, seed=1)
+    random.Random(2).shuffle(values)
+    _assert_matches_scalar(values)
+    assert validate_imeis(values).sum() == 500
+
+
+def test_vectorized_matches_scalar_on_mixed_input():
+    valid = _imeis(3)
+    values = valid + [
+        '456938035643809',           # does not start with 35
+        '35693803564380',            # 14 digits
+        '3569380356438090',          # 16 digits
+        '35693803564380X',           # non-digit in the check position
+        '3569380:5643809',           # characters just above '9' must not pass as digits
+        '3569380/5643809',           # or just below '0'
+        f' {valid[0]} ',             # surrounding whitespace is stripped
+        int(valid[1]),               # numbers are validated as their digits
+        '',
+        None,
+        0,
+    ]
+    _assert_matches_scalar(values)
+    assert validate_imeis(values).tolist()[-5:] == [True, True, False, False, False]
+
+
+def test_vectorized_handles_empty_and_wrong_length_only_input():
+    assert validate_imeis([]).tolist() == []
+    _assert_matches_scalar(['1', '35', '3' * 20])
+
+
+def test_profiling_picks_luhn_valid_columns_best_first():
+    imeis = _imeis(20)
+    df = pd.DataFrame({
+        'Order Ref': _imeis(20, valid=False, seed=3),            # 15 digits, 35..., bad check digit
+        'Device': [f"IMEI: {imei}" for imei in imeis],           # IMEIs inside text
+        'Mixed': imeis[:12] + ['n/a'] * 8,                       # 60% IMEIs
+        'Qty': [1] * 20,
+        'Empty': [None] * 20,
+    })
+    assert _profile_imei_columns(df) == ['Device', 'Mixed']
+
+
+def test_profiling_samples_only_the_first_non_empty_rows():
+    df = pd.DataFrame({'Codes': [None] * 5 + _imeis(10) + ['x'] * 30})
+    assert _profile_imei_columns(df, sample_rows=10) == ['Codes']
+    assert _profile_imei_columns(df, sample_rows=40) == []
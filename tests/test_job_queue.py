@@ -0,0 +1,112 @@
+"""
+Upload job queue against a temporary SQLite database
+
+Run with: python -m pytest tests
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+import job_queue
+from database import JOB_DONE, JOB_FAILED
+from job_queue import JobQueue, JOB_KIND_ASN, JOB_MAX_ATTEMPTS
+
+ASN = b'IMEI\n356938035643809\n356938035643817\n'
+
+
+def _job(db, job_id):
+    session = db.get_session()
+    try:
+        job = session.get(db.UploadJob, job_id)
+        session.expunge(job)
+        return job
+    finally:
+        session.close()
+
+
+def test_job_is_claimed_once(db):
+    job_id = db.enqueue_upload_job(JOB_KIND_ASN, 'INV-1', 'asn.csv', ASN)
+    job = db.claim_next_job()
+    assert (job.id, job.status, job.attempts, job.file_data) == (job_id, db.JOB_RUNNING, 1, ASN)
+    assert job.heartbeat_at == job.started_at
+    assert db.claim_next_job() is None
+
+
+def test_asn_job_stores_the_file_and_finishes(db):
+    job_id = db.enqueue_upload_job(JOB_KIND_ASN, 'INV-1', 'asn.csv', ASN)
+    JobQueue().run_job(db.claim_next_job())
+    job = _job(db, job_id)
+    assert (job.status, job.result, job.file_data) == (db.JOB_DONE, '2 IMEIs indexed', None)
+    assert db.get_asn_imeis('INV-1') == ['356938035643809', '356938035643817']
+    assert db.get_reconciliation_status('INV-1').asn_file_data == ASN
+
+
+def test_failing_job_is_retried_then_failed(db, monkeypatch):
+    def fail(job, progress):
+        raise RuntimeError("database went away")
+
+    monkeypatch.setitem(job_queue.JOB_HANDLERS, JOB_KIND_ASN, fail)
+    job_id = db.enqueue_upload_job(JOB_KIND_ASN, 'INV-1', 'asn.csv', ASN)
+    for attempt in range(1, JOB_MAX_ATTEMPTS + 1):
+        JobQueue().run_job(db.claim_next_job())
+        job = _job(db, job_id)
+        assert job.attempts == attempt
+        assert job.error == "database went away"
+        assert job.status == (db.JOB_FAILED if attempt == JOB_MAX_ATTEMPTS else db.JOB_QUEUED)
+    assert job.finished_at is not None
+    assert db.claim_next_job() is None
+
+
+def test_bad_file_fails_without_retry(db, monkeypatch):
+    def reject(job, progress):
+        raise ValueError("Unsupported file type: pdf")
+
+    monkeypatch.setitem(job_queue.JOB_HANDLERS, JOB_KIND_ASN, reject)
+    job_id = db.enqueue_upload_job(JOB_KIND_ASN, 'INV-1', 'asn.pdf', ASN)
+    JobQueue().run_job(db.claim_next_job())
+    job = _job(db, job_id)
+    assert (job.status, job.attempts) == (db.JOB_FAILED, 1)
+
+
+def test_only_jobs_with_a_stale_heartbeat_are_requeued(db):
+    job_id = db.enqueue_upload_job(JOB_KIND_ASN, 'INV-1', 'asn.csv', ASN)
+    db.claim_next_job()
+    cutoff = datetime.utcnow() - timedelta(minutes=10)
+
+    # Started long ago but still heartbeating: a slow job, not a dead one
+    db.update_job(job_id, started_at=cutoff - timedelta(hours=1), heartbeat_at=datetime.utcnow())
+    assert db.requeue_stale_jobs(cutoff) == 0
+    assert _job(db, job_id).status == db.JOB_RUNNING
+
+    db.update_job(job_id, heartbeat_at=cutoff - timedelta(minutes=1))
+    assert db.requeue_stale_jobs(cutoff) == 1
+    assert _job(db, job_id).status == db.JOB_QUEUED
+    assert db.claim_next_job().attempts == 2
+
+
+def test_running_job_without_heartbeat_falls_back_to_start_time(db):
+    job_id = db.enqueue_upload_job(JOB_KIND_ASN, 'INV-1', 'asn.csv', ASN)
+    db.claim_next_job()
+    cutoff = datetime.utcnow() - timedelta(minutes=10)
+    db.update_job(job_id, started_at=cutoff - timedelta(minutes=1), heartbeat_at=None)
+    assert db.requeue_stale_jobs(cutoff) == 1
+
+
+@pytest.mark.parametrize('finished', [JOB_DONE, JOB_FAILED])
+def test_enqueue_is_idempotent_per_file(db, finished):
+    job_id = db.enqueue_upload_job(JOB_KIND_ASN, 'INV-1', 'asn.csv', ASN)
+    assert db.enqueue_upload_job(JOB_KIND_ASN, 'INV-1', 'renamed.csv', ASN) == job_id
+    db.claim_next_job()
+    assert db.enqueue_upload_job(JOB_KIND_ASN, 'INV-1', 'asn.csv', ASN) == job_id
+    assert _job(db, job_id).status == db.JOB_RUNNING
+
+    # A finished job for the same file is reset and queued again under the same id
+    db.update_job(job_id, status=finished, error='old error', finished_at=datetime.utcnow())
+    assert db.enqueue_upload_job(JOB_KIND_ASN, 'INV-1', 'asn.csv', ASN) == job_id
+    job = _job(db, job_id)
+    assert (job.status, job.attempts, job.error, job.finished_at) == (db.JOB_QUEUED, 0, None, None)
+
+    # Another file, or the same file for another invoice, is a new job
+    assert db.enqueue_upload_job(JOB_KIND_ASN, 'INV-1', 'asn.csv', ASN + b'356938035643825\n') != job_id
+    assert db.enqueue_upload_job(JOB_KIND_ASN, 'INV-2', 'asn.csv', ASN) != job_id
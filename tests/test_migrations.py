@@ -0,0 +1,85 @@
+"""
+Upgrading a database created by the first release (files stored inline on each row)
+
+Run with: python -m pytest tests
+"""
+
+import hashlib
+import sqlite3
+
+import pytest
+from sqlalchemy import select
+
+ASN = b'IMEI\n356938035643809\n356938035643817\n'
+SCANNED = b'356938035643809\n'
+
+# The two tables that held file contents, as the first release created them
+BASELINE_SCHEMA = """
+CREATE TABLE order_reconciliation (
+    id INTEGER PRIMARY KEY, invoice VARCHAR NOT NULL UNIQUE, reconciled BOOLEAN, reconciled_date DATETIME,
+    asn_uploaded BOOLEAN, asn_filename VARCHAR, asn_file_data BLOB, asn_upload_date DATETIME,
+    imei_serial_uploaded BOOLEAN, imei_serial_filename VARCHAR, imei_serial_file_data BLOB,
+    imei_serial_upload_date DATETIME, imei_serial_count INTEGER, notes TEXT, error_log TEXT,
+    created_at DATETIME, updated_at DATETIME
+);
+CREATE TABLE archived_orders (
+    id INTEGER PRIMARY KEY, invoice VARCHAR NOT NULL, order_data TEXT, total_qty INTEGER, unique_models INTEGER,
+    asn_filename VARCHAR, asn_file_data BLOB, imei_serial_filename VARCHAR, imei_serial_file_data BLOB,
+    notes TEXT, archived_date DATETIME, archived_by VARCHAR, created_at DATETIME
+);
+"""
+
+
+@pytest.fixture
+def db_path(db_path):
+    connection = sqlite3.connect(db_path)
+    connection.executescript(BASELINE_SCHEMA)
+    connection.executemany(
+        'INSERT INTO order_reconciliation (invoice, asn_uploaded, asn_filename, asn_file_data, '
+        'imei_serial_uploaded, imei_serial_filename, imei_serial_file_data) VALUES (?, 1, ?, ?, ?, ?, ?)',
+        [('INV-1', 'asn.csv', ASN, 1, 'scan.txt', SCANNED), ('INV-2', 'asn.csv', ASN, 0, None, None)]
+    )
+    connection.execute(
+        "INSERT INTO archived_orders (invoice, asn_filename, asn_file_data) VALUES ('OLD-1', 'asn.csv', ?)", (ASN,)
+    )
+    connection.commit()
+    connection.close()
+    return db_path
+
+
+def test_inline_files_move_to_shared_blobs(db):
+    session = db.get_session()
+    try:
+        blobs = {blob.sha256: blob.size for blob in session.query(db.FileBlob)}
+        applied = set(session.execute(select(db.SchemaVersion.version)).scalars())
+    finally:
+        session.close()
+    assert blobs == {hashlib.sha256(ASN).hexdigest(): len(ASN), hashlib.sha256(SCANNED).hexdigest(): len(SCANNED)}
+    assert applied == {version for version, _, _ in db.MIGRATIONS}
+
+    recon = db.get_reconciliation_status('INV-1')
+    assert (recon.asn_file_data, recon.imei_serial_file_data) == (ASN, SCANNED)
+    assert db.get_reconciliation_status('INV-2').asn_file_hash == recon.asn_file_hash
+    assert db.get_archived_order('OLD-1').asn_file_data == ASN
+
+    connection = sqlite3.connect(db.get_database_engine().url.database)
+    try:
+        inline = [
+            connection.execute(
+                f'SELECT COUNT(*) FROM {table} WHERE asn_file_data IS NOT NULL OR imei_serial_file_data IS NOT NULL'
+            ).fetchone()[0]
+            for table in ('order_reconciliation', 'archived_orders')
+        ]
+    finally:
+        connection.close()
+    assert inline == [0, 0]
+
+
+def test_backfill_indexes_migrated_orders(db):
+    assert db.get_asn_imeis('INV-1') == []
+    summary = db.backfill_imei_index()
+    assert (summary['indexed'], summary['imeis']) == (3, 6)
+    assert db.get_asn_imeis('INV-1') == ['356938035643809', '356938035643817']
+    assert db.get_reconciliation_status('INV-1').asn_imei_count == 2
+    assert db.get_reconciliation_status('INV-2').error_log.startswith("2 IMEIs already on another order's ASN")
+    assert db.backfill_imei_index()['indexed'] == 0
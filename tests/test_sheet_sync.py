@@ -0,0 +1,162 @@
+"""
+Incremental sheet sync against an in-memory fake worksheet (no network)
+
+Run with: python -m pytest tests
+"""
+
+import re
+
+import pandas as pd
+import pytest
+
+import sheet_sync
+from sheet_sync import SheetFrameCache, sync_worksheet
+
+A1_RANGE = re.compile(r'^([A-Z]*)(\d+):([A-Z]*)(\d+)$')
+
+
+class FakeWorksheet:
+    """
+    Stand-in for a gspread Worksheet holding rows of strings in memory
+
+    Mimics the API's trimming: trailing empty cells and rows are dropped from
+    batch_get results, and get_all_values() pads rows to equal width.
+    """
+
+    def __init__(self, rows, row_count=1000):
+        self.rows = rows
+        self.row_count = row_count
+        self.calls = []
+
+    @staticmethod
+    def _trim(rows):
+        trimmed = []
+        for row in rows:
+            row = list(row)
+            while row and row[-1] == '':
+                row.pop()
+            trimmed.append(row)
+        while trimmed and not trimmed[-1]:
+            trimmed.pop()
+        return trimmed
+
+    @staticmethod
+    def _column_index(letters):
+        index = 0
+        for letter in letters:
+            index = index * 26 + ord(letter) - ord('A') + 1
+        return index - 1
+
+    def get_all_values(self):
+        self.calls.append('get_all_values')
+        rows = self._trim(self.rows)
+        width = max((len(row) for row in rows), default=0)
+        return [row + [''] * (width - len(row)) for row in rows]
+
+    def batch_get(self, ranges):
+        self.calls.append(tuple(ranges))
+        results = []
+        for a1_range in ranges:
+            first_col, first_row, last_col, last_row = A1_RANGE.match(a1_range).groups()
+            rows = self.rows[int(first_row) - 1:int(last_row)]
+            if first_col:
+                rows = [row[self._column_index(first_col):self._column_index(last_col) + 1] for row in rows]
+            results.append(self._trim(rows))
+        return results
+
+
+def _sheet(orders):
+    return [['Orders', '', ''], ['INVOICE', 'MODEL', 'QTY']] + [[f'I{i}', 'M', '1'] for i in range(orders)]
+
+
+@pytest.fixture
+def snapshot(tmp_path, monkeypatch):
+    monkeypatch.setattr(sheet_sync, 'VERIFY_WINDOW_ROWS', 3)
+    monkeypatch.setattr(sheet_sync, 'FULL_SYNC_EVERY', 100)
+    return str(tmp_path / 'sheet.pkl')
+
+
+def _sync(worksheet, path, **kwargs):
+    values, info = sync_worksheet(worksheet, path, key_column='INVOICE', **kwargs)
+    assert values == worksheet.get_all_values()
+    return info['mode'], info['changed_rows']
+
+
+def test_first_sync_is_full_then_incremental(snapshot):
+    worksheet = FakeWorksheet(_sheet(10))
+    assert _sync(worksheet, snapshot) == ('full', 12)
+    assert _sync(worksheet, snapshot) == ('incremental', 0)
+
+
+def test_incremental_reads_only_header_tail_and_key_column(snapshot):
+    worksheet = FakeWorksheet(_sheet(10))
+    _sync(worksheet, snapshot)
+    worksheet.calls.clear()
+    sync_worksheet(worksheet, snapshot, key_column='INVOICE')
+    assert worksheet.calls == [('1:2', '9:1000', 'A3:A8')]
+
+
+def test_appended_and_recently_edited_rows_are_merged(snapshot):
+    rows = _sheet(10)
+    worksheet = FakeWorksheet(rows)
+    _sync(worksheet, snapshot)
+    rows.append(['I10', 'M', '5'])
+    assert _sync(worksheet, snapshot) == ('incremental', 1)
+    rows[-2][2] = '9'
+    assert _sync(worksheet, snapshot) == ('incremental', 1)
+
+
+def test_row_inserted_above_the_tail_forces_full_pull(snapshot):
+    rows = _sheet(20)
+    worksheet = FakeWorksheet(rows)
+    _sync(worksheet, snapshot)
+    rows.insert(10, ['NEW', 'M', '3'])
+    assert _sync(worksheet, snapshot)[0] == 'full'
+
+
+def test_rows_resorted_above_the_anchor_force_full_pull(snapshot):
+    rows = _sheet(20)
+    worksheet = FakeWorksheet(rows)
+    _sync(worksheet, snapshot)
+    rows[3], rows[4] = rows[4], rows[3]
+    assert _sync(worksheet, snapshot)[0] == 'full'
+
+
+def test_row_deleted_above_the_tail_forces_full_pull(snapshot):
+    rows = _sheet(20)
+    worksheet = FakeWorksheet(rows)
+    _sync(worksheet, snapshot)
+    del rows[5]
+    rows.append(['I20', 'M', '1'])  # keep the row count unchanged
+    assert _sync(worksheet, snapshot)[0] == 'full'
+
+
+def test_header_change_shrink_and_widening_force_full_pull(snapshot):
+    rows = _sheet(10)
+    worksheet = FakeWorksheet(rows)
+    _sync(worksheet, snapshot)
+    rows.pop()
+    assert _sync(worksheet, snapshot)[0] == 'full'
+    rows[-1].append('NOTE')
+    assert _sync(worksheet, snapshot)[0] == 'full'
+    rows[1][0] = 'INVOICE #'
+    assert _sync(worksheet, snapshot)[0] == 'full'
+
+
+def test_full_flag_skips_incremental_sync(snapshot):
+    worksheet = FakeWorksheet(_sheet(10))
+    _sync(worksheet, snapshot)
+    assert _sync(worksheet, snapshot, full=True)[0] == 'full'
+
+
+def test_frame_cache_manual_refresh_is_full(tmp_path):
+    requests = []
+
+    def fetch(full=False):
+        requests.append(full)
+        return pd.DataFrame({'INVOICE': ['I0']}), None
+
+    cache = SheetFrameCache(fetch, str(tmp_path / 'sheet.parquet'))
+    cache.get()
+    cache.refresh(full=True)
+    assert requests == [False, True]